@@ -57,6 +57,7 @@ BuildRequires:  python-flexmock >= 0.10.2
 BuildRequires:  python-six
 BuildRequires:  python-osbs >= 0.15
 BuildRequires:  python-backports-lzma
+BuildRequires:  python-futures
 BuildRequires:  python2-responses
 %endif # with_check
 
@@ -102,7 +103,10 @@ Requires:       python-setuptools
 Requires:       python-dockerfile-parse >= 0.0.5
 Requires:       python-docker-squash >= 1.0.0-0.3
 Requires:       python-backports-lzma
+Requires:       python-futures
 Requires:       python-jsonschema
+# zstd compression in CompressPlugin
+Requires:       python-zstandard
 # Due to CopyBuiltImageToNFSPlugin, might be moved to subpackage later.
 Requires:       nfs-utils
 Requires:       PyYAML
@@ -167,6 +171,8 @@ Requires:       python3-setuptools
 Requires:       python3-dockerfile-parse >= 0.0.5
 Requires:       python3-docker-squash >= 1.0.0-0.3
 Requires:       python3-jsonschema
+# zstd compression in CompressPlugin
+Requires:       python3-zstandard
 # Due to CopyBuiltImageToNFSPlugin, might be moved to subpackage later.
 Requires:       nfs-utils
 Requires:       python3-PyYAML
@@ -59,7 +59,8 @@ class BuildResult(object):
     def __init__(self, logs=None, fail_reason=None, image_id=None,
                  annotations=None, labels=None):
         """
-        :param logs: iterable of log lines (without newlines)
+        :param logs: iterable of log lines (without newlines), e.g.
+                     LogFile instance
         :param fail_reason: str, description of failure or None if successful
         :param image_id: str, ID of built container image
         :param annotations: dict, data captured during build step which
@@ -19,7 +19,7 @@ from atomic_reactor.api import (build_image_here, build_image_in_privileged_cont
                                 build_image_using_hosts_docker)
 from atomic_reactor.constants import CONTAINER_BUILD_JSON_PATH, DESCRIPTION, PROG
 from atomic_reactor.buildimage import BuildImageBuilder
-from atomic_reactor.inner import build_inside, BuildResults
+from atomic_reactor.inner import build_inside, resume_build, BuildResults
 from atomic_reactor.util import process_substitutions
 
 
@@ -95,6 +95,10 @@ def cli_inside_build(args):
                  substitutions=args.substitute)
 
 
+def cli_resume(args):
+    resume_build(args.checkpoint_file)
+
+
 class CLI(object):
     def __init__(self, formatter_class=argparse.HelpFormatter, prog=PROG):
         self.parser = argparse.ArgumentParser(
@@ -105,6 +109,7 @@ class CLI(object):
         self.build_parser = None
         self.bi_parser = None
         self.ib_parser = None
+        self.resume_parser = None
 
         locale.setlocale(locale.LC_ALL, '')
 
@@ -195,6 +200,17 @@ class CLI(object):
                                          "plugin_type.plugin_name.key=value)")
         self.ib_parser.set_defaults(func=cli_inside_build)
 
+        # resume build
+        self.resume_parser = subparsers.add_parser(
+            'resume',
+            usage="%s [OPTIONS] resume" % PROG,
+            description="Resume build which failed from its checkpoint: phases and "
+                        "plugins which finished before the failure are not run again. "
+                        "The checkpoint is saved when 'checkpoint_file' is set in build json.")
+        self.resume_parser.add_argument("checkpoint_file", metavar="CHECKPOINT_FILE",
+                                        help="path to checkpoint saved by the failed build")
+        self.resume_parser.set_defaults(func=cli_resume)
+
     def generate_source_types_subparsers(self):
         build_subparsers = self.build_parser.add_subparsers(help='select source provider to use',
                                                             dest='source__provider')
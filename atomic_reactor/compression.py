@@ -0,0 +1,138 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Parallel compression: data are split to blocks which are compressed
+independently in a thread pool (zlib and lzma release the GIL) and written as
+a sequence of gzip members or xz streams. Such output is a valid gzip or xz
+file, decompressing to the original data.
+"""
+
+from __future__ import unicode_literals
+
+from collections import deque
+import multiprocessing
+import zlib
+
+try:
+    # if we import "lzma" first, we get pyliblzma on Py2, but we want backports.lzma
+    #  so first try to import backports.lzma on Py2 and then 'lzma' on Py3
+    from backports import lzma
+except ImportError:
+    import lzma
+
+from concurrent.futures import ThreadPoolExecutor
+
+from atomic_reactor.util import propagate_call_counts
+
+
+DEFAULT_BLOCK_SIZE = 16 * 1024**2  # 16 MB
+GZIP_WBITS = 16 + zlib.MAX_WBITS  # zlib stream with gzip header and trailer
+
+
+def compress_gzip_block(data, level=6):
+    """
+    :return: bytes, data compressed as gzip member
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_xz_block(data, preset=6):
+    """
+    :return: bytes, data compressed as xz stream
+    """
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=preset)
+
+
+def get_default_threads():
+    """
+    :return: int, number of CPUs
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+class ParallelCompressor(object):
+    """
+    file-like object compressing data written to it in parallel
+
+    Closing it writes the rest of data, it doesn't close the underlying file.
+    """
+
+    def __init__(self, fileobj, compress_block, threads=None,
+                 block_size=DEFAULT_BLOCK_SIZE):
+        """
+        constructor
+
+        :param fileobj: file object compressed data are written to
+        :param compress_block: callable, compresses block (bytes) to
+                               standalone gzip member or xz stream, e.g.
+                               compress_gzip_block
+        :param threads: int, number of compressing threads, number of CPUs
+                        when None
+        :param block_size: int, size of uncompressed blocks in bytes
+        """
+        self.fileobj = fileobj
+        self.compress_block = compress_block
+        self.threads = threads or get_default_threads()
+        self.block_size = block_size
+        self._buffer = []
+        self._buffered = 0
+        self._pending = deque()
+        self._blocks = 0
+        self._executor = None
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed ParallelCompressor")
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.block_size:
+            block = b''.join(self._buffer)
+            for start in range(0, len(block) - self.block_size + 1, self.block_size):
+                self._submit(block[start:start + self.block_size])
+            rest = block[len(block) - len(block) % self.block_size:]
+            self._buffer = [rest] if rest else []
+            self._buffered = len(rest)
+
+    def _submit(self, block):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        self._pending.append(self._executor.submit(propagate_call_counts(self.compress_block),
+                                                   block))
+        self._blocks += 1
+        # limit memory used by blocks waiting to be written
+        while len(self._pending) > 2 * self.threads:
+            self._write_compressed()
+
+    def _write_compressed(self):
+        self.fileobj.write(self._pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._buffered or not self._blocks:
+                # empty input still has to produce valid (empty) stream
+                self._submit(b''.join(self._buffer))
+            self._buffer = []
+            while self._pending:
+                self._write_compressed()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
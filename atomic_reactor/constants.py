@@ -25,11 +25,21 @@ HOST_SECRET_PATH = ''
 
 EXPORTED_SQUASHED_IMAGE_NAME = 'image.tar'
 EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE = 'compressed.tar.{0}'
+EXPORTED_DELTA_IMAGE_NAME = 'image-delta.tar'
 
 YUM_REPOS_DIR = '/etc/yum.repos.d/'
 RELATIVE_REPOS_PATH = "atomic-reactor-repos/"
 DEFAULT_YUM_REPOFILE_NAME = 'atomic-reactor-injected.repo'
 
+# on-disk index of plugins, see atomic_reactor.plugin.PluginsIndex
+PLUGINS_INDEX_ENV = 'ATOMIC_REACTOR_PLUGINS_INDEX'
+PLUGINS_INDEX_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                                                 os.path.expanduser('~/.cache')),
+                                  'atomic-reactor', 'plugins-index.json')
+
+# max number of independent plugins run concurrently by a plugins runner
+DEFAULT_PLUGINS_MAX_WORKERS = 4
+
 # key in dictionary returned by "docker inspect" that holds the image
 # configuration (such as labels)
 INSPECT_CONFIG = "Config"
@@ -80,6 +90,21 @@ DOCKER_MAX_RETRIES = 3
 DOCKER_BACKOFF_FACTOR = 5
 # docker retries statuses
 DOCKER_CLIENT_STATUS_RETRY = [408, 500, 502, 503, 504]
+# retries of docker requests allowed regardless of number of requests
+DOCKER_RETRY_BUDGET_MIN = 10
+# additional retries of docker requests allowed per request made
+DOCKER_RETRY_BUDGET_RATIO = 0.2
+# consecutive failures (retried statuses, timeouts) after which docker
+# requests fail without being sent
+DOCKER_CIRCUIT_FAILURE_THRESHOLD = 5
+# how many seconds to wait before sending docker request again after failures
+DOCKER_CIRCUIT_RESET_TIMEOUT = 30
+# number of recent lines of docker command output kept in memory
+COMMAND_RESULT_MAX_LINES = 1000
+# max number of docker operations run concurrently by AsyncDockerTasker
+DOCKER_ASYNC_MAX_WORKERS = 4
+# max number of streamed items read ahead by AsyncDockerTasker
+DOCKER_ASYNC_MAX_QUEUED_ITEMS = 100
 # max retries for http requests
 HTTP_MAX_RETRIES = 3
 # how many seconds should wait before another try of http request
@@ -22,22 +22,32 @@ I've tried to be as much consistent (man pages were source) with docker as possi
 
 
 """
+import copy
 import os
+import random
 import shutil
 import logging
 import tempfile
+import threading
 import json
 import requests
 import time
 import docker
+from concurrent.futures import ThreadPoolExecutor
 from docker.errors import APIError
+import six
+from six.moves import queue
 
 from atomic_reactor.constants import CONTAINER_SHARE_PATH, CONTAINER_SHARE_SOURCE_SUBDIR,\
         BUILD_JSON, DOCKER_SOCKET_PATH, DOCKER_MAX_RETRIES, DOCKER_BACKOFF_FACTOR,\
-        DOCKER_CLIENT_STATUS_RETRY
+        DOCKER_CLIENT_STATUS_RETRY, DOCKER_RETRY_BUDGET_MIN, DOCKER_RETRY_BUDGET_RATIO,\
+        DOCKER_CIRCUIT_FAILURE_THRESHOLD, DOCKER_CIRCUIT_RESET_TIMEOUT, DOCKER_ASYNC_MAX_WORKERS,\
+        DOCKER_ASYNC_MAX_QUEUED_ITEMS
 from atomic_reactor.source import get_source_instance_for
+from atomic_reactor.tracing import trace_call
 from atomic_reactor.util import (
-    ImageName, wait_for_command, clone_git_repo, figure_out_dockerfile, Dockercfg)
+    ImageName, wait_for_command, clone_git_repo, figure_out_dockerfile, Dockercfg,
+    count_call, propagate_call_counts)
 
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
@@ -45,6 +55,10 @@ requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 logger = logging.getLogger(__name__)
 
+# how often background reader of AsyncDockerTasker checks whether its
+# iterator is still consumed
+_ASYNC_PUT_TIMEOUT = 0.1
+
 
 class LastLogger(object):
     """
@@ -215,39 +229,255 @@ class BuildContainerFactory(object):
         return container_id
 
 
-def retry(function, *args, **kwargs):
-    retry_times = int(kwargs.pop('retry', 0))
-    retry_delay = DOCKER_BACKOFF_FACTOR
-    retry_client_statuses = DOCKER_CLIENT_STATUS_RETRY
+class DockerUnavailableException(Exception):
+    """Docker daemon failed repeatedly, requests are not sent to it for a while"""
 
-    for counter in range(retry_times + 1):
-        try:
-            return function(*args, **kwargs)
-        except APIError as e:
-            if (e.response.status_code in retry_client_statuses and counter != retry_times):
+
+class RetryPolicy(object):
+    """
+    retrying of requests to docker daemon
+
+    Delay before n-th retry is random between 0 and backoff_factor * 2**n
+    ("full jitter"), so that clients which failed at the same time don't
+    retry at the same time. Retries are limited by budget: min_retries plus
+    retry_ratio retries per request made.
+
+    The policy also works as circuit breaker: after failure_threshold
+    consecutive failures (retried statuses, timeouts, connection errors)
+    requests fail with DockerUnavailableException without being sent. After
+    reset_timeout seconds one request is let through; the circuit is closed
+    again once a request succeeds.
+    """
+
+    def __init__(self, backoff_factor=DOCKER_BACKOFF_FACTOR,
+                 retry_statuses=DOCKER_CLIENT_STATUS_RETRY,
+                 min_retries=DOCKER_RETRY_BUDGET_MIN, retry_ratio=DOCKER_RETRY_BUDGET_RATIO,
+                 failure_threshold=DOCKER_CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout=DOCKER_CIRCUIT_RESET_TIMEOUT):
+        """
+        constructor
+
+        :param backoff_factor: float, max delay in seconds before first retry
+        :param retry_statuses: list of int, HTTP statuses of responses to retry
+        :param min_retries: int, retries allowed regardless of number of requests
+        :param retry_ratio: float, retries allowed per request made
+        :param failure_threshold: int, consecutive failures opening the circuit
+        :param reset_timeout: float, seconds before request is sent to open circuit
+        """
+        self.backoff_factor = backoff_factor
+        self.retry_statuses = retry_statuses
+        self.min_retries = min_retries
+        self.retry_ratio = retry_ratio
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.metrics = {
+            'requests': 0,
+            'failures': 0,
+            'retries': 0,
+            'retries_denied': 0,
+            'rejected': 0,
+            'circuit_opened': 0,
+        }
+
+    def get_metrics(self):
+        """
+        :return: dict, counts of requests, failures, retries, retries denied
+                 by budget, requests rejected by open circuit and how many
+                 times the circuit opened; 'circuit' is 'open' or 'closed'
+        """
+        with self._lock:
+            metrics = dict(self.metrics)
+            metrics['retry_budget'] = self._retry_budget()
+            metrics['circuit'] = 'closed' if self._opened_at is None else 'open'
+        return metrics
+
+    def _retry_budget(self):
+        return self.min_retries + int(self.retry_ratio * self.metrics['requests'])
+
+    def _start_request(self):
+        with self._lock:
+            if self._opened_at is not None:
+                if self._probing or time.time() - self._opened_at < self.reset_timeout:
+                    self.metrics['rejected'] += 1
+                    raise DockerUnavailableException(
+                        "docker daemon failed %d times in a row, not sending requests "
+                        "for %ss" % (self._consecutive_failures, self.reset_timeout))
+                # let one request find out whether docker daemon recovered
+                self._probing = True
+            self.metrics['requests'] += 1
+
+    def _finish_request(self, failed):
+        """
+        :param failed: bool, whether docker daemon failed, None if unknown
+        """
+        with self._lock:
+            self._probing = False
+            if failed:
+                self.metrics['failures'] += 1
+                self._consecutive_failures += 1
+                if (self._opened_at is not None or
+                        self._consecutive_failures >= self.failure_threshold):
+                    if self._opened_at is None:
+                        logger.warning("docker daemon failed %d times in a row, "
+                                       "opening circuit", self._consecutive_failures)
+                        self.metrics['circuit_opened'] += 1
+                    self._opened_at = time.time()
+            elif failed is not None:
+                self._consecutive_failures = 0
+                if self._opened_at is not None:
+                    logger.info("docker daemon recovered, closing circuit")
+                    self._opened_at = None
+
+    def _spend_retry(self):
+        with self._lock:
+            if self.metrics['retries'] >= self._retry_budget():
+                self.metrics['retries_denied'] += 1
+                return False
+            self.metrics['retries'] += 1
+            return True
+
+    def call(self, function, *args, **kwargs):
+        """
+        call function, retrying it on responses with retried statuses
+
+        :param function: callable making request to docker daemon
+        :param retry: int, max number of retries
+        :return: result of function
+        """
+        retry_times = int(kwargs.pop('retry', 0))
+
+        for counter in range(retry_times + 1):
+            self._start_request()
+            try:
+                result = function(*args, **kwargs)
+            except APIError as e:
+                retriable = e.response is not None and \
+                    e.response.status_code in self.retry_statuses
+                self._finish_request(retriable)
+                if not retriable or counter == retry_times or not self._spend_retry():
+                    raise
                 logger.info("retrying %s on %s", function, e.response.status_code)
-                time.sleep(retry_delay * (2 ** counter))
-            else:
+                count_call('docker_retry')
+                time.sleep(random.uniform(0, self.backoff_factor * (2 ** counter)))
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                self._finish_request(True)
                 raise
+            except BaseException:
+                self._finish_request(None)
+                raise
+            else:
+                self._finish_request(False)
+                return result
+
+
+_retry_policies = {}
+_retry_policies_lock = threading.Lock()
+
+
+def get_retry_policy(base_url):
+    """
+    get RetryPolicy shared by all clients of docker daemon
+
+    :param base_url: str, URL of docker daemon
+    :return: RetryPolicy instance
+    """
+    with _retry_policies_lock:
+        if base_url not in _retry_policies:
+            _retry_policies[base_url] = RetryPolicy()
+        return _retry_policies[base_url]
+
+
+def get_retry_metrics():
+    """
+    :return: dict, docker daemon URL -> metrics of its RetryPolicy
+    """
+    with _retry_policies_lock:
+        policies = dict(_retry_policies)
+    return dict((base_url, policy.get_metrics()) for base_url, policy in policies.items())
+
+
+def retry(function, *args, **kwargs):
+    """
+    call function making request to docker daemon, retrying it on failure
+
+    :param function: callable
+    :param retry: int, max number of retries
+    :param retry_policy: RetryPolicy instance, new one is used if not specified
+    :return: result of function
+    """
+    retry_policy = kwargs.pop('retry_policy', None) or RetryPolicy()
+    return retry_policy.call(function, *args, **kwargs)
+
+
+_docker_clients = {}
+_docker_api_versions = {}
+_docker_clients_lock = threading.Lock()
+
+
+def get_docker_client(**kwargs):
+    """
+    get docker client shared by all users with the same arguments
+
+    clients of docker-py are thread-safe; sharing them saves connections
+    and, with version='auto', a request for API version of daemon, which is
+    then remembered for clients with other arguments as well
+
+    :param kwargs: arguments for docker.APIClient
+    :return: docker.APIClient instance
+    """
+    base_url = kwargs.get('base_url')
+    key = tuple(sorted(kwargs.items()))
+    with _docker_clients_lock:
+        client = _docker_clients.get(key)
+        if client is None:
+            if kwargs.get('version') == 'auto' and base_url in _docker_api_versions:
+                kwargs['version'] = _docker_api_versions[base_url]
+            try:
+                # docker-py 2.x
+                client = docker.APIClient(**kwargs)
+            except AttributeError:
+                # docker-py 1.x
+                client = docker.Client(**kwargs)
+            _docker_clients[key] = client
+
+            api_version = getattr(client, 'api_version', None)
+            if kwargs.get('version') == 'auto' and isinstance(api_version, six.string_types):
+                _docker_api_versions[base_url] = api_version
+        return client
+
+
+def clear_docker_clients():
+    """
+    forget shared docker clients, following get_docker_client() calls
+    create new ones
+    """
+    with _docker_clients_lock:
+        _docker_clients.clear()
+        _docker_api_versions.clear()
 
 
 class WrappedDocker(object):
     def __init__(self, **kwargs):
         self.retry_times = kwargs.pop('retry', None)
+        self.wrapped = get_docker_client(**kwargs)
 
-        try:
-            # docker-py 2.x
-            self.wrapped = docker.APIClient(**kwargs)
-        except AttributeError:
-            # docker-py 1.x
-            self.wrapped = docker.Client(**kwargs)
+        self.retry_policy = get_retry_policy(getattr(self.wrapped, 'base_url', None))
 
     def __getattr__(self, attr):
         orig_attr = getattr(self.wrapped, attr)
 
         if callable(orig_attr):
             def hooked(*args, **kwargs):
-                return retry(orig_attr, *args, retry=self.retry_times, **kwargs)
+                count_call('docker')
+                # span of streaming call ends when the stream is exhausted
+                return trace_call(attr, 'docker', retry, orig_attr, *args,
+                                  retry=self.retry_times, retry_policy=self.retry_policy,
+                                  **kwargs)
             return hooked
         else:
             return orig_attr
@@ -276,6 +506,74 @@ class DockerTasker(LastLogger):
 
         self.d = WrappedDocker(**client_kwargs)
 
+        # metadata of images: inspect results keyed by image ID or name and
+        # index of `docker images` output, see invalidate_image_cache()
+        self._image_cache_lock = threading.Lock()
+        self._inspect_cache = {}
+        self._images_index = None
+        # bumped on invalidation, metadata fetched from docker meanwhile
+        # may be stale and are not cached
+        self._image_cache_generation = 0
+
+    def invalidate_image_cache(self):
+        """
+        forget cached metadata of images
+
+        has to be called after images are changed (built, pulled, tagged,
+        removed, ...) other than through methods of this class
+        """
+        with self._image_cache_lock:
+            self._inspect_cache = {}
+            self._images_index = None
+            self._image_cache_generation += 1
+
+    def _invalidate_after(self, response):
+        try:
+            for item in response:
+                yield item
+        finally:
+            self.invalidate_image_cache()
+
+    def _get_images_index(self):
+        """
+        :return: tuple, dicts: image ID -> image info and
+                 repository (name without tag) -> list of image infos
+        """
+        with self._image_cache_lock:
+            if self._images_index is not None:
+                return self._images_index
+            generation = self._image_cache_generation
+
+        by_id = {}
+        by_repository = {}
+        for image_info in self.d.images():
+            by_id[image_info['Id']] = image_info
+            for repotag in image_info.get('RepoTags') or []:
+                if repotag == '<none>:<none>':
+                    continue
+                repository = ImageName.parse(repotag).to_str(tag=False)
+                repository_images = by_repository.setdefault(repository, [])
+                # image may have several tags in the same repository
+                if image_info not in repository_images:
+                    repository_images.append(image_info)
+
+        with self._image_cache_lock:
+            if generation == self._image_cache_generation:
+                self._images_index = (by_id, by_repository)
+        return by_id, by_repository
+
+    def _inspect_image(self, image_id):
+        with self._image_cache_lock:
+            image_metadata = self._inspect_cache.get(image_id)
+            generation = self._image_cache_generation
+        if image_metadata is None:
+            image_metadata = self.d.inspect_image(image_id)
+            if image_metadata is not None:
+                with self._image_cache_lock:
+                    if generation == self._image_cache_generation:
+                        self._inspect_cache[image_id] = image_metadata
+                        self._inspect_cache[image_metadata['Id']] = image_metadata
+        return copy.deepcopy(image_metadata)
 
     def build_image_from_path(self, path, image, stream=False, use_cache=False, remove_im=True):
         """
@@ -301,7 +599,8 @@ class DockerTasker(LastLogger):
             response = self.d.build(path=path, tag=image.to_str(), stream=stream,
                                     nocache=not use_cache, decode=True,
                                     rm=remove_im, forcerm=True,)  # returns generator
-        return response
+        self.invalidate_image_cache()
+        return self._invalidate_after(response)
 
     def build_image_from_git(self, url, image, git_path=None, git_commit=None,
                              copy_dockerfile_to=None,
@@ -397,6 +696,7 @@ class DockerTasker(LastLogger):
             tag = image.tag
             image = image.to_str(tag=False)
         response = self.d.commit(container_id, repository=image, tag=tag, message=message)
+        self.invalidate_image_cache()
         logger.debug("response = '%s'", response)
         try:
             return response['Id']
@@ -420,14 +720,14 @@ class DockerTasker(LastLogger):
         #  u'RepoTags': [u'buildroot-fedora:latest'],
         #  u'Size': 0,
         #  u'VirtualSize': 856564160}
-        images = self.d.images()
+        by_id, _ = self._get_images_index()
         try:
-            image_dict = [i for i in images if i['Id'] == image_id][0]
-        except IndexError:
+            image_dict = by_id[image_id]
+        except KeyError:
             logger.info("image not found")
             return None
         else:
-            return image_dict
+            return copy.deepcopy(image_dict)
 
     def get_image_info_by_image_name(self, image, exact_tag=True):
         """
@@ -448,17 +748,18 @@ class DockerTasker(LastLogger):
         #  u'RepoTags': [u'buildroot-fedora:latest'],
         #  u'Size': 0,
         #  u'VirtualSize': 856564160}
-        images = self.d.images(name=image.to_str(tag=False))
+        _, by_repository = self._get_images_index()
+        images = by_repository.get(image.to_str(tag=False), [])
         if exact_tag:
             # tag is specified, we are looking for the exact image
             for found_image in images:
                 if image.to_str(explicit_tag=True) in found_image['RepoTags']:
                     logger.debug("image '%s' found", image)
-                    return [found_image]
+                    return [copy.deepcopy(found_image)]
             images = []  # image not found
 
         logger.debug("%d matching images found", len(images))
-        return images
+        return copy.deepcopy(images)
 
     def pull_image(self, image, insecure=False):
         """
@@ -476,7 +777,7 @@ class DockerTasker(LastLogger):
         except TypeError:
             # because changing api is fun
             logs_gen = self.d.pull(image.to_str(tag=False), tag=image.tag, decode=True, stream=True)
-        command_result = wait_for_command(logs_gen)
+        command_result = wait_for_command(self._invalidate_after(logs_gen))
         self.last_logs = command_result.logs
         return image.to_str()
 
@@ -500,6 +801,7 @@ class DockerTasker(LastLogger):
                 target_image.to_str(tag=False),
                 tag=target_image.tag,
                 force=force)  # returns True/False
+            self.invalidate_image_cache()
             if not response:
                 logger.error("failed to tag image")
                 raise RuntimeError("Failed to tag image '%s': target_image = '%s'" %
@@ -539,7 +841,7 @@ class DockerTasker(LastLogger):
 
         :param image: ImageName
         :param insecure: bool, allow connecting to registry over plain http
-        :return: str, logs from push
+        :return: list of dicts, decoded items of push output
         """
         logger.info("pushing image '%s'", image)
         logger.debug("image: '%s', insecure: '%s'", image, insecure)
@@ -552,7 +854,8 @@ class DockerTasker(LastLogger):
             # because changing api is fun
             logs = self.d.push(image.to_str(tag=False), tag=image.tag, decode=True, stream=True)
 
-        command_result = wait_for_command(logs)
+        # pushing adds digests to the image
+        command_result = wait_for_command(self._invalidate_after(logs))
         self.last_logs = command_result.logs
         if command_result.is_failed():
             detail = command_result.error_detail
@@ -582,6 +885,8 @@ class DockerTasker(LastLogger):
         """
         return detailed metadata about provided image (see 'man docker-inspect')
 
+        metadata are cached until images are changed, see invalidate_image_cache()
+
         :param image_id: str or ImageName, id or name of the image
         :return: dict
         """
@@ -589,8 +894,7 @@ class DockerTasker(LastLogger):
         logger.debug("image_id = '%s'", image_id)
         if isinstance(image_id, ImageName):
             image_id = image_id.to_str()
-        image_metadata = self.d.inspect_image(image_id)
-        return image_metadata
+        return self._inspect_image(image_id)
 
     def remove_image(self, image_id, force=False, noprune=False):
         """
@@ -605,7 +909,10 @@ class DockerTasker(LastLogger):
         logger.debug("image_id = '%s'", image_id)
         if isinstance(image_id, ImageName):
             image_id = image_id.to_str()
-        self.d.remove_image(image_id, force=force, noprune=noprune)  # returns None
+        try:
+            self.d.remove_image(image_id, force=force, noprune=noprune)  # returns None
+        finally:
+            self.invalidate_image_cache()
 
     def remove_container(self, container_id, force=False):
         """
@@ -660,8 +967,10 @@ class DockerTasker(LastLogger):
         """
         logger.info("checking whether image '%s' exists", image_id)
         logger.debug("image_id = '%s'", image_id)
+        if isinstance(image_id, ImageName):
+            image_id = image_id.to_str()
         try:
-            response = self.d.inspect_image(image_id)
+            response = self._inspect_image(image_id)
         except APIError as ex:
             logger.warning(repr(ex))
             response = False
@@ -721,3 +1030,167 @@ class DockerTasker(LastLogger):
                 logger.debug("ignoring a conflict when removing volume %s", volume_name)
             else:
                 raise ex
+
+
+class AsyncDockerTasker(object):
+    """
+    runs operations of DockerTasker in background threads, so that many of
+    them can be sent to docker daemon at once
+
+    methods return concurrent.futures.Future instances, streaming methods
+    return iterators filled in background; all operations share connections,
+    retry policy and image metadata cache of the wrapped DockerTasker
+
+    Operations run in a thread pool rather than as asyncio coroutines:
+    atomic-reactor still supports Python 2, which has no asyncio, and
+    docker-py is a blocking client. On Python 3 the futures can be awaited
+    with asyncio.wrap_future().
+
+    >>> with AsyncDockerTasker(tasker) as async_tasker:
+    ...     futures = [async_tasker.remove_image(image) for image in images]
+    ...     concurrent.futures.wait(futures)
+    """
+
+    def __init__(self, tasker=None, max_workers=DOCKER_ASYNC_MAX_WORKERS,
+                 max_queued=DOCKER_ASYNC_MAX_QUEUED_ITEMS):
+        """
+        constructor
+
+        :param tasker: DockerTasker instance, new one is created when None
+        :param max_workers: int, max number of operations running at once
+        :param max_queued: int, max number of items of streaming operation
+                           read before they are consumed
+        """
+        self.tasker = tasker or DockerTasker()
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def shutdown(self, wait=True):
+        """
+        stop accepting operations
+
+        :param wait: bool, wait for running operations to finish
+        """
+        self._executor.shutdown(wait=wait)
+
+    def submit(self, function, *args, **kwargs):
+        """
+        run function in background
+
+        :param function: callable, usually method of the wrapped DockerTasker
+        :return: Future instance
+        """
+        return self._executor.submit(propagate_call_counts(function), *args, **kwargs)
+
+    def _stream(self, function, *args, **kwargs):
+        """
+        iterate over items returned by function, reading them in background
+
+        exception raised by function is re-raised by the iterator; reading
+        stops when the iterator is closed or garbage collected
+        """
+        items = queue.Queue(maxsize=self.max_queued)
+        end = object()
+        # set when the iterator isn't consumed any more
+        done = threading.Event()
+
+        def put(item):
+            while not done.is_set():
+                try:
+                    items.put(item, timeout=_ASYNC_PUT_TIMEOUT)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def read():
+            try:
+                for item in function(*args, **kwargs):
+                    if not put((item, None)):
+                        return
+            except Exception as ex:
+                put((end, ex))
+            else:
+                put((end, None))
+
+        def iterate():
+            try:
+                while True:
+                    item, error = items.get()
+                    if item is end:
+                        if error is not None:
+                            raise error
+                        return
+                    yield item
+            finally:
+                done.set()
+
+        self._executor.submit(propagate_call_counts(read))
+        return iterate()
+
+    def pull_image(self, image, insecure=False):
+        """
+        see DockerTasker.pull_image()
+
+        :return: Future, result is str, image (reg.om/img:v1)
+        """
+        return self.submit(self.tasker.pull_image, image, insecure=insecure)
+
+    def push_image(self, image, insecure=False):
+        """
+        see DockerTasker.push_image()
+
+        :return: Future, result is list of decoded items of push output
+        """
+        return self.submit(self.tasker.push_image, image, insecure=insecure)
+
+    def tag_image(self, image, target_image, force=False):
+        """
+        see DockerTasker.tag_image()
+
+        :return: Future, result is str, image (reg.om/img:v1)
+        """
+        return self.submit(self.tasker.tag_image, image, target_image, force=force)
+
+    def inspect_image(self, image_id):
+        """
+        see DockerTasker.inspect_image()
+
+        :return: Future, result is dict
+        """
+        return self.submit(self.tasker.inspect_image, image_id)
+
+    def remove_image(self, image_id, force=False, noprune=False):
+        """
+        see DockerTasker.remove_image()
+
+        :return: Future, result is None
+        """
+        return self.submit(self.tasker.remove_image, image_id, force=force, noprune=noprune)
+
+    def logs(self, container_id, stderr=True, stream=True):
+        """
+        see DockerTasker.logs()
+
+        :return: iterator of output when stream is True, otherwise Future,
+                 result is list of strings
+        """
+        if stream:
+            return self._stream(self.tasker.logs, container_id, stderr=stderr, stream=True)
+        return self.submit(self.tasker.logs, container_id, stderr=stderr, stream=False)
+
+    def wait(self, container_id):
+        """
+        see DockerTasker.wait()
+
+        :return: Future, result is int, exit code
+        """
+        return self.submit(self.tasker.wait, container_id)
+
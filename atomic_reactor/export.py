@@ -0,0 +1,267 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Exporting images: fan-out of a stream to several consumers and processing of
+image tarballs exported by 'docker save'.
+
+With tee(), data are read from the stream once and every chunk is handed to
+all consumers, which run concurrently, each in its own thread, reading from
+a file-like object. Queues between the reader and consumers are bounded, so
+the reader waits for the slowest consumer instead of keeping the whole stream
+in memory.
+
+Delta image is the exported tarball without layers of the base image: layer
+directories, manifest and config are kept, only their layer.tar members are
+left out, as registries and Pulp already have those layers. Layers are
+identified by manifest.json, which 'docker save' puts at the end of the
+tarball, so the delta image is made from the saved tarball, not the stream.
+"""
+
+from __future__ import unicode_literals
+
+import json
+import logging
+import tarfile
+import threading
+
+from six.moves import queue
+
+from atomic_reactor.tracing import span
+from atomic_reactor.util import propagate_call_counts
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1024**2  # 1 MB
+DEFAULT_MAX_QUEUED_CHUNKS = 16
+TAR_BLOCK_SIZE = 512
+
+# how often the reader checks whether a consumer waited for stopped
+_PUT_TIMEOUT = 0.1
+
+
+class TeeReader(object):
+    """
+    file-like object with data of the teed stream, passed to a consumer
+    """
+
+    def __init__(self, max_queued=DEFAULT_MAX_QUEUED_CHUNKS):
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._buffer = b''
+        self._eof = False
+        # set when the consumer stops reading
+        self.done = False
+
+    def _feed(self, chunk):
+        """
+        add chunk of data, b'' marks end of the stream
+
+        :return: bool, False when consumer doesn't read any more
+        """
+        while not self.done:
+            try:
+                self._queue.put(chunk, timeout=_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._queue.get()
+            if not chunk:
+                self._eof = True
+            self._buffer += chunk
+            if self._buffer and size >= 0:
+                # don't wait for more data than needed
+                break
+
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def tee(stream, consumers, chunk_size=DEFAULT_CHUNK_SIZE,
+        max_queued=DEFAULT_MAX_QUEUED_CHUNKS):
+    """
+    read stream once and pass its data to all consumers concurrently
+
+    When a consumer fails, the rest of consumers still get the whole stream;
+    the exception is re-raised once all of them finish.
+
+    :param stream: file-like object to read
+    :param consumers: dict, name -> callable taking TeeReader instance
+    :param chunk_size: int, size of chunks read from stream
+    :param max_queued: int, max number of chunks waiting for each consumer
+    :return: dict, name -> result of consumer
+    """
+    results = {}
+    errors = []
+    readers = {}
+    threads = []
+
+    def consume(name, consumer, reader):
+        try:
+            with span(name, 'export'):
+                results[name] = consumer(reader)
+        except Exception as ex:
+            logger.error("export consumer %s failed: %r", name, ex)
+            errors.append(ex)
+        finally:
+            reader.done = True
+
+    for name, consumer in consumers.items():
+        reader = readers[name] = TeeReader(max_queued=max_queued)
+        thread = threading.Thread(target=propagate_call_counts(consume),
+                                  args=(name, consumer, reader),
+                                  name='export-{0}'.format(name))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    chunk = None
+    try:
+        while chunk != b'':
+            chunk = stream.read(chunk_size)
+            active = [reader._feed(chunk) for reader in readers.values()]
+            if not any(active):
+                break
+    finally:
+        if chunk != b'':
+            # make sure consumers are not left waiting for data
+            for reader in readers.values():
+                reader._feed(b'')
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return results
+
+
+def read_exactly(stream, size):
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def copy_stream(stream, fp, size=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    copy data from stream to fp
+
+    :param size: int, number of bytes to copy, everything when None
+    :return: int, number of bytes copied
+    """
+    copied = 0
+    while size is None or copied < size:
+        to_read = chunk_size if size is None else min(chunk_size, size - copied)
+        data = stream.read(to_read)
+        if not data:
+            break
+        fp.write(data)
+        copied += len(data)
+    return copied
+
+
+def tar_member_size(header):
+    size_field = bytearray(header[124:136])
+    if size_field[0] & 0x80:
+        # GNU base-256 encoding
+        size = size_field[0] & 0x7f
+        for byte in size_field[1:]:
+            size = (size << 8) + byte
+        return size
+    size_field = bytes(size_field).rstrip(b'\0 ').strip()
+    return int(size_field, 8) if size_field else 0
+
+
+def tar_member_name(header):
+    """
+    :return: str, name of tar member; long names (GNU or pax extensions)
+             aren't supported, 'docker save' doesn't use them
+    """
+    return header[:100].rstrip(b'\0').decode('utf-8')
+
+
+def is_layer_member(header):
+    """
+    is tar member layer tarball of image exported by 'docker save'?
+    """
+    name = header[:100].rstrip(b'\0')
+    return name.endswith(b'/layer.tar') and header[156:157] in (b'0', b'\0')
+
+
+def get_base_diff_ids(base_image_inspect, image_inspect):
+    """
+    find layers of image which come from its base image
+
+    :param base_image_inspect: dict, inspection of base image
+    :param image_inspect: dict, inspection of built image
+    :return: list of str, diff IDs of layers shared with base image
+    """
+    base_layers = (base_image_inspect.get('RootFS') or {}).get('Layers') or []
+    layers = (image_inspect.get('RootFS') or {}).get('Layers') or []
+    if layers[:len(base_layers)] != base_layers:
+        # e.g. squashed image
+        logger.info("image isn't built on top of base image layers")
+        return []
+    return base_layers
+
+
+def get_layer_diff_ids(image_tar):
+    """
+    :param image_tar: tarfile.TarFile, image tarball exported by 'docker save'
+    :return: dict, name of layer.tar member -> diff ID of the layer
+    """
+    manifest = json.loads(image_tar.extractfile('manifest.json').read().decode('utf-8'))
+    diff_ids = {}
+    for image in manifest:
+        config = json.loads(image_tar.extractfile(image['Config']).read().decode('utf-8'))
+        diff_ids.update(zip(image['Layers'], config['rootfs']['diff_ids']))
+    return diff_ids
+
+
+def write_delta_image(image_file, fileobj, omit_diff_ids):
+    """
+    copy image tarball exported by 'docker save', leaving out layer.tar
+    members of layers with given diff IDs
+
+    Diff IDs of layers are looked up in manifest.json and image config before
+    anything is copied, so data of omitted layers are neither read nor written.
+
+    :param image_file: seekable file object, image tarball
+    :param fileobj: file object the delta image is written to
+    :param omit_diff_ids: list of str, diff IDs of layers to leave out
+    :return: list of str, diff IDs of layers which were left out
+    """
+    omit_diff_ids = set(omit_diff_ids)
+    with tarfile.open(fileobj=image_file, mode='r:') as image_tar:
+        layer_diff_ids = get_layer_diff_ids(image_tar) if omit_diff_ids else {}
+        members = image_tar.getmembers()
+
+    omitted = []
+    for member in members:
+        diff_id = layer_diff_ids.get(member.name)
+        if diff_id in omit_diff_ids:
+            omitted.append(diff_id)
+            continue
+        # raw copy keeps headers (including extended ones) as they are
+        end = member.offset_data + -(-member.size // TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+        image_file.seek(member.offset)
+        if copy_stream(image_file, fileobj, end - member.offset) != end - member.offset:
+            raise RuntimeError('Unexpected end of image tarball')
+    # end of archive
+    fileobj.write(2 * TAR_BLOCK_SIZE * b'\0')
+
+    return omitted
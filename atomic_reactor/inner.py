@@ -11,11 +11,15 @@ Script for building docker image. This is expected to run inside container.
 
 import json
 import logging
+import os
+import pickle
 import tempfile
 import signal
+import time
 import docker
 
 from atomic_reactor.build import InsideBuilder
+from atomic_reactor.constants import DEFAULT_PLUGINS_MAX_WORKERS
 from atomic_reactor.plugin import (
     AutoRebuildCanceledException,
     BuildCanceledException,
@@ -28,7 +32,9 @@ from atomic_reactor.plugin import (
     PrePublishPluginsRunner,
 )
 from atomic_reactor.source import get_source_instance_for
-from atomic_reactor.util import ImageName
+from atomic_reactor.prefetch import Prefetcher, set_prefetcher
+from atomic_reactor.tracing import Tracer, set_tracer, span
+from atomic_reactor.util import ChecksumsCache, ImageName, set_checksums_cache
 from atomic_reactor.build import BuildResult
 from atomic_reactor import get_logging_encoding
 
@@ -267,10 +273,28 @@ class DockerBuildWorkflow(object):
     6. push it to registries
     """
 
+    CHECKPOINT_VERSION = 1
+    # workflow attributes saved in checkpoint
+    CHECKPOINT_STATE = ['source', 'prebuild_results', 'buildstep_result', 'prepub_results',
+                        'postbuild_results', 'build_result', 'plugin_workspace',
+                        'plugins_timestamps', 'plugins_durations', 'plugins_resource_usage',
+                        'built_image_inspect', '_base_image_inspect', 'pulled_base_images',
+                        'exported_image_sequence', 'tag_conf', 'push_conf', 'files',
+                        'build_log_path']
+    # builder attributes saved in checkpoint
+    CHECKPOINT_BUILDER_STATE = ['image_id', 'base_image', 'base_image_id', 'built_image_info']
+    # plugins of these phases which finished successfully aren't run again on resume
+    PHASE_RESULTS = {
+        'prebuild': 'prebuild_results',
+        'prepublish': 'prepub_results',
+        'postbuild': 'postbuild_results',
+    }
+
     def __init__(self, source, image, prebuild_plugins=None, prepublish_plugins=None,
                  postbuild_plugins=None, exit_plugins=None, plugin_files=None,
                  openshift_build_selflink=None, client_version=None,
-                 buildstep_plugins=None, **kwargs):
+                 buildstep_plugins=None, plugins_max_workers=DEFAULT_PLUGINS_MAX_WORKERS,
+                 trace_file=None, checkpoint_file=None, build_timeout=None, **kwargs):
         """
         :param source: dict, where/how to get source code to put in image
         :param image: str, tag for built image ([registry/]image_name[:tag])
@@ -282,6 +306,16 @@ class DockerBuildWorkflow(object):
             on openshift) without the actual hostname/IP address
         :param client_version: str, osbs-client version used to render build json
         :param buildstep_plugins: dict, arguments for build-step plugins
+        :param plugins_max_workers: int, max number of plugins of the same type
+            to run concurrently
+        :param trace_file: str, path where trace of the build (in Chrome trace
+            event format) is written once all plugins finished; the build is
+            traced only when it's set
+        :param checkpoint_file: str, path where state of the build is saved after
+            each phase; when the build fails, its workdir is kept so that the
+            build can be resumed, see from_checkpoint()
+        :param build_timeout: float, seconds in which all plugins except exit
+            plugins have to finish, they are interrupted otherwise
         """
         self.source = get_source_instance_for(source, tmpdir=tempfile.mkdtemp())
         self.image = image
@@ -297,14 +331,29 @@ class DockerBuildWorkflow(object):
         self.prepub_results = {}
         self.exit_results = {}
         self.build_result = BuildResult(fail_reason="not built")
+        # file with output of docker build read by exit plugins through
+        # build_result.logs, it's removed at the end of the build
+        self.build_log_path = None
         self.plugin_workspace = {}
         self.plugins_timestamps = {}
         self.plugins_durations = {}
+        self.plugins_resource_usage = {}
         self.plugins_errors = {}
         self.autorebuild_canceled = False
         self.build_canceled = False
         self.plugin_failed = False
         self.plugin_files = plugin_files
+        self.plugins_max_workers = plugins_max_workers
+        self.trace_file = trace_file
+        # spans are collected only when they are written somewhere
+        self.tracer = Tracer() if trace_file else None
+        self.prefetcher = Prefetcher()
+        self.checksums_cache = ChecksumsCache()
+        self.checkpoint_file = checkpoint_file
+        self.build_timeout = build_timeout
+        # phases finished before checkpoint, see get_resumed_plugins_conf()
+        self.completed_phases = []
+        self._resumed_builder_state = {}
 
         self.kwargs = kwargs
 
@@ -320,6 +369,9 @@ class DockerBuildWorkflow(object):
         #  member of this structure. Example:
         #  [{'path': '/tmp/foo.tar', 'size': 12345678, 'md5sum': '<md5>', 'sha256sum': '<sha256>'}]
         #  You can use util.get_exported_image_metadata to create a dict to append to this list.
+        #  Plugins writing the tarball should rather compute checksums as they write it, see
+        #  util.ChecksumFile, so that plugins using it (koji_upload, koji_promote) don't have
+        #  to read it again.
         self.exported_image_sequence = []
 
         self.tag_conf = TagConf()
@@ -330,6 +382,7 @@ class DockerBuildWorkflow(object):
         self.files = {}
 
         self.openshift_build_selflink = openshift_build_selflink
+        self.client_version = client_version
 
         if client_version:
             logger.debug("build json was built by osbs-client %s", client_version)
@@ -344,6 +397,14 @@ class DockerBuildWorkflow(object):
         """
         return self.build_result.is_failed() or self.plugin_failed
 
+    @property
+    def keeps_checkpoint(self):
+        """
+        Will the build be resumable from checkpoint_file? Built image and
+        pulled base images have to be kept then.
+        """
+        return bool(self.checkpoint_file) and self.build_process_failed
+
     # inspect base image lazily just before it's needed - pre plugins may change the base image
     @property
     def base_image_inspect(self):
@@ -361,6 +422,184 @@ class DockerBuildWorkflow(object):
         self.build_canceled = True
         raise BuildCanceledException("Build was canceled")
 
+    def write_trace(self):
+        """
+        write trace of the build to trace_file, if requested
+        """
+        if self.tracer is None:
+            return
+        try:
+            self.tracer.write(self.trace_file)
+        except (IOError, OSError) as ex:
+            logger.warning("failed to write trace to %s: %s", self.trace_file, ex)
+        else:
+            logger.info("trace of the build written to %s", self.trace_file)
+
+    def get_build_json(self):
+        """
+        build json which creates workflow configured the same way as this one
+
+        :return: dict
+        """
+        source = {
+            'provider': self.source.provider,
+            'uri': self.source.uri,
+        }
+        if self.source.dockerfile_path:
+            source['dockerfile_path'] = self.source.dockerfile_path
+        if self.source.provider_params:
+            source['provider_params'] = self.source.provider_params
+
+        build_json = dict(self.kwargs)
+        build_json.update({
+            'source': source,
+            'image': self.image,
+            'prebuild_plugins': self.prebuild_plugins_conf,
+            'buildstep_plugins': self.buildstep_plugins_conf,
+            'prepublish_plugins': self.prepublish_plugins_conf,
+            'postbuild_plugins': self.postbuild_plugins_conf,
+            'exit_plugins': self.exit_plugins_conf,
+            'plugin_files': self.plugin_files,
+            'openshift_build_selflink': self.openshift_build_selflink,
+            'client_version': self.client_version,
+            'plugins_max_workers': self.plugins_max_workers,
+            'trace_file': self.trace_file,
+            'checkpoint_file': self.checkpoint_file,
+            'build_timeout': self.build_timeout,
+        })
+        return build_json
+
+    @staticmethod
+    def _is_picklable(value):
+        try:
+            pickle.dumps(value, protocol=2)
+        except Exception:
+            return False
+        return True
+
+    def save_checkpoint(self, completed_phase=None):
+        """
+        save state of the build to checkpoint_file (if set)
+
+        :param completed_phase: str, phase which just finished
+        """
+        if completed_phase:
+            self.completed_phases.append(completed_phase)
+        if not self.checkpoint_file:
+            return
+
+        state = {}
+        for attr in self.CHECKPOINT_STATE:
+            value = getattr(self, attr)
+            if attr in self.PHASE_RESULTS.values():
+                # plugins with results which can't be saved are run again
+                value = dict((key, result) for key, result in value.items()
+                             if self._is_picklable(result))
+            state[attr] = value
+        builder_state = {}
+        if self.builder is not None:
+            builder_state = dict((attr, getattr(self.builder, attr, None))
+                                 for attr in self.CHECKPOINT_BUILDER_STATE)
+        checkpoint = {
+            'version': self.CHECKPOINT_VERSION,
+            'build_json': self.get_build_json(),
+            'completed_phases': self.completed_phases,
+            'state': state,
+            'builder': builder_state,
+        }
+
+        tmp_file = self.checkpoint_file + '.tmp'
+        try:
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(checkpoint, f, protocol=2)
+            os.rename(tmp_file, self.checkpoint_file)
+        except Exception as ex:
+            logger.warning("failed to save checkpoint to %s: %r", self.checkpoint_file, ex)
+        else:
+            logger.debug("checkpoint saved to %s, completed phases: %s",
+                         self.checkpoint_file, self.completed_phases)
+
+    def remove_checkpoint(self):
+        """
+        remove checkpoint_file (if set), there's nothing to resume
+        """
+        if self.checkpoint_file and os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint_file):
+        """
+        create workflow resuming build from checkpoint
+
+        phases which finished before the checkpoint are skipped, as well as
+        plugins which finished successfully in the phase which failed; exit
+        plugins are always run
+
+        :param checkpoint_file: str, path to checkpoint saved by failed build
+        :return: DockerBuildWorkflow instance
+        """
+        with open(checkpoint_file, 'rb') as f:
+            checkpoint = pickle.load(f)
+        if checkpoint.get('version') != cls.CHECKPOINT_VERSION:
+            raise RuntimeError("unsupported checkpoint version: %s" %
+                               checkpoint.get('version'))
+
+        workflow = cls(**checkpoint['build_json'])
+        # use workdir of the failed build
+        workflow.source.remove_tmpdir()
+        for attr, value in checkpoint['state'].items():
+            setattr(workflow, attr, value)
+        workflow.completed_phases = checkpoint['completed_phases']
+        workflow._resumed_builder_state = checkpoint['builder']
+        logger.info("resuming build from checkpoint %s, completed phases: %s",
+                    checkpoint_file, workflow.completed_phases)
+        return workflow
+
+    def get_resumed_plugins_conf(self, phase, plugins_conf):
+        """
+        drop plugins which finished before checkpoint
+
+        :param phase: str, phase of plugins, key of PHASE_RESULTS
+        :param plugins_conf: list of dicts, plugins requested for the phase
+        :return: list of dicts, plugins which need to be run
+        """
+        if phase in self.completed_phases:
+            return []
+
+        results = getattr(self, self.PHASE_RESULTS[phase])
+        if not plugins_conf or not results:
+            return plugins_conf
+
+        def finished(plugin):
+            try:
+                result = results[plugin['name']]
+            except (TypeError, KeyError):
+                return False
+            return not isinstance(result, Exception)
+
+        return [plugin for plugin in plugins_conf if not finished(plugin)]
+
+    def remove_build_log(self):
+        """
+        remove file with output of docker build (if any)
+        """
+        if self.build_log_path and os.path.exists(self.build_log_path):
+            os.remove(self.build_log_path)
+        self.build_log_path = None
+
+    def discard_built_image_state(self):
+        """
+        forget everything done with the image built before checkpoint, so that
+        it is built, tested and published again
+        """
+        self.completed_phases = [phase for phase in self.completed_phases
+                                 if phase == 'prebuild']
+        self.prepub_results = {}
+        self.postbuild_results = {}
+        self.exported_image_sequence = []
+        self.built_image_inspect = None
+        self.push_conf = PushConf()
+
     def build_docker_image(self):
         """
         build docker image
@@ -368,15 +607,30 @@ class DockerBuildWorkflow(object):
         :return: BuildResult
         """
         self.builder = InsideBuilder(self.source, self.image)
+        for attr, value in self._resumed_builder_state.items():
+            setattr(self.builder, attr, value)
+        set_tracer(self.tracer)
+        set_prefetcher(self.prefetcher)
+        set_checksums_cache(self.checksums_cache)
+        deadline = None
+        if self.build_timeout:
+            deadline = time.time() + self.build_timeout
         try:
             signal.signal(signal.SIGTERM, self.throw_canceled_build_exception)
             # time to run pre-build plugins, so they can access cloned repo
             logger.info("running pre-build plugins")
             prebuild_runner = PreBuildPluginsRunner(self.builder.tasker, self,
-                                                    self.prebuild_plugins_conf,
-                                                    plugin_files=self.plugin_files)
+                                                    self.get_resumed_plugins_conf(
+                                                        'prebuild',
+                                                        self.prebuild_plugins_conf),
+                                                    plugin_files=self.plugin_files,
+                                                    max_workers=self.plugins_max_workers,
+                                                    deadline=deadline)
+            # base image is known now, start fetching what plugins will need
+            prebuild_runner.prefetch()
             try:
-                prebuild_runner.run()
+                with span('prebuild', 'phase'):
+                    prebuild_runner.run()
             except PluginFailedException as ex:
                 logger.error("one or more prebuild plugins failed: %s", ex)
                 raise
@@ -384,44 +638,70 @@ class DockerBuildWorkflow(object):
                 logger.info(str(ex))
                 self.autorebuild_canceled = True
                 raise
-
-            logger.info("running buildstep plugins")
-            buildstep_runner = BuildStepPluginsRunner(self.builder.tasker, self,
-                                                      self.buildstep_plugins_conf,
-                                                      plugin_files=self.plugin_files)
-            try:
-                self.build_result = buildstep_runner.run()
-
-                if self.build_result.is_failed():
-                    raise PluginFailedException(self.build_result.fail_reason)
-            except PluginFailedException as ex:
-                self.builder.is_built = False
-                logger.error('buildstep plugin failed: %s', ex)
-                raise
-
-            self.builder.is_built = True
-            if self.build_result.is_image_available():
-                self.builder.image_id = self.build_result.image_id
-                self.built_image_inspect = self.builder.inspect_built_image()
+            self.save_checkpoint('prebuild')
+
+            if ('buildstep' in self.completed_phases and self.builder.image_id and
+                    not self.builder.tasker.image_exists(self.builder.image_id)):
+                logger.warning("image %s built before checkpoint doesn't exist, "
+                               "building it again", self.builder.image_id)
+                self.discard_built_image_state()
+
+            if 'buildstep' in self.completed_phases:
+                logger.info("image was built before checkpoint, skipping buildstep plugins")
+                self.builder.is_built = True
+            else:
+                logger.info("running buildstep plugins")
+                buildstep_runner = BuildStepPluginsRunner(self.builder.tasker, self,
+                                                          self.buildstep_plugins_conf,
+                                                          plugin_files=self.plugin_files,
+                                                          deadline=deadline)
+                try:
+                    with span('buildstep', 'phase'):
+                        self.build_result = buildstep_runner.run()
+
+                    if self.build_result.is_failed():
+                        raise PluginFailedException(self.build_result.fail_reason)
+                except PluginFailedException as ex:
+                    self.builder.is_built = False
+                    logger.error('buildstep plugin failed: %s', ex)
+                    raise
+
+                self.builder.is_built = True
+                if self.build_result.is_image_available():
+                    self.builder.image_id = self.build_result.image_id
+                    self.built_image_inspect = self.builder.inspect_built_image()
+            self.save_checkpoint('buildstep')
 
             # run prepublish plugins
             prepublish_runner = PrePublishPluginsRunner(self.builder.tasker, self,
-                                                        self.prepublish_plugins_conf,
-                                                        plugin_files=self.plugin_files)
+                                                        self.get_resumed_plugins_conf(
+                                                            'prepublish',
+                                                            self.prepublish_plugins_conf),
+                                                        plugin_files=self.plugin_files,
+                                                        max_workers=self.plugins_max_workers,
+                                                        deadline=deadline)
             try:
-                prepublish_runner.run()
+                with span('prepublish', 'phase'):
+                    prepublish_runner.run()
             except PluginFailedException as ex:
                 logger.error("one or more prepublish plugins failed: %s", ex)
                 raise
+            self.save_checkpoint('prepublish')
 
             postbuild_runner = PostBuildPluginsRunner(self.builder.tasker, self,
-                                                      self.postbuild_plugins_conf,
-                                                      plugin_files=self.plugin_files)
+                                                      self.get_resumed_plugins_conf(
+                                                          'postbuild',
+                                                          self.postbuild_plugins_conf),
+                                                      plugin_files=self.plugin_files,
+                                                      max_workers=self.plugins_max_workers,
+                                                      deadline=deadline)
             try:
-                postbuild_runner.run()
+                with span('postbuild', 'phase'):
+                    postbuild_runner.run()
             except PluginFailedException as ex:
                 logger.error("one or more postbuild plugins failed: %s", ex)
                 raise
+            self.save_checkpoint('postbuild')
 
             return self.build_result
         except Exception as ex:
@@ -432,14 +712,28 @@ class DockerBuildWorkflow(object):
             signal.signal(signal.SIGTERM, lambda *args: None)
             exit_runner = ExitPluginsRunner(self.builder.tasker, self,
                                             self.exit_plugins_conf,
-                                            plugin_files=self.plugin_files)
+                                            plugin_files=self.plugin_files,
+                                            max_workers=self.plugins_max_workers)
             try:
-                exit_runner.run(keep_going=True)
+                with span('exit', 'phase'):
+                    exit_runner.run(keep_going=True)
             except PluginFailedException as ex:
                 logger.error("one or more exit plugins failed: %s", ex)
                 raise
             finally:
-                self.source.remove_tmpdir()
+                set_prefetcher(None)
+                self.prefetcher.shutdown()
+                set_checksums_cache(None)
+                if self.keeps_checkpoint:
+                    self.save_checkpoint()
+                    logger.info("keeping workdir %s, build can be resumed from "
+                                "checkpoint %s", self.source.workdir, self.checkpoint_file)
+                else:
+                    self.source.remove_tmpdir()
+                    self.remove_build_log()
+                    self.remove_checkpoint()
+                set_tracer(None)
+                self.write_trace()
 
             signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
@@ -484,3 +778,17 @@ def build_inside(input_method, input_args=None, substitutions=None):
         raise RuntimeError("no image built")
     else:
         logger.info("build has finished successfully \o/")
+
+
+def resume_build(checkpoint_file):
+    """
+    resume build which failed from its checkpoint
+
+    :param checkpoint_file: str, path to checkpoint saved by failed build
+    """
+    dbw = DockerBuildWorkflow.from_checkpoint(checkpoint_file)
+    build_result = dbw.build_docker_image()
+    if not build_result or build_result.is_failed():
+        raise RuntimeError("no image built")
+    else:
+        logger.info(r"build has finished successfully \o/")
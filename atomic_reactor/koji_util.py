@@ -16,6 +16,8 @@ import os
 import time
 
 from atomic_reactor.constants import DEFAULT_DOWNLOAD_BLOCK_SIZE
+from atomic_reactor.tracing import span
+from atomic_reactor.util import count_call
 
 
 logger = logging.getLogger(__name__)
@@ -97,6 +99,16 @@ def create_koji_session(hub_url, auth_info=None):
     """
     session = koji.ClientSession(hub_url, opts={'krb_rdns': False})
 
+    call_method = getattr(session, '_callMethod', None)
+    if call_method is not None:
+        # count and trace hub calls, see ResourceProfiler and tracing
+        def traced_call_method(name, *args, **kwargs):
+            count_call('koji')
+            with span(name, 'koji'):
+                return call_method(name, *args, **kwargs)
+
+        session._callMethod = traced_call_method
+
     if auth_info is not None:
         koji_login(session, **auth_info)
 
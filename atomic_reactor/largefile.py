@@ -0,0 +1,192 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Reading and writing large files (image tarballs) without flooding the page
+cache.
+
+Image tarballs are read or written once, sequentially, so keeping them in the
+page cache only evicts data the docker daemon and other builds running on the
+node need. Files opened by open_large_file() tell the kernel they are read
+sequentially, ask it to read ahead, and drop ranges which were already
+consumed from the cache. Written ranges are dropped one window behind, when
+they have most likely been written back already; the kernel keeps dirty pages
+regardless.
+
+posix_fadvise() is available on Python 3.3 and newer; on older versions and
+on platforms without it the hints are not given and files behave as usual.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 32 * 1024**2  # 32 MB
+
+_fadvise = getattr(os, 'posix_fadvise', None)
+
+
+def _advise(fd, offset, length, advice):
+    """
+    :param advice: str, name of POSIX_FADV_* constant without the prefix
+    :return: bool, whether the hint was given
+    """
+    if _fadvise is None:
+        return False
+    try:
+        _fadvise(fd, offset, length, getattr(os, 'POSIX_FADV_' + advice))
+    except (OSError, AttributeError) as ex:
+        logger.debug("posix_fadvise %s failed: %r", advice, ex)
+        return False
+    return True
+
+
+def advise_sequential(fd, offset=0, length=0):
+    """
+    tell kernel the range of file will be accessed sequentially, so that it
+    reads ahead more aggressively; length 0 means up to the end of file
+    """
+    return _advise(fd, offset, length, 'SEQUENTIAL')
+
+
+def readahead(fd, offset, length):
+    """
+    start reading range of file to the page cache in the background
+    """
+    return _advise(fd, offset, length, 'WILLNEED')
+
+
+def drop_cache(fd_or_path, offset=0, length=0):
+    """
+    drop clean pages of range of file from the page cache; length 0 means up
+    to the end of file
+
+    :param fd_or_path: int, file descriptor, or str, path to file
+    """
+    if _fadvise is None:
+        return False
+    if isinstance(fd_or_path, int):
+        return _advise(fd_or_path, offset, length, 'DONTNEED')
+    try:
+        fd = os.open(fd_or_path, os.O_RDONLY)
+    except OSError as ex:
+        logger.debug("can't open %s to drop it from page cache: %r", fd_or_path, ex)
+        return False
+    try:
+        return _advise(fd, offset, length, 'DONTNEED')
+    finally:
+        os.close(fd)
+
+
+class LargeFile(object):
+    """
+    file-like object wrapping a file which is read or written sequentially,
+    see the module docstring
+    """
+
+    def __init__(self, fileobj, window=DEFAULT_WINDOW, drop=True):
+        """
+        :param fileobj: file object opened in binary mode
+        :param window: int, number of bytes read ahead and processed between
+                       two hints to the kernel
+        :param drop: bool, drop consumed ranges from the page cache
+        """
+        self.fileobj = fileobj
+        self.window = window
+        self.drop = drop
+        self._fd = fileobj.fileno()
+        self._pos = fileobj.tell()
+        # start of range which hasn't been dropped from cache yet
+        self._kept = self._pos
+        # end of range the kernel was asked to read ahead
+        self._readahead_end = self._pos
+        advise_sequential(self._fd, self._pos)
+
+    @property
+    def name(self):
+        return self.fileobj.name
+
+    def fileno(self):
+        return self._fd
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        if self._readahead_end < self._pos + self.window:
+            start = max(self._readahead_end, self._pos)
+            readahead(self._fd, start, self.window)
+            self._readahead_end = start + self.window
+        data = self.fileobj.read(size)
+        self._pos += len(data)
+        if self.drop and self._pos - self._kept >= self.window:
+            drop_cache(self._fd, self._kept, self._pos - self._kept)
+            self._kept = self._pos
+        return data
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self._pos += len(data)
+        if self.drop and self._pos - self._kept >= 2 * self.window:
+            # dirty pages can't be dropped, leave the last window to writeback
+            self.fileobj.flush()
+            end = self._pos - self.window
+            drop_cache(self._fd, self._kept, end - self._kept)
+            self._kept = end
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._drop_kept()
+        self.fileobj.seek(offset, whence)
+        self._pos = self._kept = self._readahead_end = self.fileobj.tell()
+        return self._pos
+
+    def truncate(self, size=None):
+        return self.fileobj.truncate(size)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def _drop_kept(self):
+        if self.drop and self._pos > self._kept:
+            self.fileobj.flush()
+            drop_cache(self._fd, self._kept, self._pos - self._kept)
+        self._kept = self._pos
+
+    def close(self):
+        if self.fileobj.closed:
+            return
+        try:
+            self._drop_kept()
+        finally:
+            self.fileobj.close()
+
+    @property
+    def closed(self):
+        return self.fileobj.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_large_file(path, mode='rb', **kwargs):
+    """
+    open file which is read or written sequentially
+
+    :param path: str, path to file
+    :param mode: str, 'rb', 'wb', 'ab' or 'r+b'
+    :param kwargs: arguments of LargeFile
+    :return: LargeFile instance
+    """
+    return LargeFile(open(path, mode), **kwargs)
@@ -0,0 +1,200 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Node-local store of image layers: compressed layer blobs are kept in
+a directory shared by all builds running on the node, so that layers common
+to many images (base image layers) are compressed only once. Blobs are
+identified by keys: the digest of the uncompressed layer (diff_id) followed
+by compression and its level, e.g. 'sha256:1234....gzip-6'; uncompressed
+layers are not stored.
+
+When the store grows over its size limit, least recently used blobs are
+removed. Blobs are written to temporary files and renamed, removal is done
+under an exclusive lock of the store, so the store can be used by concurrent
+builds. Temporary files left by builds which were killed are removed once
+they weren't written to for TMP_FILE_MAX_AGE.
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LAYER_STORE_MAX_SIZE = 10 * 1024**3  # 10 GiB
+# temporary files older than this (in seconds) are not written by any build
+TMP_FILE_MAX_AGE = 3600
+
+KEY_REGEX = re.compile(r'^[a-zA-Z0-9]+:[a-fA-F0-9]+(\.[a-zA-Z0-9_-]+)?$')
+
+
+class LayerStore(object):
+    """
+    content-addressable store of layer blobs with LRU eviction
+    """
+
+    def __init__(self, path, max_size=DEFAULT_LAYER_STORE_MAX_SIZE):
+        """
+        constructor
+
+        :param path: str, directory of the store, created when missing
+        :param max_size: int, max size of all blobs in bytes
+        """
+        self.path = path
+        self.max_size = max_size
+        self.blobs_path = os.path.join(path, 'blobs')
+        try:
+            os.makedirs(self.blobs_path)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+
+    def _blob_path(self, key):
+        if not KEY_REGEX.match(key):
+            raise ValueError("invalid layer store key: %r" % key)
+        return os.path.join(self.blobs_path, key)
+
+    @contextmanager
+    def _lock(self, operation):
+        with open(os.path.join(self.path, 'lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def open(self, key):
+        """
+        open blob for reading and mark it as recently used
+
+        :param key: str, key of blob
+        :return: file object or None if blob isn't in the store
+        """
+        path = self._blob_path(key)
+        # blob may be removed by prune() of another build, open it under lock;
+        # once it's open, it can be read even when it is removed
+        with self._lock(fcntl.LOCK_SH):
+            try:
+                blob = open(path, 'rb')
+            except IOError as ex:
+                if ex.errno != errno.ENOENT:
+                    raise
+                logger.debug("layer %s not in store", key)
+                return None
+            try:
+                os.utime(path, None)
+            except OSError as ex:
+                logger.debug("failed to mark layer %s as used: %r", key, ex)
+        logger.debug("layer %s found in store", key)
+        return blob
+
+    def __contains__(self, key):
+        return os.path.exists(self._blob_path(key))
+
+    @contextmanager
+    def writer(self, key=None):
+        """
+        context manager for adding blob; data written to the returned
+        BlobWriter are added to the store under its key when the body
+        finishes without exception
+
+        :param key: str, key of blob; when None, the body can set key of
+                    the BlobWriter once it's known, otherwise key is
+                    'sha256:<digest of data>'
+        :return: BlobWriter instance
+        """
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=self.blobs_path)
+        blob = BlobWriter(os.fdopen(fd, 'wb'), tmp_path)
+        blob.key = key
+        try:
+            yield blob
+            blob.close()
+            blob.key = blob.key or 'sha256:' + blob.sha256.hexdigest()
+            os.rename(tmp_path, self._blob_path(blob.key))
+        except Exception:
+            blob.close()
+            os.remove(tmp_path)
+            raise
+        logger.debug("layer %s (%d bytes) added to store", blob.key, blob.size)
+
+    def prune(self):
+        """
+        remove least recently used blobs until size of the store is within
+        limit, and stale temporary files
+
+        :return: list of str, keys of removed blobs
+        """
+        removed = []
+        removed_tmp = 0
+        with self._lock(fcntl.LOCK_EX):
+            blobs = []
+            now = time.time()
+            for name in os.listdir(self.blobs_path):
+                path = os.path.join(self.blobs_path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.startswith('.tmp-'):
+                    if now - stat.st_mtime > TMP_FILE_MAX_AGE:
+                        try:
+                            os.remove(path)
+                        except OSError as ex:
+                            logger.debug("failed to remove %s: %r", path, ex)
+                        else:
+                            removed_tmp += 1
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, name))
+
+            size = sum(blob_size for _, blob_size, _ in blobs)
+            for _, blob_size, name in sorted(blobs):
+                if size <= self.max_size:
+                    break
+                os.remove(os.path.join(self.blobs_path, name))
+                size -= blob_size
+                removed.append(name)
+
+        if removed:
+            logger.info("removed %d layers from store %s", len(removed), self.path)
+        if removed_tmp:
+            logger.info("removed %d stale temporary files from store %s",
+                        removed_tmp, self.path)
+        return removed
+
+
+class BlobWriter(object):
+    """
+    file-like object for writing blob, see LayerStore.writer()
+    """
+
+    def __init__(self, fileobj, path):
+        self._file = fileobj
+        self.path = path
+        self.key = None
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self._file.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,391 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Exporting images straight from the overlay2 storage of the docker daemon,
+without passing the data through the daemon.
+
+Layers are found in the layer database by their chain IDs: cache-id names
+the overlay2 directory with the files of the layer, tar-split.json.gz holds
+everything needed to reassemble the original layer tarball from those files
+(tar headers and padding are stored there, only file contents are taken from
+the diff directory). Reassembled layer.tar is identical to the one
+'docker save' produces, so its digest matches diff ID of the layer; this is
+verified while each layer is written and the export fails otherwise, e.g.
+when tar-split metadata don't match files in the diff directory.
+
+Files are opened without following symbolic links in any component of their
+path, so that files out of the diff directory never end up in the tarball.
+
+Image tarball has the same structure as 'docker save' output (manifest.json,
+image config, a directory with VERSION, json and layer.tar for each layer).
+Sizes of all layers are known from tar-split metadata in advance, so headers
+are written first and layers are then written to their places in parallel.
+"""
+
+from __future__ import unicode_literals
+
+import base64
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import stat
+import tarfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+from atomic_reactor.export import DEFAULT_CHUNK_SIZE, TAR_BLOCK_SIZE
+from atomic_reactor.util import ChecksumFile, ImageName, propagate_call_counts
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DOCKER_ROOT = '/var/lib/docker'
+DEFAULT_EXPORT_WORKERS = 4
+
+# entry types of tar-split
+TAR_SPLIT_FILE = 1
+TAR_SPLIT_SEGMENT = 2
+
+
+def get_chain_ids(diff_ids):
+    """
+    :param diff_ids: list of str, diff IDs of image layers from the bottom one
+    :return: list of str, chain IDs of the layers
+    """
+    chain_ids = []
+    for diff_id in diff_ids:
+        if chain_ids:
+            chain = '{0} {1}'.format(chain_ids[-1], diff_id).encode('utf-8')
+            diff_id = 'sha256:' + hashlib.sha256(chain).hexdigest()
+        chain_ids.append(diff_id)
+    return chain_ids
+
+
+def _hex(digest):
+    algorithm, _, hexdigest = digest.partition(':')
+    if algorithm != 'sha256' or not hexdigest:
+        raise ValueError('unsupported digest %r' % digest)
+    return hexdigest
+
+
+class Overlay2Layer(object):
+    """
+    layer stored by overlay2 graph driver
+    """
+
+    def __init__(self, layerdb_path, diff_path, diff_id):
+        """
+        :param layerdb_path: str, directory of the layer in layer database
+        :param diff_path: str, overlay2 directory with files of the layer
+        :param diff_id: str, digest of layer tarball
+        """
+        self.layerdb_path = layerdb_path
+        self.diff_path = diff_path
+        self.diff_id = diff_id
+
+    def iter_tar_split(self):
+        """
+        :return: iterator of dicts, entries of tar-split metadata
+        """
+        path = os.path.join(self.layerdb_path, 'tar-split.json.gz')
+        with gzip.open(path, 'rb') as tar_split:
+            for line in tar_split:
+                if line.strip():
+                    yield json.loads(line.decode('utf-8'))
+
+    def get_size(self):
+        """
+        :return: int, size of layer tarball
+        """
+        size = 0
+        for entry in self.iter_tar_split():
+            if entry['type'] == TAR_SPLIT_SEGMENT:
+                size += len(base64.b64decode(entry['payload']))
+            else:
+                size += entry.get('size', 0)
+        return size
+
+    def _file_path(self, entry):
+        """
+        :return: tuple, (path of layer file, list of paths of its parent
+                 directories within the diff directory)
+        """
+        if 'name_raw' in entry:
+            # name which is not valid UTF-8
+            name = base64.b64decode(entry['name_raw'])
+            if hasattr(os, 'fsdecode'):
+                name = os.fsdecode(name)
+        else:
+            name = entry['name']
+        root = self.diff_path
+        if isinstance(name, bytes) and not isinstance(root, bytes):
+            root = root.encode('utf-8')
+        root = os.path.normpath(root)
+        path = os.path.normpath(os.path.join(root, name))
+        # root with trailing separator
+        if not path.startswith(os.path.join(root, root[:0])):
+            raise RuntimeError('file %r out of layer %s' % (name, self.diff_id))
+        parents = []
+        parent = os.path.dirname(path)
+        while parent != root:
+            parents.append(parent)
+            parent = os.path.dirname(parent)
+        return path, parents[::-1]
+
+    def _open_file(self, entry, checked_dirs):
+        """
+        open layer file, none of the components of its path may be
+        a symbolic link
+
+        :param entry: dict, tar-split entry of the file
+        :param checked_dirs: set, parent directories which were already
+                             checked, it's updated
+        :return: file object
+        """
+        path, parents = self._file_path(entry)
+        for parent in parents:
+            if parent in checked_dirs:
+                continue
+            if not stat.S_ISDIR(os.lstat(parent).st_mode):
+                raise RuntimeError('%r of layer %s is not a directory' %
+                                   (parent, self.diff_id))
+            checked_dirs.add(parent)
+
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+        layer_file = os.fdopen(fd, 'rb')
+        if not stat.S_ISREG(os.fstat(fd).st_mode):
+            layer_file.close()
+            raise RuntimeError('file %r of layer %s is not a regular file' %
+                               (entry.get('name'), self.diff_id))
+        return layer_file
+
+    def write(self, fp, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        write layer tarball reassembled from tar-split metadata and layer files
+
+        :param fp: file object
+        :return: int, number of bytes written
+        """
+        written = 0
+        checked_dirs = set()
+        for entry in self.iter_tar_split():
+            if entry['type'] == TAR_SPLIT_SEGMENT:
+                data = base64.b64decode(entry['payload'])
+                fp.write(data)
+                written += len(data)
+                continue
+
+            size = entry.get('size', 0)
+            if not size:
+                continue
+            with self._open_file(entry, checked_dirs) as layer_file:
+                copied = 0
+                while copied < size:
+                    data = layer_file.read(min(chunk_size, size - copied))
+                    if not data:
+                        break
+                    fp.write(data)
+                    copied += len(data)
+            if copied != size:
+                raise RuntimeError('file %r of layer %s changed' %
+                                   (entry.get('name'), self.diff_id))
+            written += size
+        return written
+
+
+class Overlay2Exporter(object):
+    """
+    exports images from overlay2 storage of docker daemon
+    """
+
+    def __init__(self, docker_root=DEFAULT_DOCKER_ROOT, workers=DEFAULT_EXPORT_WORKERS):
+        """
+        constructor
+
+        :param docker_root: str, root directory of docker daemon (DockerRootDir)
+        :param workers: int, number of layers written concurrently
+        """
+        self.docker_root = docker_root
+        self.workers = workers
+        self.image_path = os.path.join(docker_root, 'image', 'overlay2')
+
+    @classmethod
+    def from_docker_info(cls, info, **kwargs):
+        """
+        :param info: dict, output of 'docker info'
+        :return: Overlay2Exporter instance, None if the daemon doesn't use
+                 overlay2 or its storage is not accessible
+        """
+        if info.get('Driver') != 'overlay2':
+            logger.info("docker storage driver is %s, not overlay2", info.get('Driver'))
+            return None
+        exporter = cls(docker_root=info.get('DockerRootDir', DEFAULT_DOCKER_ROOT), **kwargs)
+        if not os.access(exporter.image_path, os.R_OK | os.X_OK):
+            logger.info("docker storage %s is not accessible", exporter.image_path)
+            return None
+        return exporter
+
+    def get_config(self, image_id):
+        """
+        :param image_id: str, image ID, e.g. 'sha256:1234...'
+        :return: bytes, image config
+        """
+        path = os.path.join(self.image_path, 'imagedb', 'content', 'sha256', _hex(image_id))
+        with open(path, 'rb') as config_file:
+            return config_file.read()
+
+    def get_layers(self, diff_ids):
+        """
+        :param diff_ids: list of str, diff IDs of image layers from the bottom one
+        :return: list of Overlay2Layer instances
+        """
+        layers = []
+        for diff_id, chain_id in zip(diff_ids, get_chain_ids(diff_ids)):
+            layerdb_path = os.path.join(self.image_path, 'layerdb', 'sha256', _hex(chain_id))
+            with open(os.path.join(layerdb_path, 'cache-id')) as cache_id_file:
+                cache_id = cache_id_file.read().strip()
+            if not cache_id or os.path.sep in cache_id or cache_id.startswith('.'):
+                raise RuntimeError('invalid cache-id of layer %s' % diff_id)
+            diff_path = os.path.join(self.docker_root, 'overlay2', cache_id, 'diff')
+            layers.append(Overlay2Layer(layerdb_path, diff_path, diff_id))
+        return layers
+
+    def export(self, image_id, path, repo_tags=None):
+        """
+        write image tarball in 'docker save' format
+
+        :param image_id: str, image ID, e.g. 'sha256:1234...'
+        :param path: str, path to image tarball
+        :param repo_tags: list of str, names of image for manifest.json
+        """
+        config_bytes = self.get_config(image_id)
+        config = json.loads(config_bytes.decode('utf-8'))
+        diff_ids = config['rootfs']['diff_ids']
+        layers = self.get_layers(diff_ids)
+        repo_tags = [_with_tag(name) for name in repo_tags or []]
+        logger.info("exporting image %s with %d layers from %s",
+                    image_id, len(layers), self.docker_root)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            sizes = list(executor.map(propagate_call_counts(lambda layer: layer.get_size()),
+                                      layers))
+
+            members, layer_dirs = self._get_members(image_id, config, config_bytes, repo_tags)
+            layer_offsets = [None] * len(layers)
+            with open(path, 'wb') as image_file:
+                for name, content in members:
+                    if name in layer_dirs:
+                        # layer directory is followed by its layer.tar
+                        index = layer_dirs.index(name)
+                        image_file.write(_tar_header(name, directory=True))
+                        for file_name, file_content in content:
+                            _write_tar_member(image_file, name + '/' + file_name, file_content)
+                        layer_size = sizes[index]
+                        image_file.write(_tar_header(name + '/layer.tar', size=layer_size))
+                        layer_offsets[index] = image_file.tell()
+                        image_file.seek(_padded(layer_size), io.SEEK_CUR)
+                    else:
+                        _write_tar_member(image_file, name, content)
+                image_file.write(2 * TAR_BLOCK_SIZE * b'\0')
+
+            write_layer = propagate_call_counts(self._write_layer)
+            futures = [executor.submit(write_layer, layer, path, offset, size)
+                       for layer, offset, size in zip(layers, layer_offsets, sizes)]
+            for future in futures:
+                future.result()
+
+    @staticmethod
+    def _write_layer(layer, path, offset, size):
+        with open(path, 'r+b') as image_file:
+            image_file.seek(offset)
+            out = ChecksumFile(image_file, algorithms=('sha256',))
+            written = layer.write(out)
+        if written != size:
+            raise RuntimeError('layer %s changed while being exported' % layer.diff_id)
+        digest = 'sha256:' + out.get_checksums()['sha256sum']
+        if digest != layer.diff_id:
+            raise RuntimeError('exported layer %s has digest %s' % (layer.diff_id, digest))
+        logger.debug("exported layer %s (%d bytes)", layer.diff_id, size)
+
+    @staticmethod
+    def _get_members(image_id, config, config_bytes, repo_tags):
+        """
+        :return: tuple, (list of (name, content) sorted by name, where content
+                 of layer directory is list of its (name, content) except
+                 layer.tar, list of names of layer directories)
+        """
+        layer_dirs = []
+        parent = None
+        diff_ids = config['rootfs']['diff_ids']
+        for index, chain_id in enumerate(get_chain_ids(diff_ids)):
+            layer_config = {'created': config.get('created')}
+            if index == len(diff_ids) - 1:
+                # legacy config of top layer describes the image
+                layer_config = dict((key, value) for key, value in config.items()
+                                    if key not in ('rootfs', 'history'))
+            # legacy layer IDs are derived from legacy config, parent and
+            # chain ID like docker does it, but they are not the same
+            v1_id = hashlib.sha256(json.dumps([layer_config, parent, chain_id],
+                                              sort_keys=True).encode('utf-8')).hexdigest()
+            layer_config['id'] = v1_id
+            if parent:
+                layer_config['parent'] = parent
+            layer_dirs.append((v1_id, [
+                ('VERSION', b'1.0'),
+                ('json', json.dumps(layer_config, sort_keys=True).encode('utf-8')),
+            ]))
+            parent = v1_id
+
+        config_name = _hex(image_id) + '.json'
+        manifest = [{
+            'Config': config_name,
+            'RepoTags': repo_tags or None,
+            'Layers': [v1_id + '/layer.tar' for v1_id, _ in layer_dirs],
+        }]
+        members = layer_dirs + [
+            (config_name, config_bytes),
+            ('manifest.json', json.dumps(manifest).encode('utf-8')),
+        ]
+        if repo_tags and layer_dirs:
+            repositories = {}
+            for repo_tag in repo_tags:
+                repo, _, tag = repo_tag.rpartition(':')
+                repositories.setdefault(repo, {})[tag] = parent
+            members.append(('repositories', json.dumps(repositories).encode('utf-8')))
+
+        return sorted(members, key=lambda member: member[0]), [name for name, _ in layer_dirs]
+
+
+def _with_tag(name):
+    image = ImageName.parse(name)
+    image.tag = image.tag or 'latest'
+    return image.to_str()
+
+
+def _padded(size):
+    return -(-size // TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+
+
+def _tar_header(name, size=0, directory=False):
+    info = tarfile.TarInfo(name)
+    if directory:
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+    else:
+        info.size = size
+        info.mode = 0o644
+    return info.tobuf(tarfile.USTAR_FORMAT)
+
+
+def _write_tar_member(fp, name, content):
+    fp.write(_tar_header(name, size=len(content)))
+    fp.write(content)
+    fp.write((_padded(len(content)) - len(content)) * b'\0')
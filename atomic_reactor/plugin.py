@@ -11,21 +11,37 @@ definition of plugin system
 plugins are supposed to be run when image is built and we need to extract some information
 """
 import copy
+import ctypes
+import signal
+import json
 import logging
 import os
+import sys
 import traceback
 import imp
 import datetime
 import inspect
+import threading
 import time
 
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from atomic_reactor import __version__
 from atomic_reactor.build import BuildResult
-from atomic_reactor.util import process_substitutions
+from atomic_reactor.constants import PLUGINS_INDEX_ENV, PLUGINS_INDEX_PATH
+from atomic_reactor.tracing import span
+from atomic_reactor.util import process_substitutions, ResourceProfiler
 from dockerfile_parse import DockerfileParser
 
 MODULE_EXTENSIONS = ('.py', '.pyc', '.pyo')
 logger = logging.getLogger(__name__)
 
+# name of data read by plugins which check whether the build failed
+# (workflow.build_process_failed); plugins which are not allowed to fail
+# modify it by failing, see PluginsRunner._run_concurrently()
+BUILD_STATUS = 'build_status'
+
 
 class AutoRebuildCanceledException(Exception):
     """Raised if a plugin cancels autorebuild"""
@@ -45,6 +61,10 @@ class BuildCanceledException(Exception):
     """Build was canceled"""
 
 
+class PluginTimeoutException(Exception):
+    """Plugin didn't finish in time"""
+
+
 class InappropriateBuildStepError(Exception):
     """Requested build step is not appropriate"""
 
@@ -58,6 +78,21 @@ class Plugin(object):
     key = None
     # by default, if plugin fails (raises exc), execution continues
     is_allowed_to_fail = True
+    # names of data the plugin reads and modifies, e.g. workflow attributes
+    # ('tag_conf', 'push_conf.docker', 'exported_image_sequence', 'files'),
+    # 'dockerfile', 'source' or keys of other plugins (for their results and
+    # workspace). Each plugin implicitly modifies data named by its own key.
+    # Plugins which check whether the build failed read BUILD_STATUS, they
+    # are started once plugins requested before them can't fail the build.
+    # Plugins which don't conflict in these may be run concurrently, see
+    # plugins_conflict(); None means the plugin may access anything.
+    # Instances may narrow down what their class declares.
+    reads = None
+    writes = None
+    # method starting prefetches (see atomic_reactor.prefetch) of remote data
+    # the plugin will need; it is called when the build starts and the same
+    # instance is run later, see BuildPluginsRunner.prefetch()
+    prefetch = None
 
     def __init__(self, *args, **kwargs):
         """
@@ -106,6 +141,215 @@ class BuildPlugin(Plugin):
         super(BuildPlugin, self).__init__(*args, **kwargs)
 
 
+def raise_in_thread(thread_id, exception_class):
+    """
+    asynchronously raise exception in another thread, the exception
+    is raised when the thread executes python code next time
+
+    :param thread_id: int, thread identifier
+    :param exception_class: exception class to raise
+    """
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(thread_id),
+                                               ctypes.py_object(exception_class))
+
+
+def plugins_conflict(first, second):
+    """
+    find out whether two plugins can't run concurrently
+
+    :param first: Plugin class or instance
+    :param second: Plugin class or instance
+    :return: bool, True if one of the plugins modifies data the other one
+             reads or modifies, or if any of them doesn't declare what it accesses
+    """
+    if None in (first.reads, first.writes, second.reads, second.writes):
+        return True
+
+    first_writes = set(first.writes) | set([first.key])
+    second_writes = set(second.writes) | set([second.key])
+    return bool(first_writes & (set(second.reads) | second_writes) or
+                set(first.reads) & second_writes)
+
+
+class PluginsIndex(object):
+    """
+    index of plugins provided by plugin files
+
+    maps plugin keys to the file which defines the plugin class and to names
+    of plugin base classes the plugin is derived from, so that runners only
+    need to import modules providing plugins they were asked to run
+
+    entries are keyed by file path and invalidated when mtime or size of the
+    file changes; the index lives for the whole process and is persisted
+    on disk (see PLUGINS_INDEX_ENV) so that following processes don't need
+    to import any plugin module just to find out which plugins it provides
+
+    plugin keys often come from other modules (atomic_reactor.constants),
+    so the whole index is dropped when atomic-reactor or python version
+    changes, and requested plugins which are not found make the index be
+    refreshed
+    """
+
+    version = [1, __version__, sys.version]
+
+    def __init__(self, path=None):
+        """
+        constructor
+
+        :param path: str, path to on-disk index, None to use default location
+        """
+        self._path = path
+        # file path -> {'stat': [mtime, size], 'plugins': [{'key', 'class', 'bases'}]}
+        self._files = None
+        self._dirty = False
+
+    @property
+    def path(self):
+        return self._path or os.environ.get(PLUGINS_INDEX_ENV) or PLUGINS_INDEX_PATH
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return [st.st_mtime, st.st_size]
+
+    def _read(self):
+        if self._files is not None:
+            return
+        self._files = {}
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+            if data['version'] == self.version:
+                self._files = dict(data['files'])
+        except (IOError, OSError, ValueError, KeyError, TypeError) as ex:
+            logger.debug("can't read plugins index '%s': %r", self.path, ex)
+
+    def _write(self):
+        if not self._dirty:
+            return
+        index_dir = os.path.dirname(self.path)
+        tmp_path = '%s.%d' % (self.path, os.getpid())
+        try:
+            if index_dir and not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            with open(tmp_path, 'w') as fp:
+                json.dump({'version': self.version, 'files': self._files}, fp)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as ex:
+            logger.debug("can't write plugins index '%s': %r", self.path, ex)
+        else:
+            self._dirty = False
+
+    @staticmethod
+    def _index_module(module):
+        """
+        find plugin classes defined in module
+
+        :param module: module object
+        :return: list of dicts with keys 'key', 'class' and 'bases'
+        """
+        plugins = []
+        for name in dir(module):
+            binding = getattr(module, name, None)
+            if not isinstance(binding, type) or not issubclass(binding, Plugin):
+                continue
+            # classes imported from elsewhere are indexed in their own module
+            if binding.__module__ != module.__name__ or binding.key is None:
+                continue
+            bases = [base.__name__ for base in binding.__mro__[1:]
+                     if base.__module__ == Plugin.__module__]
+            plugins.append({'key': binding.key, 'class': name, 'bases': bases})
+        return plugins
+
+    def _load_module(self, path):
+        """
+        import plugin module from file and (re)index it
+
+        :param path: str, path to python file
+        :return: module object or None if the module can't be loaded
+        """
+        logger.debug("load file '%s'", path)
+        module_name = os.path.basename(path).rsplit('.', 1)[0]
+        try:
+            module = imp.load_source(module_name, path)
+        except (IOError, OSError, ImportError, SyntaxError) as ex:
+            logger.warning("can't load module '%s': %r", path, ex)
+            return None
+
+        self._files[path] = {'stat': self._stat(path), 'plugins': self._index_module(module)}
+        self._dirty = True
+        return module
+
+    def get_plugin_classes(self, files, plugin_class_name, keys=None):
+        """
+        import requested plugins of given type
+
+        a file is imported only if it provides some of the requested plugins,
+        or if it is not indexed yet or changed since it was indexed; when some
+        requested plugins are not found, all files are imported to refresh
+        the index
+
+        :param files: list of str, paths to files with plugins
+        :param plugin_class_name: str, name of plugin base class (e.g. 'PreBuildPlugin')
+        :param keys: set of str, keys of plugins to import, None for all plugins
+        :return: dict, plugin key -> plugin class
+        """
+        self._read()
+        plugin_classes = {}
+        loaded = set()
+        for path in files:
+            self._get_plugin_classes(path, plugin_class_name, keys, plugin_classes, loaded)
+
+        if keys is not None and not keys <= set(plugin_classes):
+            logger.debug("plugins %s not indexed, refreshing plugins index",
+                         ', '.join(sorted(keys - set(plugin_classes))))
+            for path in files:
+                if path not in loaded:
+                    self._get_plugin_classes(path, plugin_class_name, keys, plugin_classes,
+                                             loaded, reload_module=True)
+
+        self._write()
+        return plugin_classes
+
+    def _get_plugin_classes(self, path, plugin_class_name, keys, plugin_classes, loaded,
+                            reload_module=False):
+        """
+        add requested plugins of given type provided by file to plugin_classes
+
+        :param loaded: set of str, paths of files imported so far
+        :param reload_module: bool, import the file even if its index entry is valid
+        """
+        module = None
+        entry = self._files.get(path)
+        if reload_module or entry is None or entry['stat'] != self._stat(path):
+            module = self._load_module(path)
+            loaded.add(path)
+            if module is None:
+                return
+            entry = self._files[path]
+
+        for plugin in entry['plugins']:
+            if plugin_class_name not in plugin['bases']:
+                continue
+            if keys is not None and plugin['key'] not in keys:
+                continue
+            if module is None:
+                module = self._load_module(path)
+                loaded.add(path)
+                if module is None:
+                    return
+            binding = getattr(module, plugin['class'], None)
+            # key of the imported class, the indexed one may be stale
+            if binding is not None and (keys is None or binding.key in keys):
+                plugin_classes[binding.key] = binding
+
+
+plugins_index = PluginsIndex()
+
+
 class PluginsRunner(object):
 
     def __init__(self, plugin_class_name, plugins_conf, *args, **kwargs):
@@ -114,15 +358,36 @@ class PluginsRunner(object):
 
         :param plugin_class_name: str, name of plugin class to filter (e.g. 'PreBuildPlugin')
         :param plugins_conf: dict, configuration for plugins
+        :param plugin_files: list of str, load plugins also from these files
+        :param max_workers: int, max number of plugins to run concurrently
+        :param deadline: float, time (in seconds since the epoch) by which all
+                         plugins have to finish, they are interrupted otherwise
         """
         self.plugins_results = getattr(self, "plugins_results", {})
         self.plugins_conf = plugins_conf or []
         self.plugin_files = kwargs.get("plugin_files", [])
+        self.max_workers = kwargs.get("max_workers") or 1
+        self.deadline = kwargs.get("deadline")
         self.plugin_classes = self.load_plugins(plugin_class_name)
 
+    def get_requested_plugins(self):
+        """
+        keys of plugins requested in plugins_conf
+
+        :return: set of str; subclasses return None when all plugins have
+                 to be loaded
+        """
+        keys = set()
+        for plugin_request in self.plugins_conf:
+            try:
+                keys.add(plugin_request['name'])
+            except (TypeError, KeyError):
+                continue
+        return keys
+
     def load_plugins(self, plugin_class_name):
         """
-        load all available plugins
+        load requested plugins, only modules providing them are imported
         """
         # imp.findmodule('atomic_reactor') doesn't work
         plugins_dir = os.path.join(os.path.dirname(__file__), 'plugins')
@@ -133,32 +398,8 @@ class PluginsRunner(object):
         if self.plugin_files:
             logger.debug("loading additional plugins from files '%s'", self.plugin_files)
             files += self.plugin_files
-        plugin_class = globals()[plugin_class_name]
-        plugin_classes = {}
-        for f in files:
-            logger.debug("load file '%s'", f)
-            module_name = os.path.basename(f).rsplit('.', 1)[0]
-            try:
-                f_module = imp.load_source(module_name, f)
-            except (IOError, OSError, ImportError, SyntaxError) as ex:
-                logger.warning("can't load module '%s': %r", f, ex)
-                continue
-            for name in dir(f_module):
-                binding = getattr(f_module, name, None)
-                try:
-                    # if you try to compare binding and PostBuildPlugin, python won't match them
-                    # if you call this script directly b/c:
-                    # ! <class 'plugins.plugin_rpmqa.PostBuildRPMqaPlugin'> <= <class
-                    # '__main__.PostBuildPlugin'>
-                    # but
-                    # <class 'plugins.plugin_rpmqa.PostBuildRPMqaPlugin'> <= <class
-                    # 'atomic_reactor.plugin.PostBuildPlugin'>
-                    is_sub = issubclass(binding, plugin_class)
-                except TypeError:
-                    is_sub = False
-                if binding and is_sub and plugin_class.__name__ != binding.__name__:
-                    plugin_classes[binding.key] = binding
-        return plugin_classes
+        return plugins_index.get_plugin_classes(files, plugin_class_name,
+                                                keys=self.get_requested_plugins())
 
     def create_instance_from_plugin(self, plugin_class, plugin_conf):
         """
@@ -180,126 +421,371 @@ class PluginsRunner(object):
     def save_plugin_duration(self, plugin, duration):
         pass
 
-    def run(self, keep_going=False, buildstep_phase=False):
+    def save_plugin_resource_usage(self, plugin, usage):
+        pass
+
+    def _get_plugin(self, plugin_request, keep_going=False):
         """
-        run all requested plugins
+        look up plugin for plugin request from plugins_conf
 
-        :param keep_going: bool, whether to keep going after unexpected
-                                 failure (only used for exit plugins)
-        :param buildstep_phase: bool, when True remaining plugins will
-                                not be executed after a plugin completes
-                                (only used for build-step plugins)
+        :param plugin_request: dict, plugin request
+        :param keep_going: bool, whether to keep going after unexpected failure
+        :return: tuple (plugin_name, plugin_class, plugin_conf, is_allowed_to_fail,
+                 timeout), None if the plugin should be skipped
         """
-        failed_msgs = []
-        plugin_successful = False
-        plugin_response = None
-        for plugin_request in self.plugins_conf:
-            plugin_successful = False
-            try:
-                plugin_name = plugin_request['name']
-            except (TypeError, KeyError):
-                msg = "invalid plugin request, no key 'name': %s" % plugin_request
+        try:
+            plugin_name = plugin_request['name']
+        except (TypeError, KeyError):
+            msg = "invalid plugin request, no key 'name': %s" % plugin_request
+            exc = None if keep_going else PluginFailedException(msg)
+            self.on_plugin_failed('?', exc)
+            logger.error(msg)
+            if keep_going:
+                return None
+
+            raise exc
+
+        plugin_conf = plugin_request.get("args", {})
+        try:
+            plugin_class = self.plugin_classes[plugin_name]
+        except KeyError:
+            if plugin_request.get('required', True):
+                msg = ("no such plugin: '%s', did you set "
+                       "the correct plugin type?") % plugin_name
                 exc = None if keep_going else PluginFailedException(msg)
-                self.on_plugin_failed('?', exc)
+                self.on_plugin_failed(plugin_name, exc)
                 logger.error(msg)
                 if keep_going:
-                    continue
+                    return None
 
                 raise exc
+            else:
+                # This plugin is marked as not being required
+                logger.warning("plugin '%s' requested but not available",
+                               plugin_name)
+                return None
+        try:
+            plugin_is_allowed_to_fail = plugin_request['is_allowed_to_fail']
+        except (TypeError, KeyError):
+            plugin_is_allowed_to_fail = getattr(plugin_class, "is_allowed_to_fail", True)
+
+        plugin_timeout = plugin_request.get('timeout')
+
+        return (plugin_name, plugin_class, plugin_conf, plugin_is_allowed_to_fail,
+                plugin_timeout)
+
+    @contextmanager
+    def _time_limit(self, timeout):
+        """
+        interrupt plugin running in current thread by PluginTimeoutException
+        when it doesn't finish in time
 
-            plugin_conf = plugin_request.get("args", {})
-            try:
-                plugin_class = self.plugin_classes[plugin_name]
-            except KeyError:
-                if plugin_request.get('required', True):
-                    msg = ("no such plugin: '%s', did you set "
-                           "the correct plugin type?") % plugin_name
-                    exc = None if keep_going else PluginFailedException(msg)
-                    self.on_plugin_failed(plugin_name, exc)
-                    logger.error(msg)
-                    if keep_going:
-                        continue
+        In the main thread, the exception is raised by SIGALRM handler the same
+        way as BuildCanceledException is raised when the build is canceled.
+        Other threads are interrupted once they execute python code.
 
-                    raise exc
-                else:
-                    # This plugin is marked as not being required
-                    logger.warning("plugin '%s' requested but not available",
-                                   plugin_name)
-                    continue
+        :param timeout: float, seconds, None if there's no time limit
+        """
+        if timeout is None:
+            yield
+            return
+        if timeout <= 0:
+            raise PluginTimeoutException()
+
+        def interrupt(*args):
+            raise PluginTimeoutException()
+
+        try:
+            previous_handler = signal.signal(signal.SIGALRM, interrupt)
+        except ValueError:
+            # not in main thread
+            lock = threading.Lock()
+            running = [True]
+            thread_id = threading.current_thread().ident
+
+            def interrupt_thread():
+                with lock:
+                    if running[0]:
+                        raise_in_thread(thread_id, PluginTimeoutException)
+
+            timer = threading.Timer(timeout, interrupt_thread)
+            timer.daemon = True
+            timer.start()
             try:
-                plugin_is_allowed_to_fail = plugin_request['is_allowed_to_fail']
-            except (TypeError, KeyError):
-                plugin_is_allowed_to_fail = getattr(plugin_class, "is_allowed_to_fail", True)
+                yield
+            finally:
+                with lock:
+                    running[0] = False
+                timer.cancel()
+        else:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+            try:
+                yield
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, previous_handler)
 
-            logger.debug("running plugin '%s'", plugin_name)
-            start_time = datetime.datetime.now()
+    def _run_plugin(self, plugin, failed_msgs, keep_going=False, buildstep_phase=False,
+                    plugin_instance=None, instance_error=None):
+        """
+        run single plugin and save its response, timestamp and duration
+
+        :param plugin: tuple, as returned by _get_plugin()
+        :param failed_msgs: list, messages about failed plugins are appended here
+        :param keep_going: bool, whether to keep going after unexpected failure
+        :param buildstep_phase: bool, whether this is a build-step plugin
+        :param plugin_instance: plugin instance, created here if not provided
+        :param instance_error: exception raised while creating plugin instance
+        :return: tuple (plugin_successful, plugin_response, stop), stop is True
+                 if no further plugins should be run
+        """
+        (plugin_name, plugin_class, plugin_conf, plugin_is_allowed_to_fail,
+         plugin_timeout) = plugin
 
-            plugin_response = None
-            skip_response = False
-            try:
+        logger.debug("running plugin '%s'", plugin_name)
+        start_time = datetime.datetime.now()
+
+        timeout = plugin_timeout
+        if self.deadline is not None:
+            time_left = self.deadline - time.time()
+            if timeout is None or time_left < timeout:
+                timeout = time_left
+
+        plugin_successful = False
+        plugin_response = None
+        skip_response = False
+        profiler = ResourceProfiler()
+        try:
+            if instance_error is not None:
+                raise instance_error
+            if plugin_instance is None:
                 plugin_instance = self.create_instance_from_plugin(plugin_class, plugin_conf)
-                self.save_plugin_timestamp(plugin_class.key, start_time)
+            self.save_plugin_timestamp(plugin_class.key, start_time)
+            with profiler, span(plugin_class.key, 'plugin'), self._time_limit(timeout):
                 plugin_response = plugin_instance.run()
-                plugin_successful = True
-                if buildstep_phase:
-                    assert isinstance(plugin_response, BuildResult)
-                    if plugin_response.is_failed():
-                        logger.error("Build step plugin %s failed: %s",
-                                     plugin_class.key,
-                                     plugin_response.fail_reason)
-                        self.on_plugin_failed(plugin_class.key,
-                                              plugin_response.fail_reason)
-                        plugin_successful = False
-                        self.plugins_results[plugin_class.key] = plugin_response
-                        break
-
-            except AutoRebuildCanceledException as ex:
-                # if auto rebuild is canceled, then just reraise
-                # NOTE: We need to catch and reraise explicitly, so that the below except clause
-                #   doesn't catch this and make PluginFailedException out of it in the end
-                #   (calling methods would then need to parse exception message to see if
-                #   AutoRebuildCanceledException was raised here)
+            plugin_successful = True
+            if buildstep_phase:
+                assert isinstance(plugin_response, BuildResult)
+                if plugin_response.is_failed():
+                    logger.error("Build step plugin %s failed: %s",
+                                 plugin_class.key,
+                                 plugin_response.fail_reason)
+                    self.on_plugin_failed(plugin_class.key,
+                                          plugin_response.fail_reason)
+                    plugin_successful = False
+                    self.plugins_results[plugin_class.key] = plugin_response
+                    return plugin_successful, plugin_response, True
+
+        except AutoRebuildCanceledException as ex:
+            # if auto rebuild is canceled, then just reraise
+            # NOTE: We need to catch and reraise explicitly, so that the below except clause
+            #   doesn't catch this and make PluginFailedException out of it in the end
+            #   (calling methods would then need to parse exception message to see if
+            #   AutoRebuildCanceledException was raised here)
+            raise
+        except InappropriateBuildStepError:
+            logger.debug('Build step %s is not appropriate', plugin_class.key)
+            # don't put None, in results for InappropriateBuildStepError
+            skip_response = True
+            if not buildstep_phase:
                 raise
-            except InappropriateBuildStepError:
-                logger.debug('Build step %s is not appropriate', plugin_class.key)
-                # don't put None, in results for InappropriateBuildStepError
-                skip_response = True
-                if not buildstep_phase:
-                    raise
-            except Exception as ex:
-                msg = "plugin '%s' raised an exception: %r" % (plugin_class.key, ex)
-                logger.debug(traceback.format_exc())
+        except Exception as ex:
+            if isinstance(ex, PluginTimeoutException):
+                if self.deadline is not None and time.time() >= self.deadline:
+                    ex = PluginTimeoutException("build deadline exceeded")
+                    # build can't continue
+                    plugin_is_allowed_to_fail = False
+                else:
+                    ex = PluginTimeoutException("plugin timed out after %ss" %
+                                                plugin_timeout)
+            msg = "plugin '%s' raised an exception: %r" % (plugin_class.key, ex)
+            logger.debug(traceback.format_exc())
+            if not plugin_is_allowed_to_fail:
+                self.on_plugin_failed(plugin_class.key, ex)
+
+            if plugin_is_allowed_to_fail or keep_going:
+                logger.warning(msg)
+                logger.info("error is not fatal, continuing...")
                 if not plugin_is_allowed_to_fail:
-                    self.on_plugin_failed(plugin_class.key, ex)
+                    failed_msgs.append(msg)
+            else:
+                logger.error(msg)
+                raise PluginFailedException(msg)
+
+            plugin_response = ex
+
+        try:
+            if start_time:
+                finish_time = datetime.datetime.now()
+                duration = finish_time - start_time
+                seconds = duration.total_seconds()
+                logger.debug("plugin '%s' finished in %ds", plugin_name, seconds)
+                self.save_plugin_duration(plugin_class.key, seconds)
+            if profiler.usage is not None:
+                self.save_plugin_resource_usage(plugin_class.key, profiler.usage)
+        except Exception:
+            logger.exception("failed to save plugin duration")
+
+        if not skip_response:
+            self.plugins_results[plugin_class.key] = plugin_response
+
+        stop = plugin_successful and buildstep_phase
+        if stop:
+            logger.debug('stopping further execution of plugins '
+                         'after first successful plugin')
+        return plugin_successful, plugin_response, stop
+
+    def _run_in_thread(self, threads, *args, **kwargs):
+        """
+        run plugin in thread of thread pool, see _run_plugin()
 
-                if plugin_is_allowed_to_fail or keep_going:
-                    logger.warning(msg)
-                    logger.info("error is not fatal, continuing...")
-                    if not plugin_is_allowed_to_fail:
-                        failed_msgs.append(msg)
-                else:
-                    logger.error(msg)
-                    raise PluginFailedException(msg)
+        :param threads: dict, ID of the current thread is stored here
+                        under the key of the plugin
+        """
+        plugin_class = args[0][1]
+        threads[plugin_class.key] = threading.current_thread().ident
+        try:
+            return self._run_plugin(*args, **kwargs)
+        finally:
+            del threads[plugin_class.key]
+
+    def _run_concurrently(self, failed_msgs, keep_going=False):
+        """
+        run requested plugins on a thread pool
+
+        a plugin is started once all plugins requested before it which it
+        conflicts with (see plugins_conflict) finished. Plugins reading
+        BUILD_STATUS also wait for all plugins requested before them which
+        are not allowed to fail, but they don't hold back plugins requested
+        after them. Plugins which don't declare what they access are run in
+        the main thread, so that they can be interrupted by signal handlers.
+        After a fatal failure no more plugins are started, plugins which are
+        already running are allowed to finish.
+
+        :param failed_msgs: list, messages about failed plugins are appended here
+        :param keep_going: bool, whether to keep going after unexpected failure
+        """
+        pending = list(self.plugins_conf)
+        running = {}  # future -> plugin instance or class
+        fatal = set()  # futures of plugins which are not allowed to fail
+        threads = {}  # plugin key -> thread ID
+        error = None
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while True:
+                blockers = list(running.values())
+                # whether a plugin requested so far may still fail the build
+                status_pending = bool(fatal)
+                not_started = []
+                for plugin_request in pending:
+                    if error is not None or len(running) >= self.max_workers:
+                        not_started.append(plugin_request)
+                        continue
 
-                plugin_response = ex
+                    # invalid requests and unknown plugins are handled by _get_plugin()
+                    # once all plugins requested before them finished
+                    try:
+                        plugin_class = self.plugin_classes[plugin_request['name']]
+                    except (TypeError, KeyError):
+                        plugin_class = Plugin
+                    try:
+                        may_fail_build = not plugin_request['is_allowed_to_fail']
+                    except (TypeError, KeyError):
+                        may_fail_build = not plugin_class.is_allowed_to_fail
+                    if (any(plugins_conflict(plugin_class, other) for other in blockers) or
+                            (status_pending and BUILD_STATUS in (plugin_class.reads or ()))):
+                        # plugins requested later must not overtake it
+                        blockers.append(plugin_class)
+                        status_pending = status_pending or may_fail_build
+                        not_started.append(plugin_request)
+                        continue
 
-            try:
-                if start_time:
-                    finish_time = datetime.datetime.now()
-                    duration = finish_time - start_time
-                    seconds = duration.total_seconds()
-                    logger.debug("plugin '%s' finished in %ds", plugin_name, seconds)
-                    self.save_plugin_duration(plugin_class.key, seconds)
-            except Exception:
-                logger.exception("failed to save plugin duration")
-
-            if not skip_response:
-                self.plugins_results[plugin_class.key] = plugin_response
-
-            if plugin_successful and buildstep_phase:
-                logger.debug('stopping further execution of plugins '
-                             'after first successful plugin')
-                break
+                    try:
+                        plugin = self._get_plugin(plugin_request, keep_going)
+                        if plugin is not None and None in (plugin_class.reads,
+                                                           plugin_class.writes):
+                            self._run_plugin(plugin, failed_msgs, keep_going=keep_going)
+                            plugin = None
+                    except Exception as ex:
+                        error = ex
+                        continue
+                    if plugin is None:
+                        continue
+
+                    # plugin instance is created only now so that its constructor
+                    # doesn't run concurrently with conflicting plugins
+                    plugin_instance = instance_error = None
+                    try:
+                        plugin_instance = self.create_instance_from_plugin(plugin_class,
+                                                                           plugin[2])
+                    except Exception as ex:
+                        # reported by _run_plugin
+                        instance_error = ex
+
+                    future = executor.submit(self._run_in_thread, threads, plugin,
+                                             failed_msgs, keep_going=keep_going,
+                                             plugin_instance=plugin_instance,
+                                             instance_error=instance_error)
+                    running[future] = plugin_instance or plugin_class
+                    blockers.append(running[future])
+                    if may_fail_build:
+                        fatal.add(future)
+                        status_pending = True
+                pending = not_started
+
+                if not running:
+                    break
+
+                # don't block indefinitely so that signals are handled on python 2
+                done, _ = wait(list(running.keys()), timeout=1,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    fatal.discard(future)
+                    try:
+                        future.result()
+                    except Exception as ex:
+                        if error is None:
+                            error = ex
+        except BaseException as ex:
+            # e.g. BuildCanceledException raised by signal handler, interrupt
+            # plugins running in other threads the same way
+            for thread_id in list(threads.values()):
+                raise_in_thread(thread_id, type(ex))
+            raise
+        finally:
+            executor.shutdown(wait=True)
+
+        if error is not None:
+            raise error
+
+    def run(self, keep_going=False, buildstep_phase=False):
+        """
+        run all requested plugins
+
+        :param keep_going: bool, whether to keep going after unexpected
+                                 failure (only used for exit plugins)
+        :param buildstep_phase: bool, when True remaining plugins will
+                                not be executed after a plugin completes
+                                (only used for build-step plugins)
+        """
+        failed_msgs = []
+        plugin_successful = False
+        plugin_response = None
+        if self.max_workers > 1 and not buildstep_phase:
+            self._run_concurrently(failed_msgs, keep_going=keep_going)
+        else:
+            for plugin_request in self.plugins_conf:
+                plugin_successful = False
+                plugin = self._get_plugin(plugin_request, keep_going)
+                if plugin is None:
+                    continue
+
+                plugin_successful, plugin_response, stop = self._run_plugin(
+                    plugin, failed_msgs, keep_going=keep_going,
+                    buildstep_phase=buildstep_phase)
+                if stop:
+                    break
 
         if len(failed_msgs) == 1:
             raise PluginFailedException(failed_msgs[0])
@@ -326,6 +812,8 @@ class BuildPluginsRunner(PluginsRunner):
         """
         self.dt = dt
         self.workflow = workflow
+        # (plugin class, plugin args, instance) of plugins which started prefetch
+        self._prefetching_instances = []
         super(BuildPluginsRunner, self).__init__(plugin_class_name, plugins_conf, *args, **kwargs)
 
     def on_plugin_failed(self, plugin=None, exception=None):
@@ -339,6 +827,9 @@ class BuildPluginsRunner(PluginsRunner):
     def save_plugin_duration(self, plugin, duration):
         self.workflow.plugins_durations[plugin] = duration
 
+    def save_plugin_resource_usage(self, plugin, usage):
+        self.workflow.plugins_resource_usage[plugin] = usage
+
     def _translate_special_values(self, obj_to_translate):
         """
         you may want to write plugins for values which are not known before build:
@@ -387,10 +878,44 @@ class BuildPluginsRunner(PluginsRunner):
     def create_instance_from_plugin(self, plugin_class, plugin_conf):
         plugin_conf = self._translate_special_values(plugin_conf)
         plugin_conf = self._remove_unknown_args(plugin_class, plugin_conf)
+        for index, (prefetching_class, prefetching_conf, plugin_instance) in \
+                enumerate(self._prefetching_instances):
+            if prefetching_class is plugin_class and prefetching_conf == plugin_conf:
+                # constructor isn't run again
+                del self._prefetching_instances[index]
+                logger.info("running plugin instance which started prefetch with args: '%s'",
+                            plugin_conf)
+                return plugin_instance
         logger.info("running plugin instance with args: '%s'", plugin_conf)
         plugin_instance = plugin_class(self.dt, self.workflow, **plugin_conf)
         return plugin_instance
 
+    def prefetch(self):
+        """
+        let requested plugins start prefetching data they will need
+
+        Instances of the plugins are kept and run later, unless their
+        arguments change in the meantime. Failures are only logged, the
+        plugins fetch the data themselves when run.
+        """
+        for plugin_request in self.plugins_conf:
+            try:
+                plugin_class = self.plugin_classes[plugin_request['name']]
+            except (TypeError, KeyError):
+                continue  # reported when the plugin is run
+            if plugin_class.prefetch is None:
+                continue
+
+            try:
+                plugin_conf = self._translate_special_values(plugin_request.get('args', {}))
+                plugin_conf = self._remove_unknown_args(plugin_class, plugin_conf)
+                plugin_instance = plugin_class(self.dt, self.workflow, **plugin_conf)
+                plugin_instance.prefetch()
+            except Exception as ex:
+                logger.debug("prefetch of plugin %s failed: %r", plugin_class.key, ex)
+            else:
+                self._prefetching_instances.append((plugin_class, plugin_conf, plugin_instance))
+
 
 class PreBuildPlugin(BuildPlugin):
     pass
@@ -538,6 +1063,13 @@ class InputPluginsRunner(PluginsRunner):
         self.plugins_results = {}
         self.autoinput = self.plugins_conf[0]['name'] == 'auto'
 
+    def get_requested_plugins(self):
+        # "auto" input needs to check all input plugins
+        keys = super(InputPluginsRunner, self).get_requested_plugins()
+        if 'auto' in keys:
+            return None
+        return keys
+
     def run(self, *args, **kwargs):
         """Wrap `PluginsRunner.run()` while implementing the `auto` input behaviour.
 
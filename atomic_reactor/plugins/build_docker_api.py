@@ -7,6 +7,9 @@ of the BSD license. See the LICENSE file for details.
 """
 from __future__ import print_function, unicode_literals
 
+import os
+import tempfile
+
 from atomic_reactor.plugin import BuildStepPlugin
 from atomic_reactor.util import wait_for_command
 from atomic_reactor.build import BuildResult
@@ -16,6 +19,11 @@ class DockerApiPlugin(BuildStepPlugin):
     """
     buildstep plugin
     builds image using docker api
+
+    Output of the build is written to a temporary docker-build-*.log file
+    outside of the workdir, which is removed at the end of the build, so
+    that logs of the build result can still be read afterwards; its path
+    is logged.
     """
 
     key = 'docker_api'
@@ -41,7 +49,14 @@ class DockerApiPlugin(BuildStepPlugin):
                                                      builder.image)
 
         self.log.debug('build is submitted, waiting for it to finish')
-        command_result = wait_for_command(logs_gen)
+        # output is written to file so that it isn't kept in memory, the
+        # workflow removes it once exit plugins are done with it
+        self.workflow.remove_build_log()
+        fd, log_file = tempfile.mkstemp(prefix='docker-build-', suffix='.log')
+        os.close(fd)
+        self.workflow.build_log_path = log_file
+        self.log.info('writing build output to %s', log_file)
+        command_result = wait_for_command(logs_gen, log_file=log_file)
 
         if command_result.is_failed():
             return BuildResult(logs=command_result.logs,
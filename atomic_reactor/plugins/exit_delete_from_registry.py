@@ -28,6 +28,8 @@ class DeleteFromRegistryPlugin(ExitPlugin):
 
     key = "delete_from_registry"
     is_allowed_to_fail = False
+    reads = ('push_conf.docker',)
+    writes = ('push_conf.docker',)
 
     def __init__(self, tasker, workflow, registries):
         """
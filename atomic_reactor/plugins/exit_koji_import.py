@@ -14,7 +14,7 @@ import time
 from tempfile import NamedTemporaryFile
 
 from atomic_reactor import start_time as atomic_reactor_start_time
-from atomic_reactor.plugin import ExitPlugin
+from atomic_reactor.plugin import BUILD_STATUS, ExitPlugin
 from atomic_reactor.source import GitSource
 from atomic_reactor.plugins.build_orchestrate_build import (get_worker_build_info,
                                                             get_koji_upload_dir)
@@ -57,6 +57,9 @@ class KojiImportPlugin(ExitPlugin):
 
     key = PLUGIN_KOJI_IMPORT_PLUGIN_KEY
     is_allowed_to_fail = False
+    reads = (BUILD_STATUS, 'tag_conf', 'push_conf.docker', 'push_conf.pulp', 'dockerfile',
+             'source', PLUGIN_PULP_PULL_KEY)
+    writes = ()
 
     def __init__(self, tasker, workflow, kojihub, url,
                  verify_ssl=True, use_auth=True,
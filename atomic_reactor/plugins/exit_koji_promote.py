@@ -19,7 +19,7 @@ import copy
 
 from atomic_reactor import __version__ as atomic_reactor_version
 from atomic_reactor import start_time as atomic_reactor_start_time
-from atomic_reactor.plugin import ExitPlugin
+from atomic_reactor.plugin import BUILD_STATUS, ExitPlugin
 from atomic_reactor.source import GitSource
 from atomic_reactor.plugins.post_rpmqa import PostBuildRPMqaPlugin
 from atomic_reactor.plugins.pre_add_filesystem import AddFilesystemPlugin
@@ -66,6 +66,9 @@ class KojiPromotePlugin(ExitPlugin):
 
     key = PLUGIN_KOJI_PROMOTE_PLUGIN_KEY
     is_allowed_to_fail = False
+    reads = (BUILD_STATUS, 'image', 'base_image', 'tag_conf', 'push_conf.docker', 'push_conf.pulp',
+             'exported_image_sequence', 'dockerfile', 'source')
+    writes = ()
 
     def __init__(self, tasker, workflow, kojihub, url,
                  verify_ssl=True, use_auth=True,
@@ -214,17 +217,19 @@ class KojiPromotePlugin(ExitPlugin):
 
         return self.parse_rpm_output(output.splitlines(), tags, separator=sep)
 
-    def get_output_metadata(self, path, filename):
+    def get_output_metadata(self, path, filename, md5sum=None):
         """
         Describe a file by its metadata.
 
+        :param md5sum: str, md5 checksum of the file if already known
         :return: dict
         """
 
-        checksums = get_checksums(path, ['md5'])
+        if md5sum is None:
+            md5sum = get_checksums(path, ['md5'])['md5sum']
         metadata = {'filename': filename,
                     'filesize': os.path.getsize(path),
-                    'checksum': checksums['md5sum'],
+                    'checksum': md5sum,
                     'checksum_type': 'md5'}
 
         if self.metadata_only:
@@ -334,7 +339,11 @@ class KojiPromotePlugin(ExitPlugin):
         docker_logs = NamedTemporaryFile(prefix="docker-%s" % self.build_id,
                                          suffix=".log",
                                          mode='wb')
-        docker_logs.write("\n".join(self.workflow.build_result.logs).encode('utf-8'))
+        # build logs may be huge, don't join them in memory
+        for index, line in enumerate(self.workflow.build_result.logs):
+            if index:
+                docker_logs.write(b"\n")
+            docker_logs.write(line.encode('utf-8'))
         docker_logs.flush()
         output.append(Output(file=docker_logs,
                              metadata=self.get_output_metadata(docker_logs.name,
@@ -379,7 +388,8 @@ class KojiPromotePlugin(ExitPlugin):
         """
 
         image_id = self.workflow.builder.image_id
-        saved_image = self.workflow.exported_image_sequence[-1].get('path')
+        exported_image = self.workflow.exported_image_sequence[-1]
+        saved_image = exported_image.get('path')
         ext = saved_image.split('.', 1)[1]
         name_fmt = 'docker-image-{id}.{arch}.{ext}'
         image_name = name_fmt.format(id=image_id, arch=arch, ext=ext)
@@ -387,7 +397,8 @@ class KojiPromotePlugin(ExitPlugin):
             metadata = self.get_output_metadata(os.path.devnull, image_name)
             output = Output(file=None, metadata=metadata)
         else:
-            metadata = self.get_output_metadata(saved_image, image_name)
+            metadata = self.get_output_metadata(saved_image, image_name,
+                                                md5sum=exported_image.get('md5sum'))
             output = Output(file=open(saved_image), metadata=metadata)
 
         return metadata, output
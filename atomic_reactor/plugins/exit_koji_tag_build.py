@@ -10,7 +10,7 @@ from __future__ import unicode_literals
 
 from atomic_reactor.constants import PLUGIN_KOJI_TAG_BUILD_KEY
 from atomic_reactor.koji_util import create_koji_session, tag_koji_build
-from atomic_reactor.plugin import ExitPlugin
+from atomic_reactor.plugin import BUILD_STATUS, ExitPlugin
 from atomic_reactor.plugins.exit_koji_import import KojiImportPlugin
 from atomic_reactor.plugins.exit_koji_promote import KojiPromotePlugin
 
@@ -33,6 +33,8 @@ class KojiTagBuildPlugin(ExitPlugin):
 
     key = PLUGIN_KOJI_TAG_BUILD_KEY
     is_allowed_to_fail = False
+    reads = (BUILD_STATUS, KojiImportPlugin.key, KojiPromotePlugin.key)
+    writes = ()
 
     def __init__(self, tasker, workflow, kojihub, target,
                  koji_ssl_certs=None, koji_proxy_user=None,
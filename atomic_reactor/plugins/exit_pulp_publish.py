@@ -42,7 +42,7 @@ from __future__ import print_function, unicode_literals
 
 from atomic_reactor.constants import PLUGIN_PULP_PUBLISH_KEY
 from atomic_reactor.plugins.build_orchestrate_build import get_worker_build_info
-from atomic_reactor.plugin import ExitPlugin
+from atomic_reactor.plugin import BUILD_STATUS, ExitPlugin
 from atomic_reactor.util import ImageName
 from atomic_reactor.pulp_util import PulpHandler
 
@@ -50,6 +50,8 @@ from atomic_reactor.pulp_util import PulpHandler
 class PulpPublishPlugin(ExitPlugin):
     key = PLUGIN_PULP_PUBLISH_KEY
     is_allowed_to_fail = False
+    reads = (BUILD_STATUS, 'tag_conf')
+    writes = ()
 
     def __init__(self, tasker, workflow, pulp_registry_name,
                  pulp_secret_path=None, username=None, password=None,
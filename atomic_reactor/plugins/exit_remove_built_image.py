@@ -8,7 +8,8 @@ of the BSD license. See the LICENSE file for details.
 
 Remove built image (this only makes sense if you store the image in some registry first)
 """
-from atomic_reactor.plugin import ExitPlugin
+from atomic_reactor.core import AsyncDockerTasker
+from atomic_reactor.plugin import BUILD_STATUS, ExitPlugin
 
 from docker.errors import APIError
 
@@ -25,6 +26,8 @@ def defer_removal(workflow, image):
 
 class GarbageCollectionPlugin(ExitPlugin):
     key = "remove_built_image"
+    reads = (BUILD_STATUS, 'image', 'base_image')
+    writes = ('image', 'base_image')
 
     def __init__(self, tasker, workflow, remove_pulled_base_image=True):
         """
@@ -39,20 +42,32 @@ class GarbageCollectionPlugin(ExitPlugin):
         self.remove_base_image = remove_pulled_base_image
 
     def run(self):
+        if self.workflow.keeps_checkpoint:
+            self.log.info("build can be resumed from checkpoint, keeping images")
+            return
+
         image = self.workflow.builder.image_id
         if image:
             self.remove_image(image, force=True)
 
+        # remaining images are independent of each other, remove them at once
+        images = {}
         if self.remove_base_image and self.workflow.pulled_base_images:
             # FIXME: we may need to add force here, let's try it like this for now
             # FIXME: when ID of pulled img matches an ID of an image already present, don't remove
             for base_image_tag in self.workflow.pulled_base_images:
-                self.remove_image(base_image_tag, force=False)
+                images[base_image_tag] = False
 
         workspace = self.workflow.plugin_workspace.get(self.key, {})
         images_to_remove = workspace.get('images_to_remove', [])
         for image in images_to_remove:
-            self.remove_image(image, force=True)
+            images[image] = True
+
+        with AsyncDockerTasker(self.tasker) as async_tasker:
+            futures = [async_tasker.submit(self.remove_image, image, force=force)
+                       for image, force in images.items()]
+        for future in futures:
+            future.result()
 
     def remove_image(self, image, force=False):
         try:
@@ -14,7 +14,7 @@ try:
 except ImportError:
     from urllib.parse import urljoin
 
-from atomic_reactor.plugin import ExitPlugin, PluginFailedException
+from atomic_reactor.plugin import BUILD_STATUS, ExitPlugin, PluginFailedException
 from atomic_reactor.plugins.pre_check_and_set_rebuild import is_rebuild
 from atomic_reactor.plugins.exit_koji_import import KojiImportPlugin
 from atomic_reactor.plugins.exit_koji_promote import KojiPromotePlugin
@@ -42,6 +42,8 @@ class SendMailPlugin(ExitPlugin):
         }]
     """
     key = "sendmail"
+    reads = (BUILD_STATUS, KojiImportPlugin.key, KojiPromotePlugin.key)
+    writes = ()
 
     # symbolic constants for states
     MANUAL_SUCCESS = 'manual_success'
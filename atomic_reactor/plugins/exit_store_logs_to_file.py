@@ -17,6 +17,8 @@ __all__ = ('StoreLogsToFilePlugin', )
 
 class StoreLogsToFilePlugin(ExitPlugin):
     key = "store_logs_to_file"
+    # reads and writes are left undeclared: log output of all plugins run
+    # before this one is stored, so it has to run alone
 
     def __init__(self, tasker, workflow, file_path):
         """
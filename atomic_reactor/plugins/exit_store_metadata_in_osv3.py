@@ -22,6 +22,7 @@ from atomic_reactor.constants import (PLUGIN_KOJI_IMPORT_PLUGIN_KEY,
                                       PLUGIN_KOJI_UPLOAD_PLUGIN_KEY,
                                       PLUGIN_PULP_PUSH_KEY,
                                       PLUGIN_ADD_FILESYSTEM_KEY)
+from atomic_reactor.core import get_retry_metrics
 from atomic_reactor.plugin import ExitPlugin
 from atomic_reactor.util import get_build_json
 
@@ -29,6 +30,8 @@ from atomic_reactor.util import get_build_json
 class StoreMetadataInOSv3Plugin(ExitPlugin):
     key = "store_metadata_in_osv3"
     is_allowed_to_fail = False
+    # reads and writes are left undeclared: results, errors and durations of
+    # all plugins run before this one are stored, so it has to run alone
 
     def __init__(self, tasker, workflow, url, verify_ssl=True, use_auth=True):
         """
@@ -131,6 +134,8 @@ class StoreMetadataInOSv3Plugin(ExitPlugin):
             "errors": self.workflow.plugins_errors,
             "timestamps": self.workflow.plugins_timestamps,
             "durations": self.workflow.plugins_durations,
+            "resource_usage": self.workflow.plugins_resource_usage,
+            "docker_retries": get_retry_metrics(),
         }
 
     def make_labels(self):
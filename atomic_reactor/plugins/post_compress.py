@@ -6,7 +6,9 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
+from functools import partial
 import gzip
+import hashlib
 try:
     # if we import "lzma" first, we get pyliblzma on Py2, but we want backports.lzma
     #  so first try to import backports.lzma on Py2 and then 'lzma' on Py3
@@ -14,10 +16,152 @@ try:
 except ImportError:
     import lzma
 import os
+import shutil
+import tarfile
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from atomic_reactor.compression import (ParallelCompressor, compress_gzip_block,
+                                        compress_xz_block)
 from atomic_reactor.constants import EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE
+from atomic_reactor.export import (TAR_BLOCK_SIZE, copy_stream, get_layer_diff_ids,
+                                   is_layer_member, read_exactly, tar_member_name,
+                                   tar_member_size)
+from atomic_reactor.largefile import open_large_file
+from atomic_reactor.layer_store import DEFAULT_LAYER_STORE_MAX_SIZE, LayerStore
 from atomic_reactor.plugin import PostBuildPlugin
-from atomic_reactor.util import get_exported_image_metadata, human_size
+from atomic_reactor.util import ChecksumFile, cache_checksums, human_size
+
+
+class Codec(object):
+    """
+    compression method supported by CompressPlugin; codecs are registered
+    in CODECS by their names, which are used as values of `method` argument
+    """
+
+    def __init__(self, name, extension, default_level, min_level, max_level):
+        """
+        :param name: str, name of the method, e.g. 'gzip'
+        :param extension: str, extension of compressed image, e.g. 'gz'
+        :param default_level: int, compression level used by default
+        :param min_level: int, lowest supported compression level
+        :param max_level: int, highest supported compression level
+        """
+        self.name = name
+        self.extension = extension
+        self.default_level = default_level
+        self.min_level = min_level
+        self.max_level = max_level
+
+    def check_level(self, level):
+        """
+        :param level: int or None, compression level
+        :return: int, level to use
+        """
+        if level is None:
+            return self.default_level
+        if not self.min_level <= level <= self.max_level:
+            raise RuntimeError('Unsupported {0} compression level {1}, use {2}-{3}'.format(
+                self.name, level, self.min_level, self.max_level))
+        return level
+
+    def open(self, fileobj, level, threads):
+        """
+        :param fileobj: file object compressed data are written to, it's not
+                        closed with the returned file object
+        :param level: int, compression level
+        :param threads: int, number of compressing threads, number of CPUs
+                        when None
+        :return: file object compressing data written to it
+        """
+        raise NotImplementedError
+
+
+class GzipCodec(Codec):
+    def open(self, fileobj, level, threads):
+        if threads == 1:
+            return gzip.GzipFile(filename='', mode='wb', compresslevel=level, fileobj=fileobj)
+        return ParallelCompressor(fileobj, partial(compress_gzip_block, level=level),
+                                  threads=threads)
+
+
+class LzmaCodec(Codec):
+    def open(self, fileobj, level, threads):
+        if threads == 1:
+            return lzma.LZMAFile(fileobj, 'wb', preset=level)
+        return ParallelCompressor(fileobj, partial(compress_xz_block, preset=level),
+                                  threads=threads)
+
+
+class ZstdCodec(Codec):
+    def open(self, fileobj, level, threads):
+        if zstandard is None:
+            raise RuntimeError('zstd compression requires the zstandard module')
+        # zstandard: 0 compresses in the calling thread, -1 uses all CPUs
+        if threads == 1:
+            threads = 0
+        elif threads is None:
+            threads = -1
+        compressor = zstandard.ZstdCompressor(level=level, threads=threads)
+        return compressor.stream_writer(fileobj, closefd=False)
+
+
+CODECS = {}
+
+
+def register_codec(codec):
+    """
+    make compression method available to CompressPlugin
+
+    :param codec: Codec instance
+    """
+    CODECS[codec.name] = codec
+
+
+register_codec(GzipCodec('gzip', 'gz', default_level=6, min_level=1, max_level=9))
+register_codec(LzmaCodec('lzma', 'xz', default_level=6, min_level=0, max_level=9))
+register_codec(ZstdCodec('zstd', 'zst', default_level=3, min_level=1, max_level=22))
+
+
+class TeeWriter(object):
+    """
+    file-like object writing data to several file objects
+    """
+
+    def __init__(self, *fileobjs):
+        self.fileobjs = fileobjs
+
+    def write(self, data):
+        for fileobj in self.fileobjs:
+            fileobj.write(data)
+
+    def flush(self):
+        for fileobj in self.fileobjs:
+            fileobj.flush()
+
+
+def copy_layer(stream, fp, size):
+    """
+    copy layer from stream to fp, computing its digest
+
+    :param fp: file object or None when layer is only read
+    :param size: int, size of layer
+    :return: str, digest of layer, 'sha256:...'
+    """
+    digest = hashlib.sha256()
+    copied = 0
+    while copied < size:
+        data = stream.read(min(CHUNK_SIZE, size - copied))
+        if not data:
+            raise RuntimeError('Unexpected end of image tarball')
+        digest.update(data)
+        if fp is not None:
+            fp.write(data)
+        copied += len(data)
+    return 'sha256:' + digest.hexdigest()
 
 
 class CompressPlugin(PostBuildPlugin):
@@ -31,49 +175,182 @@ class CompressPlugin(PostBuildPlugin):
             }
     }]
 
-    Currently supported compression methods are gzip and lzma; gzip is default.
+    Currently supported compression methods are gzip, lzma and zstd (needs
+    the zstandard module); gzip is default. Compression level is set by
+    `level`, defaults are 6 for gzip and lzma and 3 for zstd.
     By default, the plugin doesn't work on exported image, you have to explicitly
     ask for it by using `load_exported_image: true`.
+
+    Image is compressed by as many threads as there are CPUs, unless `threads`
+    is set.
+
+    With `layer_store` set to a directory, compressed layers are kept there
+    (see atomic_reactor.layer_store) and layers found in it aren't compressed
+    again; the result is then a concatenation of compressed streams (layers
+    and data around them), which decompresses to the same image tarball.
+    Layers are looked up by diff IDs from the manifest of the image, which
+    is at the end of the tarball, so only layers of exported image file
+    (`load_exported_image`) can be found; layers of image streamed from
+    docker are only added to the store.
     """
     key = 'compress'
     is_allowed_to_fail = False
 
     # TODO: add remove_former_image?
-    def __init__(self, tasker, workflow, load_exported_image=False, method='gzip'):
+    def __init__(self, tasker, workflow, load_exported_image=False, method='gzip',
+                 layer_store=None, layer_store_max_size=DEFAULT_LAYER_STORE_MAX_SIZE,
+                 threads=None, level=None):
         """
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
         :param load_exported_image: bool, when running squash plugin with `dont_load=True`,
                                     you may load the exported tar with this switch
+        :param method: str, 'gzip', 'lzma' or 'zstd'
+        :param layer_store: str, directory of node-local layer store or None
+        :param layer_store_max_size: int, max size of layer store in bytes
+        :param threads: int, number of threads compressing the image, number
+                        of CPUs by default; with more than one thread, blocks
+                        of image are compressed as separate gzip members or
+                        xz streams
+        :param level: int, compression level, default level of the method
+                      when None
         """
         super(CompressPlugin, self).__init__(tasker, workflow)
         self.load_exported_image = load_exported_image
         self.method = method
+        self.codec = CODECS.get(method)
+        self.level = level
+        if self.codec is not None:
+            self.level = self.codec.check_level(level)
         self.uncompressed_size = 0
+        self.threads = threads
+        self.layer_store = None
+        if layer_store:
+            self.layer_store = LayerStore(layer_store, max_size=layer_store_max_size)
+
+    def _open_compressed(self, fileobj):
+        """
+        :param fileobj: file object compressed data are written to, it's not
+                        closed with the returned file object
+        :return: file object compressing data written to it
+        """
+        return self.codec.open(fileobj, self.level, self.threads)
 
-    def _compress_image_stream(self, stream):
+    def compress_image_stream(self, stream):
         outfile = os.path.join(self.workflow.source.workdir,
                                EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE)
-        if self.method == 'gzip':
-            outfile = outfile.format('gz')
-            fp = gzip.open(outfile, 'wb', compresslevel=6)
-        elif self.method == 'lzma':
-            outfile = outfile.format('xz')
-            fp = lzma.open(outfile, 'wb')
-        else:
+        if self.codec is None:
             raise RuntimeError('Unsupported compression format {0}'.format(self.method))
+        outfile = outfile.format(self.codec.extension)
 
-        _chunk_size = 1024**2  # 1 MB chunk size for reading/writing
-        self.log.info('compressing image %s to %s using %s method',
-                      self.workflow.image, outfile, self.method)
-        data = stream.read(_chunk_size)
-        while data != b'':
-            fp.write(data)
-            data = stream.read(_chunk_size)
+        self.log.info('compressing image %s to %s using %s method, level %d',
+                      self.workflow.image, outfile, self.method, self.level)
+        layer_diff_ids = {}
+        if self.layer_store is not None:
+            layer_diff_ids = self._get_layer_diff_ids(stream)
+        # checksums are computed while the data pass through
+        stream = ChecksumFile(stream)
+        with open_large_file(outfile, 'wb') as out_file:
+            out = ChecksumFile(out_file)
+            if self.layer_store is None:
+                with self._open_compressed(out) as fp:
+                    copy_stream(stream, fp)
+            else:
+                self._compress_layers(stream, out, layer_diff_ids)
+                self.layer_store.prune()
 
-        self.uncompressed_size = stream.tell()
+        cache_checksums(outfile, out.get_checksums())
+        metadata = {
+            'path': outfile,
+            'size': out.size,
+            'compression': self.method,
+            'compression_level': self.level,
+        }
+        metadata.update(out.get_checksums())
+        self.uncompressed_size = stream.size
+        for name, checksum in stream.get_checksums().items():
+            metadata['uncompressed_' + name] = checksum
+        return metadata
 
-        return outfile
+    def _get_layer_diff_ids(self, stream):
+        """
+        read manifest of image tarball without reading its layers
+
+        :param stream: file object of image tarball
+        :return: dict, name of layer.tar member -> diff ID of the layer;
+                 empty when the image isn't read from a file
+        """
+        path = getattr(stream, 'name', None)
+        if not path or not os.path.isfile(path):
+            self.log.debug('image is not read from file, layers can only be added to store')
+            return {}
+        try:
+            with tarfile.open(path, mode='r:') as image_tar:
+                return get_layer_diff_ids(image_tar)
+        except (tarfile.TarError, KeyError, ValueError) as ex:
+            self.log.warning("can't read manifest of image %s: %r", path, ex)
+            return {}
+
+    def _compress_layers(self, stream, out, layer_diff_ids):
+        """
+        compress image tarball, taking compressed layers from layer store
+
+        :param layer_diff_ids: dict, name of layer.tar member -> diff ID
+        """
+        fp = self._open_compressed(out)
+        try:
+            while True:
+                header = read_exactly(stream, TAR_BLOCK_SIZE)
+                if len(header) < TAR_BLOCK_SIZE or header == TAR_BLOCK_SIZE * b'\0':
+                    # end of archive
+                    fp.write(header)
+                    copy_stream(stream, fp)
+                    break
+
+                data_size = tar_member_size(header)
+                padded_size = -(-data_size // TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+                fp.write(header)
+                if is_layer_member(header) and data_size:
+                    fp.close()
+                    diff_id = layer_diff_ids.get(tar_member_name(header))
+                    self._copy_compressed_layer(stream, data_size, out, diff_id)
+                    fp = self._open_compressed(out)
+                    copy_stream(stream, fp, padded_size - data_size)
+                else:
+                    copy_stream(stream, fp, padded_size)
+        finally:
+            fp.close()
+
+    def _get_compressed_key(self, diff_id):
+        return '{0}.{1}-{2}'.format(diff_id, self.method, self.level)
+
+    def _copy_compressed_layer(self, stream, layer_size, out, diff_id=None):
+        """
+        read layer from stream and write it compressed to out; compressed
+        layer is taken from layer store when it's there, otherwise the layer
+        is compressed to out and to the store at once
+
+        :param diff_id: str, diff ID of the layer from image manifest or None
+        """
+        compressed = None
+        if diff_id is not None:
+            compressed = self.layer_store.open(self._get_compressed_key(diff_id))
+        if compressed is not None:
+            with compressed:
+                # the layer is read anyway, make sure manifest matches it
+                if copy_layer(stream, None, layer_size) != diff_id:
+                    raise RuntimeError("Layer doesn't match diff ID {0}".format(diff_id))
+                self.log.debug('using compressed layer %s from layer store', diff_id)
+                shutil.copyfileobj(compressed, out, CHUNK_SIZE)
+            return
+
+        with self.layer_store.writer() as compressed_layer:
+            with self._open_compressed(TeeWriter(out, compressed_layer)) as fp:
+                layer_diff_id = copy_layer(stream, fp, layer_size)
+            if diff_id is not None and layer_diff_id != diff_id:
+                raise RuntimeError("Layer doesn't match diff ID {0}".format(diff_id))
+            self.log.debug('compressed layer %s', layer_diff_id)
+            compressed_layer.key = self._get_compressed_key(layer_diff_id)
 
     def run(self):
         if self.load_exported_image:
@@ -81,14 +358,14 @@ class CompressPlugin(PostBuildPlugin):
                 raise RuntimeError('load_exported_image used, but no exported image')
             image = self.workflow.exported_image_sequence[-1].get('path')
             self.log.info('preparing to compress image %s', image)
-            with open(image, 'rb') as image_stream:
-                outfile = self._compress_image_stream(image_stream)
+            with open_large_file(image) as image_stream:
+                metadata = self.compress_image_stream(image_stream)
         else:
             image = self.workflow.image
             self.log.info('fetching image %s from docker', image)
             with self.tasker.d.get_image(image) as image_stream:
-                outfile = self._compress_image_stream(image_stream)
-        metadata = get_exported_image_metadata(outfile)
+                metadata = self.compress_image_stream(image_stream)
+        outfile = metadata['path']
 
         if self.uncompressed_size != 0:
             metadata['uncompressed_size'] = self.uncompressed_size
@@ -100,3 +377,6 @@ class CompressPlugin(PostBuildPlugin):
 
         self.workflow.exported_image_sequence.append(metadata)
         self.log.info('compressed image is available as %s', outfile)
+
+
+CHUNK_SIZE = 1024**2  # 1 MB chunk size for reading/writing
@@ -14,7 +14,8 @@ Usage:
     'name': 'cp_built_image_to_nfs',
     'args': { 'nfs_server_path': 'server:path',
               'dest_dir': 'dest_dir',
-              'mountpoint': '/tmp/mountpoint/' }
+              'mountpoint': '/tmp/mountpoint/',
+              'workers': 4 }
 
 }
 
@@ -23,10 +24,10 @@ Usage:
 from __future__ import unicode_literals
 
 import os
-import shutil
 import subprocess
 import errno
 from atomic_reactor.plugin import PostBuildPlugin
+from atomic_reactor.util import copy_file, get_checksums
 
 
 __all__ = ('CopyBuiltImageToNFSPlugin', )
@@ -64,13 +65,15 @@ class CopyBuiltImageToNFSPlugin(PostBuildPlugin):
     1. mount NFS
     2. create subdir (`dest_dir`)
     3. copy squashed image to $NFS/$dest_dir/
+    4. verify sha256 checksum of the copy, when the checksum of the image
+       is known
     """
 
     key = "cp_built_image_to_nfs"
     is_allowed_to_fail = False
 
     def __init__(self, tasker, workflow, nfs_server_path, dest_dir=None,
-                 mountpoint=DEFAULT_MOUNTPOINT):
+                 mountpoint=DEFAULT_MOUNTPOINT, workers=1, verify=True):
         """
         constructor
 
@@ -80,12 +83,17 @@ class CopyBuiltImageToNFSPlugin(PostBuildPlugin):
         :param dest_dir: this directory will be created in NFS and the built image will be copied
                          into it, if not specified, copy to root of NFS
         :param mountpoint: str, path where NFS share will be mounted
+        :param workers: int, number of parts of the image copied concurrently
+        :param verify: bool, compare sha256 checksum of the copy with checksum
+                       recorded for the exported image
         """
         # call parent constructor
         super(CopyBuiltImageToNFSPlugin, self).__init__(tasker, workflow)
         self.nfs_server_path = nfs_server_path
         self.dest_dir = dest_dir
         self.mountpoint = mountpoint
+        self.workers = workers
+        self.verify = verify
         self.absolute_dest_dir = self.mountpoint
         if self.dest_dir:
             self.absolute_dest_dir = os.path.join(self.mountpoint, self.dest_dir)
@@ -97,10 +105,23 @@ class CopyBuiltImageToNFSPlugin(PostBuildPlugin):
         self.log.debug("mount NFS %r at %s", self.nfs_server_path, self.mountpoint)
         mount(self.nfs_server_path, self.mountpoint)
 
+    def verify_copy(self, path, sha256sum):
+        if not sha256sum:
+            self.log.debug("checksum of image unknown, not verifying %s", path)
+            return
+
+        self.log.info("verifying checksum of %s", path)
+        copied_sha256sum = get_checksums(path, ['sha256'])['sha256sum']
+        if copied_sha256sum != sha256sum:
+            os.remove(path)
+            raise RuntimeError("checksum of %s is %s, expected %s" %
+                               (path, copied_sha256sum, sha256sum))
+
     def run(self):
         if len(self.workflow.exported_image_sequence) == 0:
             raise RuntimeError('no exported image to upload to nfs')
-        source_path = self.workflow.exported_image_sequence[-1].get("path")
+        exported_image = self.workflow.exported_image_sequence[-1]
+        source_path = exported_image.get("path")
         if not source_path or not os.path.isfile(source_path):
             raise RuntimeError("squashed image does not exist: %s", source_path)
 
@@ -120,11 +141,14 @@ class CopyBuiltImageToNFSPlugin(PostBuildPlugin):
 
         self.log.info("starting copying the image; this may take a while")
         try:
-            shutil.copy2(source_path, self.absolute_dest_dir)
+            copy_file(source_path, expected_image_path, workers=self.workers)
         except (IOError, OSError) as ex:
             self.log.error("couldn't copy %s into %s: %r", source_path, self.dest_dir, ex)
             raise
 
+        if self.verify:
+            self.verify_copy(expected_image_path, exported_image.get('sha256sum'))
+
         if os.path.isfile(os.path.join(self.absolute_dest_dir, fname)):
             self.log.debug("CopyBuiltImagePlugin.run() success")
         else:
@@ -0,0 +1,249 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Export built image from docker once and pass it to all consumers concurrently.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+
+from atomic_reactor.constants import EXPORTED_DELTA_IMAGE_NAME, EXPORTED_SQUASHED_IMAGE_NAME
+from atomic_reactor.export import (DEFAULT_MAX_QUEUED_CHUNKS, get_base_diff_ids, tee,
+                                   write_delta_image)
+from atomic_reactor.largefile import open_large_file
+from atomic_reactor.overlay2 import DEFAULT_EXPORT_WORKERS, Overlay2Exporter
+from atomic_reactor.plugin import PostBuildPlugin
+from atomic_reactor.plugins.post_compress import CHUNK_SIZE, CompressPlugin
+from atomic_reactor.util import ChecksumFile, cache_checksums
+
+
+__all__ = ('ExportImagePlugin', 'get_delta_image')
+
+
+def get_delta_image(workflow):
+    """
+    :param workflow: DockerBuildWorkflow instance
+    :return: dict, metadata of delta image exported by export_image plugin
+             (path, size, md5sum, sha256sum, omitted_layers) or None
+    """
+    results = workflow.postbuild_results.get(ExportImagePlugin.key) or {}
+    return results.get('delta')
+
+
+class ExportImagePlugin(PostBuildPlugin):
+    """
+    Read 'docker save' output of built image once and feed it to consumers:
+
+    * tarball: the image is saved as $workdir/image.tar, its size and
+      checksums are computed while it's written
+    * compressed: the image is compressed like the compress plugin does,
+      when `compress` is set
+    Consumers run concurrently; reading from docker waits for the slowest of
+    them. When `compress` uses a layer store, the image is compressed from
+    the saved tarball afterwards instead, so that compressed layers can be
+    found in the store by diff IDs from the manifest at its end; the tarball
+    is then removed unless `save_tarball` is set.
+
+    When `delta` is true, the image without layers of the base image is
+    then saved as $workdir/image-delta.tar. It's made from the saved
+    tarball, which is removed afterwards unless `save_tarball` is set, as
+    layers can be identified only by manifest.json at its end. The delta
+    image isn't added to exported_image_sequence, plugins which can upload
+    it (pulp_push) get it by get_delta_image().
+
+    The tarball, then the compressed image, are added to
+    exported_image_sequence, so that pulp_push, cp_built_image_to_nfs and
+    koji uploads use them without exporting the image again.
+
+    With `backend` set to 'overlay2', the image tarball is put together from
+    overlay2 storage of the daemon by `workers` threads (see
+    atomic_reactor.overlay2), when atomic-reactor runs on the host which has
+    the storage available; 'docker save' is used otherwise and when the
+    export fails, e.g. because layer files don't match diff IDs. Other
+    consumers then read the tarball.
+
+    Example configuration:
+
+    "postbuild_plugins": [{
+            "name": "export_image",
+            "args": {
+                    "compress": {"method": "gzip", "level": 6}
+            }
+    }]
+    """
+
+    key = 'export_image'
+    is_allowed_to_fail = False
+    reads = ('image',)
+    writes = ('exported_image_sequence',)
+
+    def __init__(self, tasker, workflow, save_tarball=True, compress=None, delta=False,
+                 max_queued_chunks=DEFAULT_MAX_QUEUED_CHUNKS, backend='docker',
+                 workers=DEFAULT_EXPORT_WORKERS):
+        """
+        constructor
+
+        :param tasker: DockerTasker instance
+        :param workflow: DockerBuildWorkflow instance
+        :param save_tarball: bool, save uncompressed image tarball
+        :param compress: dict, arguments of compress plugin (method, level,
+                         threads, layer_store, layer_store_max_size), the
+                         image isn't compressed when None
+        :param delta: bool, save also image without layers of base image
+        :param max_queued_chunks: int, max number of 1 MB chunks of image
+                                  waiting for each consumer
+        :param backend: str, 'docker' to read 'docker save' output, 'overlay2'
+                        to read layers from storage of the daemon
+        :param workers: int, number of layers exported concurrently by
+                        overlay2 backend
+        """
+        super(ExportImagePlugin, self).__init__(tasker, workflow)
+        self.save_tarball = save_tarball
+        self.delta = delta
+        self.max_queued_chunks = max_queued_chunks
+        if backend not in ('docker', 'overlay2'):
+            raise RuntimeError('Unsupported export backend {0}'.format(backend))
+        self.backend = backend
+        self.workers = workers
+        self.compressor = None
+        if compress is not None:
+            self.compressor = CompressPlugin(tasker, workflow, **compress)
+
+    def save_image_tarball(self, stream):
+        path = os.path.join(self.workflow.source.workdir, EXPORTED_SQUASHED_IMAGE_NAME)
+        self.log.info('saving image %s to %s', self.workflow.image, path)
+        with open_large_file(path, 'wb') as image_file:
+            out = ChecksumFile(image_file)
+            shutil.copyfileobj(stream, out, CHUNK_SIZE)
+
+        cache_checksums(path, out.get_checksums())
+        metadata = {'path': path, 'size': out.size}
+        metadata.update(out.get_checksums())
+        return metadata
+
+    def checksum_image_tarball(self, stream):
+        path = os.path.join(self.workflow.source.workdir, EXPORTED_SQUASHED_IMAGE_NAME)
+        checksums = ChecksumFile(stream)
+        while checksums.read(CHUNK_SIZE):
+            pass
+
+        cache_checksums(path, checksums.get_checksums())
+        metadata = {'path': path, 'size': checksums.size}
+        metadata.update(checksums.get_checksums())
+        return metadata
+
+    def get_overlay2_exporter(self):
+        """
+        :return: Overlay2Exporter instance or None when it can't be used
+        """
+        if self.backend != 'overlay2':
+            return None
+        exporter = Overlay2Exporter.from_docker_info(self.tasker.get_info(),
+                                                     workers=self.workers)
+        if exporter is None:
+            self.log.warning('overlay2 storage not available, using docker save')
+        return exporter
+
+    def export_overlay2(self, exporter, path):
+        """
+        write image tarball straight from overlay2 storage
+
+        :param exporter: Overlay2Exporter instance
+        :param path: str, path to image tarball
+        :return: bool, False if the image couldn't be exported, e.g. because
+                 files of a layer don't match its diff ID
+        """
+        image = self.workflow.image
+        image_id = self.tasker.inspect_image(image)['Id']
+        try:
+            exporter.export(image_id, path, repo_tags=[str(image)])
+        except (RuntimeError, ValueError, KeyError, IOError, OSError) as ex:
+            self.log.warning('exporting image from overlay2 storage failed, '
+                             'using docker save: %r', ex)
+            if os.path.exists(path):
+                os.remove(path)
+            return False
+        return True
+
+    def compress_image(self, stream):
+        metadata = self.compressor.compress_image_stream(stream)
+        if self.compressor.uncompressed_size != 0:
+            metadata['uncompressed_size'] = self.compressor.uncompressed_size
+        return metadata
+
+    def save_delta_image(self, image_path):
+        path = os.path.join(self.workflow.source.workdir, EXPORTED_DELTA_IMAGE_NAME)
+        try:
+            base_image_inspect = self.workflow.base_image_inspect
+        except KeyError:
+            base_image_inspect = {}
+        image_inspect = self.tasker.inspect_image(self.workflow.image)
+        base_diff_ids = get_base_diff_ids(base_image_inspect or {}, image_inspect)
+
+        self.log.info('saving image %s without %d base image layers to %s',
+                      self.workflow.image, len(base_diff_ids), path)
+        with open_large_file(image_path) as image_file, \
+                open_large_file(path, 'wb') as delta_file:
+            out = ChecksumFile(delta_file)
+            omitted = write_delta_image(image_file, out, base_diff_ids)
+
+        cache_checksums(path, out.get_checksums())
+        metadata = {'path': path, 'size': out.size, 'omitted_layers': omitted}
+        metadata.update(out.get_checksums())
+        return metadata
+
+    def run(self):
+        compress_saved = self.compressor is not None and self.compressor.layer_store is not None
+        # files made from the saved tarball after it's exported
+        tarball_needed = self.delta or compress_saved
+        consumers = {}
+        if self.save_tarball or tarball_needed:
+            consumers['tarball'] = self.save_image_tarball
+        if self.compressor is not None and not compress_saved:
+            consumers['compressed'] = self.compress_image
+        if not consumers:
+            self.log.info('nothing to export')
+            return None
+
+        image = self.workflow.image
+        path = os.path.join(self.workflow.source.workdir, EXPORTED_SQUASHED_IMAGE_NAME)
+        self.log.info('exporting image %s to %s', image, ', '.join(sorted(consumers)))
+        overlay2_exporter = self.get_overlay2_exporter()
+        if overlay2_exporter is not None and not self.export_overlay2(overlay2_exporter, path):
+            overlay2_exporter = None
+        if overlay2_exporter is not None:
+            # tarball is written by the exporter, the rest of consumers read it
+            consumers.pop('tarball', None)
+            if self.save_tarball:
+                consumers['tarball'] = self.checksum_image_tarball
+            results = {}
+            if consumers:
+                with open_large_file(path) as image_stream:
+                    results = tee(image_stream, consumers, chunk_size=CHUNK_SIZE,
+                                  max_queued=self.max_queued_chunks)
+        else:
+            with self.tasker.d.get_image(image) as image_stream:
+                results = tee(image_stream, consumers, chunk_size=CHUNK_SIZE,
+                              max_queued=self.max_queued_chunks)
+
+        if compress_saved:
+            with open_large_file(path) as image_file:
+                results['compressed'] = self.compress_image(image_file)
+        if self.delta:
+            results['delta'] = self.save_delta_image(path)
+        if not self.save_tarball and (tarball_needed or overlay2_exporter is not None):
+            # tarball was needed only to make other files
+            results.pop('tarball', None)
+            os.remove(path)
+
+        for name in ('tarball', 'compressed'):
+            if name in results:
+                self.workflow.exported_image_sequence.append(results[name])
+        return results
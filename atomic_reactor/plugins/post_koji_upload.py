@@ -9,13 +9,14 @@ of the BSD license. See the LICENSE file for details.
 from __future__ import unicode_literals
 
 from collections import namedtuple
+import json
 import os
 import subprocess
 from tempfile import NamedTemporaryFile
 import copy
 
 from atomic_reactor import __version__ as atomic_reactor_version
-from atomic_reactor.plugin import PostBuildPlugin
+from atomic_reactor.plugin import BUILD_STATUS, PostBuildPlugin
 from atomic_reactor.plugins.post_rpmqa import PostBuildRPMqaPlugin
 from atomic_reactor.constants import PROG, PLUGIN_KOJI_UPLOAD_PLUGIN_KEY
 from atomic_reactor.util import (get_version_of_tools, get_checksums,
@@ -74,12 +75,15 @@ class KojiUploadPlugin(PostBuildPlugin):
 
     key = PLUGIN_KOJI_UPLOAD_PLUGIN_KEY
     is_allowed_to_fail = False
+    reads = (BUILD_STATUS, 'image', 'base_image', 'tag_conf', 'push_conf.docker', 'push_conf.pulp',
+             'exported_image_sequence', PostBuildRPMqaPlugin.key)
+    writes = ()
 
     def __init__(self, tasker, workflow, kojihub, url, build_json_dir,
                  koji_upload_dir, verify_ssl=True, use_auth=True,
                  koji_ssl_certs_dir=None, koji_proxy_user=None,
                  koji_principal=None, koji_keytab=None,
-                 blocksize=None, prefer_schema1_digest=True):
+                 blocksize=None, prefer_schema1_digest=True, upload_trace=False):
         """
         constructor
 
@@ -98,6 +102,9 @@ class KojiUploadPlugin(PostBuildPlugin):
         :param blocksize: int, blocksize to use for uploading files
         :param prefer_schema1_digest: bool, when True, v2 schema 1 digest will
             be preferred as the built image digest
+        :param upload_trace: bool, when True, trace of the build so far
+            (in Chrome trace event format) is uploaded as a log; the build
+            is traced only when trace_file is set in the build json
         """
         super(KojiUploadPlugin, self).__init__(tasker, workflow)
 
@@ -112,6 +119,7 @@ class KojiUploadPlugin(PostBuildPlugin):
         self.build_json_dir = build_json_dir
         self.koji_upload_dir = koji_upload_dir
         self.prefer_schema1_digest = prefer_schema1_digest
+        self.upload_trace = upload_trace
 
         self.namespace = get_build_json().get('metadata', {}).get('namespace', None)
         osbs_conf = Configuration(conf_file=None, openshift_uri=url,
@@ -223,17 +231,19 @@ class KojiUploadPlugin(PostBuildPlugin):
 
         return self.parse_rpm_output(output.splitlines(), tags, separator=sep)
 
-    def get_output_metadata(self, path, filename):
+    def get_output_metadata(self, path, filename, md5sum=None):
         """
         Describe a file by its metadata.
 
+        :param md5sum: str, md5 checksum of the file if already known
         :return: dict
         """
 
-        checksums = get_checksums(path, ['md5'])
+        if md5sum is None:
+            md5sum = get_checksums(path, ['md5'])['md5sum']
         metadata = {'filename': filename,
                     'filesize': os.path.getsize(path),
-                    'checksum': checksums['md5sum'],
+                    'checksum': md5sum,
                     'checksum_type': 'md5'}
 
         return metadata
@@ -340,11 +350,27 @@ class KojiUploadPlugin(PostBuildPlugin):
         docker_logs = NamedTemporaryFile(prefix="docker-%s" % self.build_id,
                                          suffix=".log",
                                          mode='wb')
-        docker_logs.write("\n".join(self.workflow.build_result.logs).encode('utf-8'))
+        # build logs may be huge, don't join them in memory
+        for index, line in enumerate(self.workflow.build_result.logs):
+            if index:
+                docker_logs.write(b"\n")
+            docker_logs.write(line.encode('utf-8'))
         docker_logs.flush()
         output.append(Output(file=docker_logs,
                              metadata=self.get_output_metadata(docker_logs.name,
                                                                "build.log")))
+
+        if self.upload_trace and self.workflow.tracer is None:
+            self.log.warning("build isn't traced, set trace_file to upload its trace")
+        elif self.upload_trace:
+            trace = NamedTemporaryFile(prefix="trace-%s" % self.build_id,
+                                       suffix=".json",
+                                       mode='wb')
+            trace.write(json.dumps(self.workflow.tracer.get_trace()).encode('utf-8'))
+            trace.flush()
+            output.append(Output(file=trace,
+                                 metadata=self.get_output_metadata(trace.name,
+                                                                   "trace.json")))
         return output
 
     def get_image_components(self):
@@ -382,11 +408,13 @@ class KojiUploadPlugin(PostBuildPlugin):
         """
 
         image_id = self.workflow.builder.image_id
-        saved_image = self.workflow.exported_image_sequence[-1].get('path')
+        exported_image = self.workflow.exported_image_sequence[-1]
+        saved_image = exported_image.get('path')
         ext = saved_image.split('.', 1)[1]
         name_fmt = 'docker-image-{id}.{arch}.{ext}'
         image_name = name_fmt.format(id=image_id, arch=arch, ext=ext)
-        metadata = self.get_output_metadata(saved_image, image_name)
+        metadata = self.get_output_metadata(saved_image, image_name,
+                                            md5sum=exported_image.get('md5sum'))
         output = Output(file=open(saved_image), metadata=metadata)
 
         return metadata, output
@@ -15,9 +15,11 @@ discover the image ID Docker will give it.
 
 from __future__ import unicode_literals
 
-from atomic_reactor.constants import PLUGIN_PULP_PUSH_KEY, PLUGIN_PULP_SYNC_KEY
-from atomic_reactor.plugin import PostBuildPlugin, ExitPlugin
-from atomic_reactor.plugins.exit_remove_built_image import defer_removal
+from atomic_reactor.constants import (PLUGIN_PULP_PUBLISH_KEY, PLUGIN_PULP_PUSH_KEY,
+                                      PLUGIN_PULP_SYNC_KEY)
+from atomic_reactor.plugin import BUILD_STATUS, PostBuildPlugin, ExitPlugin
+from atomic_reactor.plugins.exit_remove_built_image import (defer_removal,
+                                                            GarbageCollectionPlugin)
 from atomic_reactor.util import get_manifest_digests
 import requests
 from time import time, sleep
@@ -35,6 +37,9 @@ class CraneTimeoutError(Exception):
 class PulpPullPlugin(ExitPlugin, PostBuildPlugin):
     key = 'pulp_pull'
     is_allowed_to_fail = False
+    # waits for the image to be published in Crane by pulp_publish
+    reads = (BUILD_STATUS, 'tag_conf', 'push_conf.pulp', PLUGIN_PULP_PUBLISH_KEY)
+    writes = ('image', GarbageCollectionPlugin.key)
 
     def __init__(self, tasker, workflow,
                  timeout=600, retry_delay=30,
@@ -46,7 +46,9 @@ import os
 import subprocess
 
 from atomic_reactor.constants import PLUGIN_PULP_SYNC_KEY, PLUGIN_PULP_PUSH_KEY
+from atomic_reactor.largefile import drop_cache
 from atomic_reactor.plugin import PostBuildPlugin
+from atomic_reactor.plugins.post_export_image import ExportImagePlugin, get_delta_image
 from atomic_reactor.util import ImageName, are_plugins_in_order
 from atomic_reactor.pulp_util import PulpHandler
 
@@ -54,10 +56,13 @@ from atomic_reactor.pulp_util import PulpHandler
 class PulpPushPlugin(PostBuildPlugin):
     key = PLUGIN_PULP_PUSH_KEY
     is_allowed_to_fail = False
+    reads = ('image', 'tag_conf', 'exported_image_sequence', ExportImagePlugin.key)
+    writes = ('push_conf.pulp',)
 
     def __init__(self, tasker, workflow, pulp_registry_name, load_squashed_image=None,
                  load_exported_image=None, image_names=None, pulp_secret_path=None,
-                 username=None, password=None, dockpulp_loglevel=None, publish=True):
+                 username=None, password=None, dockpulp_loglevel=None, publish=True,
+                 load_delta_image=False):
         """
         constructor
 
@@ -72,6 +77,8 @@ class PulpPushPlugin(PostBuildPlugin):
         :param username: pulp username, used in preference to certificate and key
         :param password: pulp password, used in preference to certificate and key
         :param publish: Bool, whether to publish to crane or not
+        :param load_delta_image: bool, upload image without layers of base
+                                 image when export_image plugin saved it
         """
         # call parent constructor
         super(PulpPushPlugin, self).__init__(tasker, workflow)
@@ -85,6 +92,7 @@ class PulpPushPlugin(PostBuildPlugin):
             self.log.warning('load_squashed_image argument is obsolete and will be '
                              'removed in a future version; please use load_exported_image instead')
         self.load_exported_image = load_exported_image or load_squashed_image or False
+        self.load_delta_image = load_delta_image
         self.pulp_secret_path = pulp_secret_path
         self.username = username
         self.password = password
@@ -117,7 +125,8 @@ class PulpPushPlugin(PostBuildPlugin):
             # Strip existing layers from the tar and repack it
             remove_layers = [str(os.path.join(x, 'layer.tar')) for x in existing_imageids]
 
-            commands = {'.xz': 'xzcat', '.gz': 'zcat', '.bz2': 'bzcat', '.tar': 'cat'}
+            commands = {'.xz': 'xzcat', '.gz': 'zcat', '.bz2': 'bzcat', '.zst': 'zstdcat',
+                        '.tar': 'cat'}
             unpacker = commands.get(file_extension, None)
             self.log.debug("using unpacker %s for extension %s", unpacker, file_extension)
             if unpacker is None:
@@ -145,6 +154,9 @@ class PulpPushPlugin(PostBuildPlugin):
             except:
                 self.log.info("Falling back to full tar upload")
                 self.pulp_handler.upload(filename)
+        finally:
+            # the tarball was read by the unpacker
+            drop_cache(filename)
 
         for repo_id, pulp_repo in pulp_repos.items():
             for layer in layers:
@@ -179,7 +191,13 @@ class PulpPushPlugin(PostBuildPlugin):
             self.log.info("extending image names: %s", self.image_names)
             image_names += [ImageName.parse(x) for x in self.image_names]
 
-        if self.load_exported_image:
+        delta_image = get_delta_image(self.workflow) if self.load_delta_image else None
+        if delta_image is not None:
+            # base image layers are in Pulp already
+            self.log.info("pushing delta image without %d base image layers",
+                          len(delta_image['omitted_layers']))
+            top_layer, crane_repos = self.push_tar(delta_image['path'], image_names)
+        elif self.load_exported_image:
             if len(self.workflow.exported_image_sequence) == 0:
                 raise RuntimeError('no exported image to push to pulp')
             export_path = self.workflow.exported_image_sequence[-1].get("path")
@@ -8,14 +8,23 @@ of the BSD license. See the LICENSE file for details.
 
 from copy import deepcopy
 
+from concurrent.futures import ThreadPoolExecutor
+
+from atomic_reactor.core import AsyncDockerTasker
 from atomic_reactor.plugin import PostBuildPlugin
-from atomic_reactor.plugins.exit_remove_built_image import defer_removal
-from atomic_reactor.util import get_manifest_digests, get_config_from_registry
+from atomic_reactor.plugins.exit_remove_built_image import (defer_removal,
+                                                            GarbageCollectionPlugin)
+from atomic_reactor.util import (get_manifest_digests, get_config_from_registry,
+                                 get_manifest_media_type, query_registry, put_manifest,
+                                 propagate_call_counts)
 
 
 __all__ = ('TagAndPushPlugin', )
 
 
+DEFAULT_MAX_WORKERS = 4
+
+
 class TagAndPushPlugin(PostBuildPlugin):
     """
     Use tags from workflow.tag_conf and push the images to workflow.push_conf
@@ -23,8 +32,11 @@ class TagAndPushPlugin(PostBuildPlugin):
 
     key = "tag_and_push"
     is_allowed_to_fail = False
+    reads = ('image', 'tag_conf')
+    writes = ('tag_conf', 'push_conf.docker', GarbageCollectionPlugin.key)
 
-    def __init__(self, tasker, workflow, registries):
+    def __init__(self, tasker, workflow, registries, max_workers=DEFAULT_MAX_WORKERS,
+                 push_once=False):
         """
         constructor
 
@@ -37,56 +49,140 @@ class TagAndPushPlugin(PostBuildPlugin):
                               plain HTTP.
                             * "secret" optional string - path to the secret, which stores
                               email, login and password for remote registry
+        :param max_workers: int, max number of registries pushed to at once
+        :param push_once: bool, push only first tag of each repository, upload
+                          its manifest under the other tags using registry API
         """
         # call parent constructor
         super(TagAndPushPlugin, self).__init__(tasker, workflow)
 
         self.registries = deepcopy(registries)
+        self.max_workers = max_workers
+        self.push_once = push_once
 
-    def run(self):
-        pushed_images = []
+        if self.workflow.tag_conf.unique_images:
+            # tag_conf is only modified when there's no unique image
+            self.writes = tuple(data for data in self.writes if data != 'tag_conf')
 
-        if not self.workflow.tag_conf.unique_images:
-            self.workflow.tag_conf.add_unique_image(self.workflow.image)
+    def push_to_registry(self, registry, registry_conf, pushed_images, digests_executor):
+        """
+        tag and push images to registry, tags are pushed one by one while
+        their digests are fetched in background
+
+        :param registry: str, docker registry
+        :param registry_conf: dict, per-registry parameters, see __init__()
+        :param pushed_images: list, images are appended to it as they're pushed
+        :param digests_executor: Executor, for fetching digests
+        :return: tuple, dict of digests by tag and config of image or None
+        """
+        insecure = registry_conf.get('insecure', False)
+        docker_push_secret = registry_conf.get('secret', None)
+        self.log.info("Registry %s secret %s", registry, docker_push_secret)
+
+        digest_futures = []
+        # repository -> manifest of its pushed tag, None when it can't be uploaded
+        manifests = {}
+        for image in self.workflow.tag_conf.images:
+            registry_image = image.copy()
+            registry_image.registry = registry
+            repository = registry_image.to_str(tag=False)
+
+            if manifests.get(repository):
+                self.tasker.tag_image(self.workflow.builder.image_id, registry_image, force=True)
+                self.log.info("uploading manifest of %s as %s", repository, registry_image)
+                put_manifest(registry_image, registry, manifests[repository],
+                             insecure=insecure, dockercfg_path=docker_push_secret)
+            else:
+                self.tasker.tag_and_push_image(self.workflow.builder.image_id,
+                                               registry_image, insecure=insecure,
+                                               force=True, dockercfg=docker_push_secret)
+                if self.push_once and repository not in manifests:
+                    manifests[repository] = self.get_manifest(registry_image, registry,
+                                                              insecure, docker_push_secret)
+            pushed_images.append(registry_image)
+
+            digest_futures.append((registry_image, digests_executor.submit(
+                propagate_call_counts(get_manifest_digests), registry_image, registry,
+                insecure, docker_push_secret)))
 
+        digests_by_tag = {}
         first_v2_digest = None
         first_registry_image = None
-        for registry, registry_conf in self.registries.items():
-            insecure = registry_conf.get('insecure', False)
-            push_conf_registry = \
-                self.workflow.push_conf.add_docker_registry(registry, insecure=insecure)
+        for registry_image, future in digest_futures:
+            digests = future.result()
+            digests_by_tag[registry_image.to_str(registry=False)] = digests
 
-            docker_push_secret = registry_conf.get('secret', None)
-            self.log.info("Registry %s secret %s", registry, docker_push_secret)
+            if not first_v2_digest and digests.v2:
+                first_v2_digest = digests.v2
+                first_registry_image = registry_image
 
-            for image in self.workflow.tag_conf.images:
-                if image.registry:
-                    raise RuntimeError("Image name must not contain registry: %r" % image.registry)
+        config = None
+        if first_v2_digest:
+            config = get_config_from_registry(
+                first_registry_image, registry, first_v2_digest, insecure,
+                docker_push_secret, 'v2')
+        else:
+            self.log.info("V2 schema 2 digest is not available")
 
-                registry_image = image.copy()
-                registry_image.registry = registry
-                self.tasker.tag_and_push_image(self.workflow.builder.image_id,
-                                               registry_image, insecure=insecure,
-                                               force=True, dockercfg=docker_push_secret)
+        return digests_by_tag, config
 
-                pushed_images.append(registry_image)
-                defer_removal(self.workflow, registry_image)
+    def get_manifest(self, image, registry, insecure, docker_push_secret):
+        """
+        :return: bytes, v2 schema 2 manifest of pushed image or None when
+                 registry doesn't provide it
+        """
+        media_type = get_manifest_media_type('v2')
+        response = query_registry(image, registry, insecure=insecure,
+                                  dockercfg_path=docker_push_secret, version='v2')
+        if response.headers.get('Content-Type') != media_type:
+            self.log.info("registry %s doesn't provide %s manifest for %s, "
+                          "pushing all tags", registry, media_type, image)
+            return None
+        return response.content
+
+    def run(self):
+        if not self.workflow.tag_conf.unique_images:
+            self.workflow.tag_conf.add_unique_image(self.workflow.image)
 
-                digests = get_manifest_digests(registry_image, registry,
-                                               insecure, docker_push_secret)
-                tag = registry_image.to_str(registry=False)
-                push_conf_registry.digests[tag] = digests
+        for image in self.workflow.tag_conf.images:
+            if image.registry:
+                raise RuntimeError("Image name must not contain registry: %r" % image.registry)
+
+        # registries are pushed to concurrently, failure of one doesn't stop
+        # pushes to the others
+        pushes = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as digests_executor, \
+                AsyncDockerTasker(self.tasker, max_workers=self.max_workers) as async_tasker:
+            for registry, registry_conf in self.registries.items():
+                push_conf_registry = self.workflow.push_conf.add_docker_registry(
+                    registry, insecure=registry_conf.get('insecure', False))
+                registry_images = []
+                future = async_tasker.submit(self.push_to_registry, registry, registry_conf,
+                                             registry_images, digests_executor)
+                pushes.append((registry, push_conf_registry, registry_images, future))
 
-                if not first_v2_digest and digests.v2:
-                    first_v2_digest = digests.v2
-                    first_registry_image = registry_image
+        pushed_images = []
+        failed = []
+        for registry, push_conf_registry, registry_images, future in pushes:
+            for registry_image in registry_images:
+                pushed_images.append(registry_image)
+                defer_removal(self.workflow, registry_image)
 
-            if first_v2_digest:
-                push_conf_registry.config = get_config_from_registry(
-                    first_registry_image, registry, first_v2_digest, insecure,
-                    docker_push_secret, 'v2')
-            else:
-                self.log.info("V2 schema 2 digest is not available")
+            try:
+                digests_by_tag, config = future.result()
+            except Exception as ex:
+                self.log.error("failed to push to registry %s: %r", registry, ex)
+                failed.append((registry, ex))
+                continue
+
+            push_conf_registry.digests.update(digests_by_tag)
+            push_conf_registry.config = config
+
+        if failed:
+            if len(failed) == 1:
+                raise failed[0][1]
+            raise RuntimeError("Failed to push to registries: %s" %
+                               ", ".join("%s (%s)" % (registry, ex) for registry, ex in failed))
 
         self.log.info("All images were tagged and pushed")
         return pushed_images
@@ -280,6 +280,7 @@ class AddFilesystemPlugin(PreBuildPlugin):
 
     def import_base_image(self, filesystem):
         result = self.tasker.d.import_image_from_stream(filesystem)
+        self.tasker.invalidate_image_cache()
         # Response not deserialized:
         #   https://github.com/docker/docker-py/issues/1060
         self.log.info('import base image result: %s', result)
@@ -25,6 +25,7 @@ Example configuration to add content of repo file at URL:
 """
 from atomic_reactor.constants import YUM_REPOS_DIR
 from atomic_reactor.plugin import PreBuildPlugin
+from atomic_reactor.prefetch import get_prefetched, start_prefetch
 from atomic_reactor.util import get_retrying_requests_session
 import os
 import os.path
@@ -57,11 +58,18 @@ class YumRepo(object):
     def dst_filename(self):
         return os.path.join(self.dst_repos_dir, self.filename)
 
-    def fetch(self):
+    @property
+    def prefetch_key(self):
+        return ('yum_repo', self.repourl)
+
+    def download(self):
         session = get_retrying_requests_session()
         response = session.get(self.repourl)
         response.raise_for_status()
-        self.content = response.content
+        return response.content
+
+    def fetch(self):
+        self.content = get_prefetched(self.prefetch_key, self.download)
 
     def is_valid(self):
         # Using BytesIO as configparser in 2.7 can't work with unicode
@@ -93,6 +101,8 @@ class YumRepo(object):
 class AddYumRepoByUrlPlugin(PreBuildPlugin):
     key = "add_yum_repo_by_url"
     is_allowed_to_fail = False
+    reads = ()
+    writes = ('files',)
 
     def __init__(self, tasker, workflow, repourls, inject_proxy=None):
         """
@@ -108,6 +118,14 @@ class AddYumRepoByUrlPlugin(PreBuildPlugin):
         self.repourls = repourls
         self.inject_proxy = inject_proxy
 
+    def prefetch(self):
+        """
+        start downloading the repo files
+        """
+        for repourl in self.repourls or []:
+            yumrepo = YumRepo(repourl)
+            start_prefetch(yumrepo.prefetch_key, yumrepo.download)
+
     def run(self):
         """
         run the plugin
@@ -9,6 +9,7 @@ of the BSD license. See the LICENSE file for details.
 from __future__ import unicode_literals
 
 from atomic_reactor.plugin import PreBuildPlugin
+from atomic_reactor.prefetch import get_prefetched, start_prefetch
 from atomic_reactor.util import get_all_label_keys, get_preferred_label_key, df_parser
 from atomic_reactor.koji_util import create_koji_session
 
@@ -20,6 +21,8 @@ class BumpReleasePlugin(PreBuildPlugin):
     """
 
     key = "bump_release"
+    reads = ('dockerfile', 'base_image')
+    writes = ('dockerfile',)
     is_allowed_to_fail = False  # We really want to stop the process
 
     # The target parameter is no longer used by this plugin. It's
@@ -44,6 +47,7 @@ class BumpReleasePlugin(PreBuildPlugin):
             koji_auth_info = {
                 'ssl_certs_dir': koji_ssl_certs_dir,
             }
+        self.hub = hub
         self.xmlrpc = create_koji_session(hub, koji_auth_info)
 
     def get_patched_release(self, original_release, increment=False):
@@ -63,19 +67,11 @@ class BumpReleasePlugin(PreBuildPlugin):
         return '.'.join([part for part in [release, suffix, rest]
                          if part is not None])
 
-    def run(self):
+    def get_component_version(self, dockerfile_labels):
         """
-        run the plugin
+        :param dockerfile_labels: dict, labels from Dockerfile
+        :return: tuple, component and version of the image
         """
-
-        parser = df_parser(self.workflow.builder.df_path, workflow=self.workflow)
-        release_labels = get_all_label_keys('release')
-        dockerfile_labels = parser.labels
-        if any(release_label in dockerfile_labels
-               for release_label in release_labels):
-            self.log.debug("release set explicitly so not incrementing")
-            return
-
         component_label = get_preferred_label_key(dockerfile_labels,
                                                   'com.redhat.component')
         try:
@@ -89,6 +85,14 @@ class BumpReleasePlugin(PreBuildPlugin):
         except KeyError:
             raise RuntimeError('missing label: {}'.format(version_label))
 
+        return component, version
+
+    def get_next_release(self, component, version):
+        """
+        ask Koji for the next release of component and version
+
+        :return: str, release of a build which doesn't exist yet
+        """
         build_info = {'name': component, 'version': version}
         self.log.debug('getting next release from build info: %s', build_info)
         next_release = self.get_patched_release(self.xmlrpc.getNextRelease(build_info))
@@ -106,6 +110,43 @@ class BumpReleasePlugin(PreBuildPlugin):
 
             next_release = self.get_patched_release(next_release, increment=True)
 
+        return next_release
+
+    def _next_release_key(self, component, version):
+        return ('next_release', self.hub, component, version)
+
+    def prefetch(self):
+        """
+        start asking Koji for the next release, using labels the Dockerfile
+        has at the beginning of the build
+        """
+        parser = df_parser(self.workflow.builder.df_path, workflow=self.workflow)
+        dockerfile_labels = parser.labels
+        if any(release_label in dockerfile_labels
+               for release_label in get_all_label_keys('release')):
+            return
+
+        component, version = self.get_component_version(dockerfile_labels)
+        start_prefetch(self._next_release_key(component, version),
+                       self.get_next_release, component, version)
+
+    def run(self):
+        """
+        run the plugin
+        """
+
+        parser = df_parser(self.workflow.builder.df_path, workflow=self.workflow)
+        release_labels = get_all_label_keys('release')
+        dockerfile_labels = parser.labels
+        if any(release_label in dockerfile_labels
+               for release_label in release_labels):
+            self.log.debug("release set explicitly so not incrementing")
+            return
+
+        component, version = self.get_component_version(dockerfile_labels)
+        next_release = get_prefetched(self._next_release_key(component, version),
+                                      self.get_next_release, component, version)
+
         # Always set preferred release label - other will be set if old-style
         # label is present
         preferred_release_label = get_preferred_label_key(dockerfile_labels,
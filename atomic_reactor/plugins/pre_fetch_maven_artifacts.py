@@ -16,6 +16,7 @@ from atomic_reactor import util
 from atomic_reactor.constants import DEFAULT_DOWNLOAD_BLOCK_SIZE
 from atomic_reactor.koji_util import create_koji_session
 from atomic_reactor.plugin import PreBuildPlugin
+from atomic_reactor.prefetch import get_prefetched, start_prefetch
 from collections import namedtuple
 
 try:
@@ -67,6 +68,8 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
 
     key = 'fetch_maven_artifacts'
     is_allowed_to_fail = False
+    reads = ('source',)
+    writes = ('source',)
 
     NVR_REQUESTS_FILENAME = 'fetch-artifacts-koji.yaml'
     URL_REQUESTS_FILENAME = 'fetch-artifacts-url.yaml'
@@ -125,19 +128,56 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
 
         return util.read_yaml(file_path, 'schemas/fetch-artifacts-url.json')
 
+    def get_maven_builds(self, session, nvrs):
+        """
+        look up builds and their maven archives
+
+        :param session: koji.ClientSession instance
+        :param nvrs: tuple of str, NVRs of builds
+        :return: dict, NVR -> (build info, list of archives), build info is
+                 None for builds which don't exist
+        """
+        builds = {}
+        for nvr in nvrs:
+            build_info = session.getBuild(nvr)
+            build_archives = []
+            if build_info:
+                build_archives = session.listArchives(buildID=build_info['id'],
+                                                      type='maven')
+            builds[nvr] = (build_info, build_archives)
+
+        return builds
+
+    def _maven_builds_key(self, nvrs):
+        return ('maven_builds', self.koji_info['hub'], nvrs)
+
+    def prefetch(self):
+        """
+        start looking up requested builds in Koji
+        """
+        def prefetch_builds(nvrs):
+            session = create_koji_session(self.koji_info['hub'], self.koji_info.get('auth'))
+            return self.get_maven_builds(session, nvrs)
+
+        nvrs = tuple(nvr_request.nvr for nvr_request in self.read_nvr_requests())
+        if nvrs:
+            start_prefetch(self._maven_builds_key(nvrs), prefetch_builds, nvrs)
+
     def process_by_nvr(self, nvr_requests):
         download_queue = []
         errors = []
 
+        nvrs = tuple(nvr_request.nvr for nvr_request in nvr_requests)
+        builds = get_prefetched(self._maven_builds_key(nvrs), self.get_maven_builds,
+                                self.session, nvrs)
+
         for nvr_request in nvr_requests:
-            build_info = self.session.getBuild(nvr_request.nvr)
+            build_info, build_archives = builds[nvr_request.nvr]
             if not build_info:
                 errors.append('Build {} not found.'.format(nvr_request.nvr))
                 continue
 
             maven_build_path = self.path_info.mavenbuild(build_info)
-            build_archives = self.session.listArchives(buildID=build_info['id'],
-                                                       type='maven')
             build_archives = nvr_request.match_all(build_archives)
 
             for build_archive in build_archives:
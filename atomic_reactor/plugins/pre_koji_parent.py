@@ -36,6 +36,8 @@ class KojiParentPlugin(PreBuildPlugin):
 
     key = 'koji_parent'
     is_allowed_to_fail = False
+    reads = ('base_image',)
+    writes = ()
 
     def __init__(self, tasker, workflow, koji_hub, koji_ssl_certs_dir=None,
                  poll_interval=DEFAULT_POLL_INTERVAL, poll_timeout=DEFAULT_POLL_TIMEOUT):
@@ -14,6 +14,7 @@ from __future__ import unicode_literals
 import docker
 
 from atomic_reactor.plugin import PreBuildPlugin
+from atomic_reactor.prefetch import get_prefetched, start_prefetch
 from atomic_reactor.util import get_build_json, ImageName
 
 
@@ -36,6 +37,25 @@ class PullBaseImagePlugin(PreBuildPlugin):
         self.parent_registry = parent_registry
         self.parent_registry_insecure = parent_registry_insecure
 
+    def _pull_key(self, image):
+        return ('pull_image', image.to_str(), self.parent_registry_insecure)
+
+    def prefetch(self):
+        """
+        start pulling base image
+        """
+        base_image = self.workflow.builder.base_image
+        if (self.parent_registry and base_image.registry and
+                base_image.registry != self.parent_registry):
+            return  # run() fails
+
+        base_image_with_registry = base_image.copy()
+        if self.parent_registry:
+            base_image_with_registry.registry = self.parent_registry
+        start_prefetch(self._pull_key(base_image_with_registry),
+                       self.tasker.pull_image, base_image_with_registry,
+                       insecure=self.parent_registry_insecure)
+
     def run(self):
         """
         pull base image
@@ -62,8 +82,9 @@ class PullBaseImagePlugin(PreBuildPlugin):
 
             base_image_with_registry.registry = self.parent_registry
 
-        pulled_base = self.tasker.pull_image(base_image_with_registry,
-                                             insecure=self.parent_registry_insecure)
+        pulled_base = get_prefetched(self._pull_key(base_image_with_registry),
+                                     self.tasker.pull_image, base_image_with_registry,
+                                     insecure=self.parent_registry_insecure)
         if (base_image_with_registry.namespace != 'library' and
                 not self.tasker.image_exists(base_image_with_registry.to_str())):
             self.log.info("'%s' not found", base_image_with_registry.to_str())
@@ -96,6 +96,8 @@ class PrePublishSquashPlugin(PrePublishPlugin):
                 # Older versions of the daemon do not include the prefix
                 new_id = 'sha256:{}'.format(new_id)
             self.workflow.builder.image_id = new_id
+            # squashed image was loaded by its own docker client
+            self.tasker.invalidate_image_cache()
 
         metadata.update(get_exported_image_metadata(metadata["path"]))
         self.workflow.exported_image_sequence.append(metadata)
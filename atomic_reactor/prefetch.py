@@ -0,0 +1,152 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Speculative prefetching: plugins may start fetching remote data they will
+need (pulled images, repo files, Koji builds) as soon as the build starts and
+get the results later, when they are actually run. Each prefetch is identified
+by a key: tuple naming the kind of data followed by everything the data depend
+on, e.g. ('koji_build', hub, nvr). When a plugin asks for a key which wasn't
+prefetched or whose prefetch failed, the data are fetched directly.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from atomic_reactor.tracing import span
+from atomic_reactor.util import propagate_call_counts
+
+
+logger = logging.getLogger(__name__)
+
+_prefetcher = None
+
+DEFAULT_PREFETCH_MAX_WORKERS = 4
+
+
+class Prefetcher(object):
+    """
+    runs prefetches in background threads and keeps their results
+    """
+
+    def __init__(self, max_workers=DEFAULT_PREFETCH_MAX_WORKERS):
+        """
+        constructor
+
+        :param max_workers: int, max number of prefetches running at once
+        """
+        self.max_workers = max_workers
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, function, *args, **kwargs):
+        """
+        start prefetch in background unless prefetch with the same key was
+        already started
+
+        :param key: tuple, identification of prefetched data
+        :param function: callable fetching the data
+        :return: Future instance
+        """
+        def prefetch():
+            with span(key[0], 'prefetch'):
+                return function(*args, **kwargs)
+
+        with self._lock:
+            if key not in self._futures:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                logger.debug("prefetching %s", key)
+                self._futures[key] = self._executor.submit(propagate_call_counts(prefetch))
+            return self._futures[key]
+
+    def get(self, key, function, *args, **kwargs):
+        """
+        get result of prefetch, waiting for it if it still runs; when nothing
+        was prefetched for the key or the prefetch failed, call function
+
+        Result of each prefetch is handed out only once.
+
+        :param key: tuple, identification of prefetched data
+        :param function: callable fetching the data, the same one which
+                         was passed to submit()
+        :return: result of function
+        """
+        with self._lock:
+            future = self._futures.pop(key, None)
+
+        if future is not None and not future.cancelled():
+            try:
+                result = future.result()
+            except Exception as ex:
+                logger.debug("prefetch of %s failed (%r), fetching again", key, ex)
+            else:
+                logger.debug("using prefetched %s", key)
+                return result
+
+        return function(*args, **kwargs)
+
+    def shutdown(self, wait=True):
+        """
+        cancel prefetches which haven't started and forget all results
+
+        :param wait: bool, wait for running prefetches to finish, so that
+                     they don't outlive the build
+        """
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures = {}
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def get_prefetcher():
+    """
+    :return: Prefetcher instance of running build or None
+    """
+    return _prefetcher
+
+
+def set_prefetcher(prefetcher):
+    """
+    set Prefetcher instance used by plugins
+
+    :param prefetcher: Prefetcher instance or None to stop prefetching
+    """
+    global _prefetcher
+    _prefetcher = prefetcher
+
+
+def start_prefetch(key, function, *args, **kwargs):
+    """
+    start prefetch using the active prefetcher, see Prefetcher.submit()
+
+    Nothing is done when there is no active prefetcher.
+    """
+    prefetcher = _prefetcher
+    if prefetcher is not None:
+        prefetcher.submit(key, function, *args, **kwargs)
+
+
+def get_prefetched(key, function, *args, **kwargs):
+    """
+    get prefetched data using the active prefetcher, see Prefetcher.get()
+
+    When there is no active prefetcher, function is called directly.
+    """
+    prefetcher = _prefetcher
+    if prefetcher is None:
+        return function(*args, **kwargs)
+    return prefetcher.get(key, function, *args, **kwargs)
@@ -14,6 +14,8 @@ import logging
 import warnings
 from collections import namedtuple
 
+from atomic_reactor.largefile import drop_cache
+
 try:
     import dockpulp
     from dockpulp import setup_logger
@@ -159,6 +161,8 @@ class PulpHandler(object):
 
     def upload(self, filename):
         self.p.upload(filename)
+        # dockpulp reads the file itself, only drop it from the cache afterwards
+        drop_cache(filename)
 
     def copy(self, repo_id, layer):
         self.p.copy(repo_id, layer)
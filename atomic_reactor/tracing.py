@@ -0,0 +1,259 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Tracing of builds: spans (named time intervals) of workflow phases,
+plugins and remote calls are collected by the active Tracer and can be
+exported in Chrome trace event format (chrome://tracing, Perfetto).
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+import types
+
+
+_tracer = None
+
+
+class Tracer(object):
+    """
+    collects spans of a build
+    """
+
+    def __init__(self):
+        self.events = []
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def add_span(self, name, category, start, duration, args=None):
+        """
+        add span which already finished
+
+        :param name: str, name of span
+        :param category: str, e.g. 'phase', 'plugin', 'docker', 'http', 'koji'
+        :param start: float, start time in seconds since the epoch
+        :param duration: float, duration in seconds
+        :param args: dict, additional information shown with the span
+        """
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int(start * 1000000),
+            'dur': int(duration * 1000000),
+            'pid': self._pid,
+            'tid': thread.ident,
+        }
+        if args:
+            event['args'] = args
+
+        with self._lock:
+            if thread.ident not in self._threads:
+                self._threads.add(thread.ident)
+                self.events.append({
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': self._pid,
+                    'tid': thread.ident,
+                    'args': {'name': thread.name},
+                })
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """
+        context manager adding span for the time spent in its body
+
+        :param name: str, name of span
+        :param category: str, see add_span()
+        :param args: additional information shown with the span
+        """
+        start = time.time()
+        try:
+            yield
+        except Exception as ex:
+            args['error'] = repr(ex)
+            raise
+        finally:
+            self.add_span(name, category, start, time.time() - start, args)
+
+    def get_trace(self):
+        """
+        :return: dict, trace in Chrome trace event format
+        """
+        with self._lock:
+            events = list(self.events)
+        return {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+        }
+
+    def write(self, path):
+        """
+        write trace to file
+
+        :param path: str, path of file
+        """
+        with open(path, 'w') as trace_file:
+            json.dump(self.get_trace(), trace_file)
+
+
+def get_tracer():
+    """
+    :return: Tracer instance collecting spans or None
+    """
+    return _tracer
+
+
+def set_tracer(tracer):
+    """
+    set Tracer instance which collects spans
+
+    :param tracer: Tracer instance or None to stop tracing
+    """
+    global _tracer
+    _tracer = tracer
+
+
+@contextmanager
+def span(name, category, **args):
+    """
+    add span to the active tracer, see Tracer.span()
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield
+    else:
+        with tracer.span(name, category, **args):
+            yield
+
+
+def add_span(name, category, start, duration, args=None):
+    """
+    add span to the active tracer, see Tracer.add_span()
+    """
+    tracer = _tracer
+    if tracer is not None:
+        tracer.add_span(name, category, start, duration, args)
+
+
+class _StreamSpan(object):
+    """
+    span of call which returned stream, it ends once the stream is
+    exhausted or closed
+    """
+
+    def __init__(self, tracer, name, category, start, stream):
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._start = start
+        self._finished = False
+        self.stream = stream
+
+    def finish(self, error=None):
+        if self._finished:
+            return
+        self._finished = True
+        args = {'error': repr(error)} if error is not None else None
+        self._tracer.add_span(self._name, self._category, self._start,
+                              time.time() - self._start, args)
+
+
+class TracedIterator(_StreamSpan):
+    """
+    iterator ending span of call which returned it when it's exhausted
+    """
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.stream)
+        except StopIteration:
+            self.finish()
+            raise
+        except Exception as ex:
+            self.finish(ex)
+            raise
+
+    next = __next__
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.finish()
+
+
+class TracedFile(_StreamSpan):
+    """
+    file-like object ending span of call which returned it when all of its
+    data are read or it's closed
+    """
+
+    def read(self, *args, **kwargs):
+        try:
+            data = self.stream.read(*args, **kwargs)
+        except Exception as ex:
+            self.finish(ex)
+            raise
+        if not data:
+            self.finish()
+        return data
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.finish()
+
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def trace_call(name, category, function, *args, **kwargs):
+    """
+    call function within span of the active tracer; when it returns
+    a stream (generator or file-like object), the span ends once the
+    stream is exhausted or closed
+
+    :param name: str, name of span
+    :param category: str, see Tracer.add_span()
+    :param function: callable
+    :return: result of function, streams are wrapped
+    """
+    tracer = _tracer
+    if tracer is None:
+        return function(*args, **kwargs)
+
+    start = time.time()
+    try:
+        result = function(*args, **kwargs)
+    except Exception as ex:
+        tracer.add_span(name, category, start, time.time() - start, {'error': repr(ex)})
+        raise
+    if isinstance(result, types.GeneratorType):
+        return TracedIterator(tracer, name, category, start, result)
+    if hasattr(result, 'read') and hasattr(result, 'close'):
+        return TracedFile(tracer, name, category, start, result)
+    tracer.add_span(name, category, start, time.time() - start)
+    return result
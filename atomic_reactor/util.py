@@ -8,7 +8,11 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import print_function, unicode_literals
 
+from collections import deque
+import errno
+import functools
 import hashlib
+import io
 import json
 import jsonschema
 import os
@@ -23,13 +27,21 @@ import subprocess
 import tempfile
 import logging
 import uuid
+import resource
+import threading
+import time
 import yaml
 import codecs
 import string
 
+from concurrent.futures import ThreadPoolExecutor
+
+from atomic_reactor.largefile import DEFAULT_WINDOW, advise_sequential, drop_cache,\
+    open_large_file
+from atomic_reactor.tracing import add_span
 from atomic_reactor.constants import DOCKERFILE_FILENAME, TOOLS_USED, INSPECT_CONFIG,\
                                      HTTP_MAX_RETRIES, HTTP_BACKOFF_FACTOR,\
-                                     HTTP_CLIENT_STATUS_RETRY
+                                     HTTP_CLIENT_STATUS_RETRY, COMMAND_RESULT_MAX_LINES
 
 from dockerfile_parse import DockerfileParser
 from pkg_resources import resource_stream
@@ -153,10 +165,66 @@ def figure_out_dockerfile(absolute_path, local_path=None):
     return df_path, df_dir
 
 
+class LogFile(object):
+    """
+    lines of log stored in a file; iterating over the instance reads them
+    back, so they don't have to be kept in memory
+    """
+
+    def __init__(self, path):
+        """
+        :param path: str, path of file, it is truncated
+        """
+        self.path = path
+        self._lines = 0
+        self._file = io.open(path, 'w', encoding='utf-8')
+
+    def write(self, line):
+        """
+        :param line: str, line without newline
+        """
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        self._file.write(line + '\n')
+        self._lines += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __iter__(self):
+        if self._file is not None:
+            self._file.flush()
+        with io.open(self.path, encoding='utf-8') as log_file:
+            for line in log_file:
+                yield line[:-1] if line.endswith('\n') else line
+
+    def __len__(self):
+        return self._lines
+
+    def __getstate__(self):
+        if self._file is not None:
+            self._file.flush()
+        state = self.__dict__.copy()
+        state['_file'] = None
+        return state
+
+
 class CommandResult(object):
-    def __init__(self):
-        self._logs = []
-        self._parsed_logs = []
+    def __init__(self, log_file=None, max_lines=None):
+        """
+        :param log_file: str, path of file where all lines of the output are
+                         written; when None, they are all kept in memory
+        :param max_lines: int, number of recent lines (and decoded items)
+                          kept in memory; when None, COMMAND_RESULT_MAX_LINES
+                          with log file, all of them otherwise
+        """
+        if max_lines is None and log_file:
+            max_lines = COMMAND_RESULT_MAX_LINES
+        self._log_file = LogFile(log_file) if log_file else None
+        self._logs = deque(maxlen=max_lines)
+        self._parsed_logs = deque(maxlen=max_lines)
         self._error = None
         self._error_detail = None
 
@@ -177,6 +245,8 @@ class CommandResult(object):
         for l in line.splitlines():
             l = l.strip()
             self._logs.append(l)
+            if self._log_file is not None:
+                self._log_file.write(l)
             if l:
                 logger.debug(l)
 
@@ -186,13 +256,37 @@ class CommandResult(object):
             if self._error:
                 logger.error(item)
 
+    def close(self):
+        """
+        close log file, all lines were parsed
+        """
+        if self._log_file is not None:
+            self._log_file.close()
+
     @property
     def parsed_logs(self):
-        return self._parsed_logs
+        """
+        :return: list of decoded items, only recent ones when their number
+                 is limited
+        """
+        return list(self._parsed_logs)
 
     @property
     def logs(self):
-        return self._logs
+        """
+        :return: LogFile with all lines when log file is used, otherwise list
+                 of lines kept in memory
+        """
+        if self._log_file is not None:
+            return self._log_file
+        return list(self._logs)
+
+    @property
+    def recent_logs(self):
+        """
+        :return: list of recent lines
+        """
+        return list(self._logs)
 
     @property
     def error(self):
@@ -206,16 +300,21 @@ class CommandResult(object):
         return bool(self.error) or bool(self.error_detail)
 
 
-def wait_for_command(logs_generator):
+def wait_for_command(logs_generator, log_file=None):
     """
     Create a CommandResult from given iterator
 
+    :param logs_generator: iterator of decoded log items
+    :param log_file: str, path of file where output is written, see CommandResult
     :return: CommandResult
     """
     logger.info("wait_for_command")
-    cr = CommandResult()
-    for item in logs_generator:
-        cr.parse_item(item)
+    cr = CommandResult(log_file=log_file)
+    try:
+        for item in logs_generator:
+            cr.parse_item(item)
+    finally:
+        cr.close()
 
     logger.info("no more logs")
     return cr
@@ -419,44 +518,298 @@ def _process_plugin_substitution(mapping, key_parts, value):
                            plugin_name, plugins_num)
 
 
+CHECKSUMS_BLOCK_SIZE = 1024**2  # 1 MB
+
+_checksums_cache = None
+
+
+class ChecksumsCache(object):
+    """
+    checksums of files computed during the build; entries are keyed by
+    device, inode, size and mtime of file, so a file is not read again
+    until it's modified or replaced
+    """
+
+    def __init__(self):
+        self._checksums = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(path):
+        """
+        :param path: str, path to file
+        :return: tuple identifying file and its version
+        """
+        st = os.stat(path)
+        # st_mtime_ns is not available on Python 2
+        mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+        return (st.st_dev, st.st_ino, st.st_size, mtime)
+
+    def get(self, key, algorithms):
+        """
+        :param key: tuple, as returned by get_key()
+        :param algorithms: list of str, names of hash functions
+        :return: dict, known checksums of file for requested algorithms
+        """
+        with self._lock:
+            known = self._checksums.get(key, {})
+            return dict((name, known[name]) for name in
+                        ('%ssum' % algorithm for algorithm in algorithms)
+                        if name in known)
+
+    def add(self, key, checksums):
+        """
+        :param key: tuple, as returned by get_key()
+        :param checksums: dict, checksums in the format returned by get_checksums()
+        """
+        with self._lock:
+            self._checksums.setdefault(key, {}).update(checksums)
+
+
+def get_checksums_cache():
+    """
+    :return: ChecksumsCache instance of running build or None
+    """
+    return _checksums_cache
+
+
+def set_checksums_cache(cache):
+    """
+    set ChecksumsCache instance used by get_checksums()
+
+    :param cache: ChecksumsCache instance or None to stop caching
+    """
+    global _checksums_cache
+    _checksums_cache = cache
+
+
+def cache_checksums(path, checksums):
+    """
+    remember checksums of file computed while it was written, see ChecksumFile
+
+    Nothing is done when there is no active cache.
+
+    :param path: str, path to file, which must not be modified afterwards
+    :param checksums: dict, checksums in the format returned by get_checksums()
+    """
+    cache = _checksums_cache
+    if cache is not None:
+        cache.add(cache.get_key(path), checksums)
+
+
+def _compute_checksums(path, algorithms, blocksize=CHECKSUMS_BLOCK_SIZE):
+    hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+    with open_large_file(path) as f:
+        if len(hashes) == 1:
+            for buf in iter(lambda: f.read(blocksize), b''):
+                hashes[0].update(buf)
+        else:
+            # each hash function runs in its own thread (hashlib releases the
+            # GIL), next block is read while the previous one is hashed
+            updates = [propagate_call_counts(hash_obj.update) for hash_obj in hashes]
+            with ThreadPoolExecutor(max_workers=len(hashes)) as executor:
+                pending = []
+                for buf in iter(lambda: f.read(blocksize), b''):
+                    for future in pending:
+                        future.result()
+                    pending = [executor.submit(update, buf) for update in updates]
+                for future in pending:
+                    future.result()
+
+    return dict(('%ssum' % algorithm, hash_obj.hexdigest())
+                for algorithm, hash_obj in zip(algorithms, hashes))
+
+
 def get_checksums(path, algorithms):
     """
     Compute a checksum(s) of given file using specified algorithms.
 
+    While a build runs, checksums are remembered in its ChecksumsCache and
+    files are read only when their checksums are not known yet.
+
     :param path: path to file
-    :param algorithms: list of cryptographic hash functions, currently supported: md5, sha256
+    :param algorithms: list of cryptographic hash functions, e.g. md5, sha256
     :return: dictionary
     """
     if not algorithms:
         return {}
 
-    compute_md5 = 'md5' in algorithms
-    compute_sha256 = 'sha256' in algorithms
-
-    if compute_md5:
-        md5 = hashlib.md5()
-    if compute_sha256:
-        sha256 = hashlib.sha256()
-    blocksize = 65536
-    with open(path, mode='rb') as f:
-        buf = f.read(blocksize)
-        while len(buf) > 0:
-            if compute_md5:
-                md5.update(buf)
-            if compute_sha256:
-                sha256.update(buf)
-            buf = f.read(blocksize)
-
+    cache = _checksums_cache
     checksums = {}
-    if compute_md5:
-        checksums['md5sum'] = md5.hexdigest()
-        logger.debug('md5sum: %s', checksums['md5sum'])
-    if compute_sha256:
-        checksums['sha256sum'] = sha256.hexdigest()
-        logger.debug('sha256sum: %s', checksums['sha256sum'])
+    if cache is not None:
+        key = cache.get_key(path)
+        checksums = cache.get(key, algorithms)
+    missing = [algorithm for algorithm in algorithms
+               if '%ssum' % algorithm not in checksums]
+    if missing:
+        computed = _compute_checksums(path, missing)
+        if cache is not None:
+            cache.add(key, computed)
+        checksums.update(computed)
+    else:
+        logger.debug('using cached checksums of %s', path)
+
+    for name, checksum in sorted(checksums.items()):
+        logger.debug('%s: %s', name, checksum)
     return checksums
 
 
+class ChecksumFile(object):
+    """
+    file-like object computing checksums and size of data read from or
+    written to the wrapped file object, so that the data don't have to be
+    read again just to get the checksums
+    """
+
+    def __init__(self, fileobj, algorithms=('md5', 'sha256')):
+        """
+        :param fileobj: file object
+        :param algorithms: list of cryptographic hash functions, see get_checksums()
+        """
+        self.fileobj = fileobj
+        self.size = 0
+        self._hashes = dict((algorithm, hashlib.new(algorithm)) for algorithm in algorithms)
+
+    def _update(self, data):
+        for hash_obj in self._hashes.values():
+            hash_obj.update(data)
+        self.size += len(data)
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self._update(data)
+        return data
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self._update(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def get_checksums(self):
+        """
+        :return: dict, checksums of data so far in the same format as get_checksums()
+        """
+        return dict(('%ssum' % algorithm, hash_obj.hexdigest())
+                    for algorithm, hash_obj in self._hashes.items())
+
+
+COPY_CHUNK_SIZE = 8 * 1024**2  # 8 MB
+
+
+def _copy_range_userspace(source_fd, dest_fd, offset, size, chunk_size):
+    os.lseek(source_fd, offset, os.SEEK_SET)
+    os.lseek(dest_fd, offset, os.SEEK_SET)
+    copied = 0
+    while copied < size:
+        data = os.read(source_fd, min(chunk_size, size - copied))
+        if not data:
+            break
+        while data:
+            written = os.write(dest_fd, data)
+            data = data[written:]
+            copied += written
+    return copied
+
+
+def _copy_range_kernel(source_fd, dest_fd, offset, size, chunk_size):
+    """
+    copy range of file without passing data through userspace, using
+    copy_file_range() (server-side copy on NFS 4.2) or sendfile()
+
+    :return: int, number of bytes copied, None when kernel copy is unavailable
+    """
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    sendfile = getattr(os, 'sendfile', None)
+    copied = 0
+    while copied < size:
+        count = min(chunk_size, size - copied)
+        try:
+            if copy_file_range is not None:
+                done = copy_file_range(source_fd, dest_fd, count,
+                                       offset + copied, offset + copied)
+            elif sendfile is not None:
+                if not copied:
+                    os.lseek(dest_fd, offset, os.SEEK_SET)
+                done = sendfile(dest_fd, source_fd, offset + copied, count)
+            else:
+                return None
+        except OSError as ex:
+            if copied or ex.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL,
+                                          errno.EOPNOTSUPP, errno.ENOTSUP):
+                raise
+            if copy_file_range is not None:
+                # e.g. copying across file systems on older kernels
+                copy_file_range = None
+                continue
+            return None
+        if not done:
+            break
+        copied += done
+    return copied
+
+
+def _copy_range(source, dest, offset, size, chunk_size):
+    with open(source, 'rb') as source_file, open(dest, 'r+b') as dest_file:
+        source_fd, dest_fd = source_file.fileno(), dest_file.fileno()
+        advise_sequential(source_fd, offset, size)
+        copy_range = _copy_range_kernel
+        copied = 0
+        # copied windows of source are dropped from page cache
+        while copied < size:
+            length = min(max(DEFAULT_WINDOW, chunk_size), size - copied)
+            done = copy_range(source_fd, dest_fd, offset + copied, length, chunk_size)
+            if done is None:
+                copy_range = _copy_range_userspace
+                continue
+            drop_cache(source_fd, offset + copied, done)
+            copied += done
+            if done != length:
+                break
+    if copied != size:
+        raise RuntimeError('%s changed while being copied' % source)
+
+
+def copy_file(source, dest, workers=1, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Copy file content and metadata like shutil.copy2() does, but let kernel
+    move the data when possible. With more than one worker, the file is split
+    to ranges written concurrently, which helps on high-latency file systems
+    (NFS). Neither file is left in the page cache, so reading the copy
+    afterwards gets the data from the file system.
+
+    :param source: str, path to file to copy
+    :param dest: str, path to destination file (not directory)
+    :param workers: int, number of ranges copied concurrently
+    :param chunk_size: int, max number of bytes copied by one system call
+    :return: int, size of copied file
+    """
+    size = os.path.getsize(source)
+    with open(dest, 'wb') as dest_file:
+        dest_file.truncate(size)
+
+    # ranges are aligned to chunk size, each worker copies at least one chunk
+    range_size = -(-size // max(workers, 1))
+    range_size = max(-(-range_size // chunk_size), 1) * chunk_size
+    ranges = [(offset, min(range_size, size - offset))
+              for offset in range(0, size, range_size)]
+    if len(ranges) <= 1:
+        for offset, length in ranges:
+            _copy_range(source, dest, offset, length, chunk_size)
+    else:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            copy_range = propagate_call_counts(_copy_range)
+            futures = [executor.submit(copy_range, source, dest, offset, length, chunk_size)
+                       for offset, length in ranges]
+            for future in futures:
+                future.result()
+
+    shutil.copystat(source, dest)
+    drop_cache(dest)
+    return size
+
+
 def get_docker_architecture(tasker):
     docker_version = tasker.get_version()
     host_arch = docker_version['Arch']
@@ -646,29 +999,29 @@ def get_manifest_media_type(version):
     return 'application/vnd.docker.distribution.manifest.{}+json'.format(version)
 
 
-def query_registry(image, registry, digest=None, insecure=False, dockercfg_path=None,
-                   version='v1', is_blob=False):
-    """Return manifest digest for image.
-
-    :param image: ImageName, the remote image to inspect
-    :param registry: str, URI for registry, if URI schema is not provided,
-                          https:// will be used
-    :param digest: str, digest of the image manifest
-    :param insecure: bool, when True registry's cert is not verified
-    :param dockercfg_path: str, dirname of .dockercfg location
-    :param version: str, which manifest schema version to fetch digest
-    :param is_blob: bool, read blob config if set to True
-
-    :return: requests.Response object
+def _get_registry_auth(image, dockercfg_path):
+    """
+    :return: requests.auth.HTTPBasicAuth for registry of image or None
     """
-    auth = None
     if dockercfg_path:
         dockercfg = Dockercfg(dockercfg_path).get_credentials(image.registry)
 
         username = dockercfg.get('username')
         password = dockercfg.get('password')
         if username and password:
-            auth = requests.auth.HTTPBasicAuth(username, password)
+            return requests.auth.HTTPBasicAuth(username, password)
+    return None
+
+
+def _registry_request(method, image, registry, reference, insecure=False,
+                      dockercfg_path=None, object_type='manifests', headers=None, data=None):
+    """
+    send request to registry v2 API
+
+    :param method: str, 'get' or 'put'
+    :return: requests.Response object
+    """
+    auth = _get_registry_auth(image, dockercfg_path)
 
     # In the insecure case, if the registry is just a hostname:port, we don't
     # know whether to talk HTTPS or HTTP to it, so try both ways
@@ -681,13 +1034,10 @@ def query_registry(image, registry, digest=None, insecure=False, dockercfg_path=
         registries = (registry,)
 
     context = '/'.join([x for x in [image.namespace, image.repo] if x])
-    reference = digest or image.tag or 'latest'
-    object_type = 'manifests'
-    if is_blob:
-        object_type = 'blobs'
 
-    headers = {'Accept': (get_manifest_media_type(version))}
     kwargs = {'verify': not insecure, 'headers': headers, 'auth': auth}
+    if data is not None:
+        kwargs['data'] = data
 
     session = get_retrying_requests_session()
 
@@ -696,7 +1046,7 @@ def query_registry(image, registry, digest=None, insecure=False, dockercfg_path=
         logger.debug("url: {}, headers: {}".format(url, headers))
 
         try:
-            response = session.get(url, **kwargs)
+            response = getattr(session, method)(url, **kwargs)
             response.raise_for_status()
             break
         except (ConnectionError, SSLError):
@@ -708,6 +1058,53 @@ def query_registry(image, registry, digest=None, insecure=False, dockercfg_path=
     return response
 
 
+def query_registry(image, registry, digest=None, insecure=False, dockercfg_path=None,
+                   version='v1', is_blob=False):
+    """Return manifest digest for image.
+
+    :param image: ImageName, the remote image to inspect
+    :param registry: str, URI for registry, if URI schema is not provided,
+                          https:// will be used
+    :param digest: str, digest of the image manifest
+    :param insecure: bool, when True registry's cert is not verified
+    :param dockercfg_path: str, dirname of .dockercfg location
+    :param version: str, which manifest schema version to fetch digest
+    :param is_blob: bool, read blob config if set to True
+
+    :return: requests.Response object
+    """
+    reference = digest or image.tag or 'latest'
+    object_type = 'manifests'
+    if is_blob:
+        object_type = 'blobs'
+
+    headers = {'Accept': (get_manifest_media_type(version))}
+    return _registry_request('get', image, registry, reference, insecure=insecure,
+                             dockercfg_path=dockercfg_path, object_type=object_type,
+                             headers=headers)
+
+
+def put_manifest(image, registry, manifest, insecure=False, dockercfg_path=None,
+                 version='v2'):
+    """Upload manifest to registry under tag of image.
+
+    All blobs referenced by the manifest have to be in the repository already.
+
+    :param image: ImageName, the remote image to tag
+    :param registry: str, URI for registry, if URI schema is not provided,
+                          https:// will be used
+    :param manifest: bytes, manifest as returned by registry
+    :param insecure: bool, when True registry's cert is not verified
+    :param dockercfg_path: str, dirname of .dockercfg location
+    :param version: str, schema version of manifest
+
+    :return: requests.Response object
+    """
+    headers = {'Content-Type': get_manifest_media_type(version)}
+    return _registry_request('put', image, registry, image.tag or 'latest', insecure=insecure,
+                             dockercfg_path=dockercfg_path, headers=headers, data=manifest)
+
+
 def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
                          versions=('v1', 'v2', 'v2_list'), require_digest=True):
     """Return manifest digest for image.
@@ -963,6 +1360,17 @@ class LabelFormatter(string.Formatter):
         return (self.get_value(field_name, args, kwargs), field_name)
 
 
+def _response_hook(response, *args, **kwargs):
+    """
+    count and trace HTTP request, see ResourceProfiler and tracing
+    """
+    count_call('http')
+    elapsed = response.elapsed.total_seconds()
+    method = getattr(response.request, 'method', None)
+    add_span('%s %s' % (method, response.url), 'http', time.time() - elapsed, elapsed,
+             {'status': response.status_code})
+
+
 def get_retrying_requests_session(client_statuses=HTTP_CLIENT_STATUS_RETRY,
                                   times=HTTP_MAX_RETRIES, delay=HTTP_BACKOFF_FACTOR):
     retry = Retry(
@@ -973,5 +1381,168 @@ def get_retrying_requests_session(client_statuses=HTTP_CLIENT_STATUS_RETRY,
     session = requests.Session()
     session.mount('http://', HTTPAdapter(max_retries=retry))
     session.mount('https://', HTTPAdapter(max_retries=retry))
+    session.hooks['response'].append(_response_hook)
 
     return session
+
+
+_call_counts = threading.local()
+# counts and usage of helper threads are shared by threads working for
+# the same profiled code
+_call_counts_lock = threading.Lock()
+
+
+def count_call(kind):
+    """
+    count remote call made by current thread, see ResourceProfiler
+
+    :param kind: str, 'docker', 'docker_retry', 'http' or 'koji'
+    """
+    counts = getattr(_call_counts, 'counts', None)
+    if counts is not None:
+        with _call_counts_lock:
+            counts[kind] = counts.get(kind, 0) + 1
+
+
+def propagate_call_counts(function):
+    """
+    wrap function run in another thread, so that remote calls it makes,
+    CPU time and I/O of the thread while it runs are counted by
+    ResourceProfiler active in the current thread
+
+    :param function: callable
+    :return: callable
+    """
+    counts = getattr(_call_counts, 'counts', None)
+    if counts is None:
+        return function
+    helper_usage = _call_counts.helper_usage
+
+    @functools.wraps(function)
+    def counted(*args, **kwargs):
+        thread_counts = getattr(_call_counts, 'counts', None)
+        if thread_counts is counts:
+            # the thread already works for the same profiler
+            return function(*args, **kwargs)
+
+        thread_helper_usage = getattr(_call_counts, 'helper_usage', None)
+        _call_counts.counts = counts
+        _call_counts.helper_usage = helper_usage
+        start = ResourceProfiler.thread_snapshot()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            end = ResourceProfiler.thread_snapshot()
+            _call_counts.counts = thread_counts
+            _call_counts.helper_usage = thread_helper_usage
+            with _call_counts_lock:
+                for key, value in start.items():
+                    helper_usage[key] = helper_usage.get(key, 0) + end[key] - value
+    return counted
+
+
+class ResourceProfiler(object):
+    """
+    context manager measuring resources used by current thread
+
+    CPU time and I/O are per-thread where the kernel supports it (otherwise
+    the whole process is measured), peak RSS is always measured for the
+    whole process; remote calls, CPU time and I/O are counted also in
+    threads running functions wrapped by propagate_call_counts(), once the
+    functions return
+
+    usage: dict with usage after the context was left:
+           cpu_user, cpu_system (seconds), max_rss_increase (bytes),
+           read_bytes, write_bytes (bytes read/written from/to storage,
+           only when available), docker_calls, docker_retry_calls (retried
+           docker requests), http_calls and koji_calls
+    """
+    RUSAGE_WHO = getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF)
+    IO_PATHS = ['/proc/thread-self/io', '/proc/self/io']
+    CALL_KINDS = ['docker', 'docker_retry', 'http', 'koji']
+
+    def __init__(self):
+        self.usage = None
+        self._start = None
+        self._counts = None
+        self._helper_usage = None
+        self._parent_counts = None
+        self._parent_helper_usage = None
+
+    @classmethod
+    def _read_io(cls, paths=None):
+        for path in paths or cls.IO_PATHS:
+            try:
+                with open(path) as f:
+                    io = dict(line.split(':', 1) for line in f if ':' in line)
+                return {
+                    'read_bytes': int(io['read_bytes']),
+                    'write_bytes': int(io['write_bytes']),
+                }
+            except (IOError, OSError, KeyError, ValueError):
+                continue
+        return {}
+
+    def _snapshot(self):
+        usage = resource.getrusage(self.RUSAGE_WHO)
+        snapshot = {
+            'cpu_user': usage.ru_utime,
+            'cpu_system': usage.ru_stime,
+            # kilobytes on Linux
+            'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        }
+        snapshot.update(self._read_io())
+        return snapshot
+
+    @classmethod
+    def thread_snapshot(cls):
+        """
+        :return: dict, CPU time and I/O used by current thread so far, only
+                 those which the kernel measures per thread
+        """
+        snapshot = {}
+        if cls.RUSAGE_WHO != resource.RUSAGE_SELF:
+            usage = resource.getrusage(cls.RUSAGE_WHO)
+            snapshot['cpu_user'] = usage.ru_utime
+            snapshot['cpu_system'] = usage.ru_stime
+        snapshot.update(cls._read_io(cls.IO_PATHS[:1]))
+        return snapshot
+
+    def __enter__(self):
+        self._parent_counts = getattr(_call_counts, 'counts', None)
+        self._parent_helper_usage = getattr(_call_counts, 'helper_usage', None)
+        self._counts = _call_counts.counts = {}
+        self._helper_usage = _call_counts.helper_usage = {}
+        self._start = self._snapshot()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end = self._snapshot()
+        _call_counts.counts = self._parent_counts
+        _call_counts.helper_usage = self._parent_helper_usage
+        with _call_counts_lock:
+            counts = dict(self._counts)
+            helper_usage = dict(self._helper_usage)
+            # calls made by nested profiled code and its helper threads
+            # count in outer one as well
+            if self._parent_counts is not None:
+                for kind, count in counts.items():
+                    self._parent_counts[kind] = self._parent_counts.get(kind, 0) + count
+            if self._parent_helper_usage is not None:
+                for key, value in helper_usage.items():
+                    self._parent_helper_usage[key] = (
+                        self._parent_helper_usage.get(key, 0) + value)
+
+        for key, value in helper_usage.items():
+            if key in end:
+                end[key] += value
+        self.usage = {
+            'cpu_user': round(end['cpu_user'] - self._start['cpu_user'], 3),
+            'cpu_system': round(end['cpu_system'] - self._start['cpu_system'], 3),
+            'max_rss_increase': end['max_rss'] - self._start['max_rss'],
+        }
+        for key in ('read_bytes', 'write_bytes'):
+            if key in self._start and key in end:
+                self.usage[key] = end[key] - self._start[key]
+        for kind in self.CALL_KINDS:
+            self.usage['%s_calls' % kind] = counts.get(kind, 0)
@@ -0,0 +1,37 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+
+from atomic_reactor import plugin
+from atomic_reactor.constants import PLUGINS_INDEX_ENV
+
+
+@pytest.fixture(scope='session', autouse=True)
+def plugins_index_path(tmpdir_factory):
+    """
+    keep plugins index of the test run out of $HOME
+
+    the index used by runners is bound to the path, as some tests replace
+    os.environ; the environment variable covers processes the tests start
+    """
+    path = str(tmpdir_factory.mktemp('plugins-index').join('index.json'))
+    original_env = os.environ.get(PLUGINS_INDEX_ENV)
+    original_index = plugin.plugins_index
+    os.environ[PLUGINS_INDEX_ENV] = path
+    plugin.plugins_index = plugin.PluginsIndex(path=path)
+    yield path
+    plugin.plugins_index = original_index
+    if original_env is None:
+        del os.environ[PLUGINS_INDEX_ENV]
+    else:
+        os.environ[PLUGINS_INDEX_ENV] = original_env
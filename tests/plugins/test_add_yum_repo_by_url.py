@@ -14,6 +14,7 @@ from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import PreBuildPluginsRunner
 from atomic_reactor.plugins.pre_add_yum_repo_by_url import AddYumRepoByUrlPlugin
+from atomic_reactor.prefetch import Prefetcher, set_prefetcher
 from atomic_reactor.util import ImageName
 import requests
 import pytest
@@ -101,3 +102,28 @@ def test_multiple_repourls(inject_proxy):
     assert workflow.files[os.path.join(YUM_REPOS_DIR, filename1)] == repo_content
     assert workflow.files[os.path.join(YUM_REPOS_DIR, filename2)] == repo_content
     assert len(workflow.files) == 2
+
+
+def test_prefetch():
+    tasker, workflow = prepare()
+    url1 = 'http://example.com/a/b/c/myrepo.repo'
+    url2 = 'http://example.com/repo-2.repo'
+    # each repo file is downloaded only once
+    (flexmock(requests.Session)
+        .should_receive('get')
+        .and_return(requests.Response())
+        .twice())
+    runner = PreBuildPluginsRunner(tasker, workflow, [{
+        'name': AddYumRepoByUrlPlugin.key,
+        'args': {'repourls': [url1, url2]}}])
+    prefetcher = Prefetcher()
+    set_prefetcher(prefetcher)
+    try:
+        runner.prefetch()
+        runner.run()
+    finally:
+        set_prefetcher(None)
+        prefetcher.shutdown()
+
+    assert workflow.files[os.path.join(YUM_REPOS_DIR, 'myrepo.repo')] == repocontent
+    assert workflow.files[os.path.join(YUM_REPOS_DIR, 'repo-2.repo')] == repocontent
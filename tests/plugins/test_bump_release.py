@@ -27,6 +27,7 @@ except ImportError:
     import koji as koji
 
 from atomic_reactor.plugins.pre_bump_release import BumpReleasePlugin
+from atomic_reactor.prefetch import Prefetcher, set_prefetcher
 from atomic_reactor.util import df_parser
 from flexmock import flexmock
 import pytest
@@ -187,3 +188,31 @@ class TestBumpRelease(object):
             assert 'Release' not in parser.labels
         else:
             assert parser.labels['Release'] == next_release['expected']
+
+    @pytest.mark.parametrize('labels_changed', [False, True])
+    def test_prefetch(self, tmpdir, labels_changed):
+        session = flexmock()
+        (session
+            .should_receive('getNextRelease')
+            .and_return('1')
+            .times(2 if labels_changed else 1))
+        session.should_receive('getBuild').and_return(None)
+        flexmock(koji, ClientSession=lambda hub, opts=None: session)
+
+        plugin = self.prepare(tmpdir, labels={'com.redhat.component': 'component',
+                                              'version': '7.1'})
+        prefetcher = Prefetcher()
+        set_prefetcher(prefetcher)
+        try:
+            plugin.prefetch()
+            if labels_changed:
+                # prefetched release is not used for other version
+                parser = df_parser(plugin.workflow.builder.df_path, workflow=plugin.workflow)
+                parser.labels['version'] = '7.2'
+            plugin.run()
+        finally:
+            set_prefetcher(None)
+            prefetcher.shutdown()
+
+        parser = df_parser(plugin.workflow.builder.df_path, workflow=plugin.workflow)
+        assert parser.labels['release'] == '1'
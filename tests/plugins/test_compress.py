@@ -1,16 +1,26 @@
+import gzip
+try:
+    from backports import lzma
+except ImportError:
+    import lzma
+import io
 import os
 import tarfile
 
+import docker
+from flexmock import flexmock
 import pytest
 
 from atomic_reactor.constants import EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
+from atomic_reactor.layer_store import LayerStore
 from atomic_reactor.plugin import PostBuildPluginsRunner
-from atomic_reactor.plugins.post_compress import CompressPlugin
-from atomic_reactor.util import ImageName
+from atomic_reactor.plugins.post_compress import CODECS, CompressPlugin
+from atomic_reactor.util import ImageName, get_checksums
 
 from tests.constants import INPUT_IMAGE, MOCK
+from tests.test_export import make_image_tarball
 
 try:
     from six import integer_types
@@ -32,6 +42,17 @@ class X(object):
     base_image = ImageName.parse('asd')
 
 
+def decompress(method, path):
+    if method == 'zstd':
+        import zstandard
+        with open(path, 'rb') as compressed:
+            reader = zstandard.ZstdDecompressor().stream_reader(compressed,
+                                                                read_across_frames=True)
+            return reader.read()
+    with (gzip.open if method == 'gzip' else lzma.open)(path) as decompressed:
+        return decompressed.read()
+
+
 class TestCompress(object):
     @pytest.mark.parametrize('method, load_exported_image, extension', [
         ('gzip', False, 'gz'),
@@ -74,3 +95,183 @@ class TestCompress(object):
         assert 'uncompressed_size' in metadata
         assert isinstance(metadata['uncompressed_size'], integer_types)
         assert ", ratio: " in caplog.text()
+
+    @pytest.mark.parametrize('method, extension', [
+        ('gzip', 'gz'),
+        ('lzma', 'xz'),
+        ('zstd', 'zst'),
+    ])
+    @pytest.mark.parametrize('threads', [1, None])
+    def test_compress_layer_store(self, tmpdir, method, extension, threads):
+        if method == 'zstd':
+            pytest.importorskip('zstandard')
+        if MOCK:
+            mock_docker()
+
+        exp_img, diff_ids = make_image_tarball(tmpdir, ['layer content\n' * 1000, 'top\n'])
+
+        store = str(tmpdir.join('store'))
+        compressed_inodes = []
+        for _ in range(2):
+            tasker = DockerTasker()
+            workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+            workflow.builder = X()
+            workflow.exported_image_sequence.append({'path': exp_img})
+            runner = PostBuildPluginsRunner(
+                tasker,
+                workflow,
+                [{
+                    'name': CompressPlugin.key,
+                    'args': {
+                        'method': method,
+                        'load_exported_image': True,
+                        'layer_store': store,
+                        'threads': threads,
+                    },
+                }]
+            )
+            runner.run()
+
+            compressed_img = os.path.join(
+                workflow.source.tmpdir,
+                EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE.format(extension))
+            metadata = workflow.exported_image_sequence[-1]
+            assert metadata['path'] == compressed_img
+            assert metadata['uncompressed_size'] == os.path.getsize(exp_img)
+
+            assert metadata['size'] == os.path.getsize(compressed_img)
+            checksums = get_checksums(compressed_img, ['md5', 'sha256'])
+            assert metadata['md5sum'] == checksums['md5sum']
+            assert metadata['sha256sum'] == checksums['sha256sum']
+            checksums = get_checksums(exp_img, ['md5', 'sha256'])
+            assert metadata['uncompressed_md5sum'] == checksums['md5sum']
+            assert metadata['uncompressed_sha256sum'] == checksums['sha256sum']
+
+            with open(exp_img, 'rb') as original:
+                assert decompress(method, compressed_img) == original.read()
+
+            compressed_inodes.append(sorted(
+                os.stat(os.path.join(store, 'blobs', name)).st_ino
+                for name in os.listdir(os.path.join(store, 'blobs'))
+                if '.{0}-'.format(method) in name))
+
+        # only compressed layers are kept
+        level = CODECS[method].default_level
+        assert sorted(os.listdir(os.path.join(store, 'blobs'))) == sorted(
+            '{0}.{1}-{2}'.format(diff_id, method, level) for diff_id in diff_ids)
+        # layers were compressed only once
+        assert len(compressed_inodes[0]) == 2
+        assert compressed_inodes[0] == compressed_inodes[1]
+
+    def test_compress_layer_store_stream(self, tmpdir):
+        if MOCK:
+            mock_docker()
+        exp_img, diff_ids = make_image_tarball(tmpdir, ['layer content\n' * 1000, 'top\n'])
+        with open(exp_img, 'rb') as image_file:
+            image_content = image_file.read()
+        flexmock(docker.APIClient,
+                 get_image=lambda img, **kwargs: io.BytesIO(image_content))
+
+        store = str(tmpdir.join('store'))
+        compressed_paths = []
+        for load_exported_image in [False, True]:
+            workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+            workflow.builder = X()
+            workflow.exported_image_sequence.append({'path': exp_img})
+            plugin = CompressPlugin(DockerTasker(), workflow,
+                                    load_exported_image=load_exported_image,
+                                    layer_store=store)
+            plugin.run()
+            compressed_paths.append(workflow.exported_image_sequence[-1]['path'])
+            assert decompress('gzip', compressed_paths[-1]) == image_content
+
+            # layers of streamed image are added under their diff IDs,
+            # so that they are found in the image file
+            assert sorted(os.listdir(os.path.join(store, 'blobs'))) == sorted(
+                diff_id + '.gzip-6' for diff_id in diff_ids)
+            if not load_exported_image:
+                blobs_inodes = dict((name, os.stat(os.path.join(store, 'blobs', name)).st_ino)
+                                   for name in os.listdir(os.path.join(store, 'blobs')))
+        assert blobs_inodes == dict((name, os.stat(os.path.join(store, 'blobs', name)).st_ino)
+                                   for name in os.listdir(os.path.join(store, 'blobs')))
+
+    @pytest.mark.parametrize('in_store', [True, False])
+    def test_compress_layer_store_wrong_diff_id(self, tmpdir, in_store):
+        if MOCK:
+            mock_docker()
+        exp_img, diff_ids = make_image_tarball(tmpdir, ['layer content\n'])
+        store = LayerStore(str(tmpdir.join('store')))
+        if in_store:
+            with store.writer(diff_ids[0] + '.gzip-6') as blob:
+                blob.write(b'compressed')
+        # layer doesn't match the manifest anymore
+        with open(exp_img, 'r+b') as image_file:
+            data = image_file.read()
+            layer_offset = data.index(b'layer content')
+            image_file.seek(layer_offset)
+            image_file.write(b'LAYER')
+
+        workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+        workflow.builder = X()
+        workflow.exported_image_sequence.append({'path': exp_img})
+        plugin = CompressPlugin(DockerTasker(), workflow, load_exported_image=True,
+                                layer_store=store.path)
+        with pytest.raises(RuntimeError):
+            plugin.run()
+        assert os.listdir(store.blobs_path) == (['{0}.gzip-6'.format(diff_ids[0])]
+                                                if in_store else [])
+
+    @pytest.mark.parametrize('method, level, threads', [
+        ('gzip', 1, 1),
+        ('gzip', 9, None),
+        ('lzma', 0, 1),
+        ('lzma', None, None),
+        ('zstd', 19, 1),
+        ('zstd', None, None),
+    ])
+    def test_compress_level(self, tmpdir, method, level, threads):
+        if method == 'zstd':
+            pytest.importorskip('zstandard')
+        if MOCK:
+            mock_docker()
+
+        exp_img = str(tmpdir.join('img.tar'))
+        with open(exp_img, 'wb') as image:
+            image.write(b'image content\n' * 10000)
+
+        tasker = DockerTasker()
+        workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+        workflow.builder = X()
+        workflow.exported_image_sequence.append({'path': exp_img})
+        runner = PostBuildPluginsRunner(
+            tasker,
+            workflow,
+            [{
+                'name': CompressPlugin.key,
+                'args': {
+                    'method': method,
+                    'level': level,
+                    'load_exported_image': True,
+                    'threads': threads,
+                },
+            }]
+        )
+        runner.run()
+
+        metadata = workflow.exported_image_sequence[-1]
+        assert metadata['compression'] == method
+        assert metadata['compression_level'] == (level if level is not None
+                                                 else CODECS[method].default_level)
+        with open(exp_img, 'rb') as original:
+            assert decompress(method, metadata['path']) == original.read()
+
+    @pytest.mark.parametrize('method, level', [
+        ('gzip', 0),
+        ('gzip', 10),
+        ('zstd', 23),
+    ])
+    def test_compress_invalid_level(self, method, level):
+        workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+        with pytest.raises(RuntimeError) as exc:
+            CompressPlugin(None, workflow, method=method, level=level)
+        assert 'compression level' in str(exc.value)
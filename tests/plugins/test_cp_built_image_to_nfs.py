@@ -8,6 +8,7 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import hashlib
 import os
 import subprocess
 
@@ -17,7 +18,7 @@ from atomic_reactor.constants import EXPORTED_SQUASHED_IMAGE_NAME
 
 from atomic_reactor.util import ImageName
 from atomic_reactor.inner import DockerBuildWorkflow
-from atomic_reactor.plugin import PostBuildPluginsRunner
+from atomic_reactor.plugin import PostBuildPluginsRunner, PluginFailedException
 from atomic_reactor.plugins.post_cp_built_image_to_nfs import CopyBuiltImageToNFSPlugin
 from tests.constants import INPUT_IMAGE
 from tests.fixtures import docker_tasker  # noqa
@@ -39,7 +40,8 @@ NFS_SERVER_PATH = "server:path"
 
 
 @pytest.mark.parametrize('dest_dir', [None, "test_directory"])  # noqa
-def test_cp_built_image_to_nfs(tmpdir, docker_tasker, dest_dir):
+@pytest.mark.parametrize('workers', [1, 4])
+def test_cp_built_image_to_nfs(tmpdir, docker_tasker, dest_dir, workers):
     mountpoint = tmpdir.join("mountpoint")
 
     def fake_check_call(cmd):
@@ -66,6 +68,7 @@ def test_cp_built_image_to_nfs(tmpdir, docker_tasker, dest_dir):
                 "nfs_server_path": NFS_SERVER_PATH,
                 "dest_dir": dest_dir,
                 "mountpoint": str(mountpoint),
+                "workers": workers,
             }
         }]
     )
@@ -74,3 +77,39 @@ def test_cp_built_image_to_nfs(tmpdir, docker_tasker, dest_dir):
         assert os.path.isfile(os.path.join(str(mountpoint), EXPORTED_SQUASHED_IMAGE_NAME))
     else:
         assert os.path.isfile(os.path.join(str(mountpoint), dest_dir, EXPORTED_SQUASHED_IMAGE_NAME))
+
+
+@pytest.mark.parametrize(('sha256sum', 'valid'), [  # noqa
+    (None, True),
+    (hashlib.sha256(b'image').hexdigest(), True),
+    (hashlib.sha256(b'other image').hexdigest(), False),
+])
+def test_cp_built_image_to_nfs_verify(tmpdir, docker_tasker, sha256sum, valid):
+    mountpoint = tmpdir.join("mountpoint")
+    flexmock(subprocess, check_call=lambda cmd: None)
+    workflow = DockerBuildWorkflow({"provider": "git", "uri": "asd"}, "test-image")
+    workflow.builder = X()
+    image_path = os.path.join(str(tmpdir), EXPORTED_SQUASHED_IMAGE_NAME)
+    with open(image_path, 'wb') as image:
+        image.write(b'image')
+    workflow.exported_image_sequence.append({"path": image_path, "sha256sum": sha256sum})
+
+    runner = PostBuildPluginsRunner(
+        docker_tasker,
+        workflow,
+        [{
+            'name': CopyBuiltImageToNFSPlugin.key,
+            'args': {
+                "nfs_server_path": NFS_SERVER_PATH,
+                "mountpoint": str(mountpoint),
+            }
+        }]
+    )
+    copied_path = os.path.join(str(mountpoint), EXPORTED_SQUASHED_IMAGE_NAME)
+    if valid:
+        runner.run()
+        assert os.path.isfile(copied_path)
+    else:
+        with pytest.raises(PluginFailedException):
+            runner.run()
+        assert not os.path.exists(copied_path)
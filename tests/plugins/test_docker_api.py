@@ -8,11 +8,13 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import os
+
 from dockerfile_parse import DockerfileParser
 
-from atomic_reactor.plugin import PluginFailedException
+from atomic_reactor.plugin import ExitPluginsRunner, PluginFailedException
 from atomic_reactor.build import InsideBuilder, BuildResult
-from atomic_reactor.util import ImageName, CommandResult
+from atomic_reactor.util import ImageName, CommandResult, LogFile
 from atomic_reactor.inner import DockerBuildWorkflow
 
 from tests.docker_mock import mock_docker
@@ -72,7 +74,7 @@ class MockInsideBuilder(object):
     False,
 ])
 @pytest.mark.parametrize('image_id', ['sha256:12345', '12345'])
-def test_build(is_failed, image_id):
+def test_build(monkeypatch, is_failed, image_id):
     """
     tests docker build api plugin working
     """
@@ -82,6 +84,13 @@ def test_build(is_failed, image_id):
     flexmock(InsideBuilder).new_instances(fake_builder)
 
     workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+    exit_logs = []
+
+    def run_exit_plugins(runner, keep_going=False):
+        # exit plugins can read build logs
+        exit_logs.extend(workflow.build_result.logs)
+
+    monkeypatch.setattr(ExitPluginsRunner, 'run', run_exit_plugins)
     flexmock(CommandResult).should_receive('is_failed').and_return(is_failed)
     error = "error message"
     error_detail = "{u'message': u\"%s\"}" % error
@@ -103,3 +112,12 @@ def test_build(is_failed, image_id):
     else:
         assert workflow.build_result.image_id.startswith('sha256:')
         assert workflow.build_result.image_id.count(':') == 1
+
+    # build logs are written to file outside of workdir, both are removed
+    # after exit plugins
+    assert not os.path.exists(workflow.source.workdir)
+    assert isinstance(workflow.build_result.logs, LogFile)
+    assert len(workflow.build_result.logs) > 0
+    assert len(exit_logs) == len(workflow.build_result.logs)
+    assert not os.path.exists(workflow.build_result.logs.path)
+    assert workflow.build_log_path is None
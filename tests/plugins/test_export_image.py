@@ -0,0 +1,251 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import gzip
+import os
+import tarfile
+
+import docker
+from flexmock import flexmock
+import pytest
+
+from atomic_reactor.constants import (EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE,
+                                      EXPORTED_DELTA_IMAGE_NAME,
+                                      EXPORTED_SQUASHED_IMAGE_NAME)
+from atomic_reactor.core import DockerTasker
+from atomic_reactor.inner import DockerBuildWorkflow
+from atomic_reactor.plugin import PostBuildPluginsRunner
+from atomic_reactor.plugins.post_export_image import ExportImagePlugin, get_delta_image
+from atomic_reactor.util import ImageName, get_checksums
+
+from tests import docker_mock
+from tests.constants import INPUT_IMAGE, MOCK
+from tests.test_export import make_image_tarball
+from tests.test_overlay2 import make_docker_root
+
+if MOCK:
+    from tests.docker_mock import mock_docker
+
+
+class Y(object):
+    dockerfile_path = None
+    path = None
+
+
+class X(object):
+    image_id = INPUT_IMAGE
+    source = Y()
+    base_image = ImageName.parse('asd')
+
+
+@pytest.mark.parametrize(('save_tarball', 'compress'), [
+    (True, None),
+    (True, {'method': 'gzip', 'threads': 1}),
+    (False, {'method': 'gzip', 'level': 1}),
+    (False, None),
+])
+def test_export_image(save_tarball, compress):
+    if MOCK:
+        mock_docker()
+    # mocked 'docker save' returns content of docker_mock module
+    with open(docker_mock.__file__.replace('.pyc', '.py'), 'rb') as image_file:
+        image_content = image_file.read()
+
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+    workflow.builder = X()
+    runner = PostBuildPluginsRunner(
+        tasker,
+        workflow,
+        [{
+            'name': ExportImagePlugin.key,
+            'args': {
+                'save_tarball': save_tarball,
+                'compress': compress,
+            },
+        }]
+    )
+    runner.run()
+
+    sequence = workflow.exported_image_sequence
+    assert len(sequence) == int(save_tarball) + int(compress is not None)
+    if save_tarball:
+        metadata = sequence[0]
+        assert metadata['path'] == os.path.join(workflow.source.workdir,
+                                                EXPORTED_SQUASHED_IMAGE_NAME)
+        with open(metadata['path'], 'rb') as tarball:
+            assert tarball.read() == image_content
+        assert metadata['size'] == len(image_content)
+        checksums = get_checksums(metadata['path'], ['md5', 'sha256'])
+        assert metadata['md5sum'] == checksums['md5sum']
+        assert metadata['sha256sum'] == checksums['sha256sum']
+
+    if compress is not None:
+        metadata = sequence[-1]
+        assert metadata['path'] == os.path.join(
+            workflow.source.workdir, EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE.format('gz'))
+        with gzip.open(metadata['path']) as decompressed:
+            assert decompressed.read() == image_content
+        assert metadata['uncompressed_size'] == len(image_content)
+        assert metadata['compression'] == 'gzip'
+        assert metadata['compression_level'] == compress.get('level', 6)
+
+
+@pytest.mark.parametrize('save_tarball', [True, False])
+def test_export_delta_image(tmpdir, save_tarball):
+    if MOCK:
+        mock_docker()
+    image_path, diff_ids = make_image_tarball(tmpdir, ['base\n' * 1000, 'top\n'])
+
+    flexmock(docker.APIClient, get_image=lambda img, **kwargs: open(image_path, 'rb'))
+    tasker = DockerTasker()
+    (flexmock(tasker)
+     .should_receive('inspect_image')
+     .and_return({'RootFS': {'Layers': diff_ids}}))
+    workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+    workflow.builder = X()
+    workflow._base_image_inspect = {'RootFS': {'Layers': diff_ids[:1]}}
+    runner = PostBuildPluginsRunner(
+        tasker,
+        workflow,
+        [{
+            'name': ExportImagePlugin.key,
+            'args': {
+                'save_tarball': save_tarball,
+                'delta': True,
+            },
+        }]
+    )
+    runner.run()
+
+    delta = get_delta_image(workflow)
+    assert delta['path'] == os.path.join(workflow.source.workdir, EXPORTED_DELTA_IMAGE_NAME)
+    assert delta['omitted_layers'] == diff_ids[:1]
+    assert delta['size'] == os.path.getsize(delta['path'])
+    assert delta['sha256sum'] == get_checksums(delta['path'], ['sha256'])['sha256sum']
+    with tarfile.open(delta['path']) as delta_tar:
+        names = delta_tar.getnames()
+    assert '0' * 64 + '/layer.tar' not in names
+    assert '0' * 64 + '/json' in names
+    assert '1' * 64 + '/layer.tar' in names
+    assert 'manifest.json' in names
+
+    # delta image is not used unless requested
+    tarball_path = os.path.join(workflow.source.workdir, EXPORTED_SQUASHED_IMAGE_NAME)
+    sequence = [metadata['path'] for metadata in workflow.exported_image_sequence]
+    if save_tarball:
+        assert sequence == [tarball_path]
+    else:
+        assert sequence == []
+        assert not os.path.exists(tarball_path)
+
+
+def test_export_image_layer_store(tmpdir):
+    if MOCK:
+        mock_docker()
+    image_path, diff_ids = make_image_tarball(tmpdir, ['base\n' * 1000, 'top\n'])
+    with open(image_path, 'rb') as image_file:
+        image_content = image_file.read()
+
+    flexmock(docker.APIClient, get_image=lambda img, **kwargs: open(image_path, 'rb'))
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+    workflow.builder = X()
+    store = str(tmpdir.join('store'))
+    runner = PostBuildPluginsRunner(
+        tasker,
+        workflow,
+        [{
+            'name': ExportImagePlugin.key,
+            'args': {
+                'save_tarball': False,
+                'compress': {'method': 'gzip', 'layer_store': store},
+            },
+        }]
+    )
+    runner.run()
+
+    # image is compressed from saved tarball, its layers are found by diff IDs
+    sequence = workflow.exported_image_sequence
+    assert len(sequence) == 1
+    with gzip.open(sequence[0]['path']) as decompressed:
+        assert decompressed.read() == image_content
+    assert sorted(os.listdir(os.path.join(store, 'blobs'))) == sorted(
+        diff_id + '.gzip-6' for diff_id in diff_ids)
+    assert not os.path.exists(os.path.join(workflow.source.workdir,
+                                           EXPORTED_SQUASHED_IMAGE_NAME))
+
+
+@pytest.mark.parametrize(('driver', 'compress', 'corrupt'), [
+    ('overlay2', None, False),
+    ('overlay2', {'method': 'gzip', 'level': 1}, False),
+    ('overlay2', None, True),
+    ('devicemapper', None, False),
+])
+def test_export_image_overlay2(tmpdir, driver, compress, corrupt):
+    if MOCK:
+        mock_docker()
+    docker_root, image_id, diff_ids = make_docker_root(tmpdir, [{'file': 'base\n' * 1000},
+                                                                {'file': 'top\n'}])
+    if corrupt:
+        # layer file doesn't match diff ID of the layer
+        tmpdir.join('docker', 'overlay2', 'cache-1', 'diff', 'file').write('TOP\n')
+    image_path, _ = make_image_tarball(tmpdir, ['saved\n'])
+
+    flexmock(docker.APIClient, get_image=lambda img, **kwargs: open(image_path, 'rb'))
+    tasker = DockerTasker()
+    (flexmock(tasker)
+     .should_receive('get_info')
+     .and_return({'Driver': driver, 'DockerRootDir': docker_root}))
+    flexmock(tasker).should_receive('inspect_image').and_return({'Id': image_id})
+    workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+    workflow.builder = X()
+    runner = PostBuildPluginsRunner(
+        tasker,
+        workflow,
+        [{
+            'name': ExportImagePlugin.key,
+            'args': {
+                'backend': 'overlay2',
+                'workers': 2,
+                'compress': compress,
+            },
+        }]
+    )
+    runner.run()
+
+    sequence = workflow.exported_image_sequence
+    assert len(sequence) == 1 + int(compress is not None)
+    metadata = sequence[0]
+    with tarfile.open(metadata['path']) as image_tar:
+        names = image_tar.getnames()
+        if driver == 'overlay2' and not corrupt:
+            layer_names = [name for name in names if name.endswith('/layer.tar')]
+            assert len(layer_names) == len(diff_ids)
+        else:
+            # docker save was used
+            assert '0' * 64 + '/layer.tar' in names
+    checksums = get_checksums(metadata['path'], ['md5', 'sha256'])
+    assert metadata['md5sum'] == checksums['md5sum']
+    assert metadata['sha256sum'] == checksums['sha256sum']
+    assert metadata['size'] == os.path.getsize(metadata['path'])
+
+    if compress is not None:
+        with open(metadata['path'], 'rb') as tarball, gzip.open(sequence[1]['path']) as gz:
+            assert gz.read() == tarball.read()
+
+
+def test_export_image_unknown_backend():
+    if MOCK:
+        mock_docker()
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+    with pytest.raises(RuntimeError):
+        ExportImagePlugin(tasker, workflow, backend='btrfs')
@@ -30,7 +30,7 @@ from atomic_reactor.core import DockerTasker
 from atomic_reactor.plugins.exit_koji_tag_build import KojiTagBuildPlugin
 from atomic_reactor.plugins.exit_koji_import import KojiImportPlugin
 from atomic_reactor.plugins.exit_koji_promote import KojiPromotePlugin
-from atomic_reactor.plugin import ExitPluginsRunner, PluginFailedException
+from atomic_reactor.plugin import ExitPluginsRunner, PluginFailedException, plugins_conflict
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.util import ImageName
 from atomic_reactor.build import BuildResult
@@ -258,3 +258,7 @@ class TestKojiPromote(object):
         runner = create_runner(tasker, workflow)
         result = runner.run()
         assert result[KojiTagBuildPlugin.key] == 'images-candidate'
+
+    @pytest.mark.parametrize('koji_plugin', [KojiImportPlugin, KojiPromotePlugin])
+    def test_runs_after_koji_build(self, koji_plugin):
+        assert plugins_conflict(koji_plugin, KojiTagBuildPlugin)
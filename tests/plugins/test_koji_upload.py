@@ -35,6 +35,7 @@ from atomic_reactor.plugin import PostBuildPluginsRunner, PluginFailedException
 from atomic_reactor.inner import DockerBuildWorkflow, TagConf, PushConf
 from atomic_reactor.util import ImageName, ManifestDigest
 from atomic_reactor.source import GitSource
+from atomic_reactor.tracing import Tracer
 from atomic_reactor.build import BuildResult
 from tests.constants import SOURCE, MOCK
 
@@ -327,7 +328,8 @@ def os_env(monkeypatch):
 
 
 def create_runner(tasker, workflow, ssl_certs=False, principal=None,
-                  keytab=None, blocksize=None, target=None, prefer_schema1_digest=None):
+                  keytab=None, blocksize=None, target=None, prefer_schema1_digest=None,
+                  upload_trace=False):
     args = {
         'kojihub': '',
         'url': '/',
@@ -353,6 +355,9 @@ def create_runner(tasker, workflow, ssl_certs=False, principal=None,
     if prefer_schema1_digest is not None:
         args['prefer_schema1_digest'] = prefer_schema1_digest
 
+    if upload_trace:
+        args['upload_trace'] = upload_trace
+
     plugins_conf = [
         {'name': KojiUploadPlugin.key, 'args': args},
     ]
@@ -1008,3 +1013,26 @@ class TestKojiUpload(object):
                                             release='1')
         runner = create_runner(tasker, workflow)
         runner.run()
+
+    @pytest.mark.parametrize(('upload_trace', 'traced'), [
+        (True, True),
+        (True, False),
+        (False, True),
+    ])
+    def test_koji_upload_trace(self, tmpdir, os_env, upload_trace, traced):
+        osbs = MockedOSBS()
+        tasker, workflow = mock_environment(tmpdir,
+                                            name='name',
+                                            version='1.0',
+                                            release='1')
+        if traced:
+            workflow.tracer = Tracer()
+            with workflow.tracer.span('prebuild', 'phase'):
+                pass
+        runner = create_runner(tasker, workflow, upload_trace=upload_trace)
+        runner.run()
+
+        data = get_metadata(workflow, osbs)
+        log_outputs = [output['filename'] for output in data['output']
+                       if output['type'] == 'log']
+        assert ('trace.json' in log_outputs) == (upload_trace and traced)
@@ -267,3 +267,35 @@ def test_pulp_publish_only_without_sync(before_name, after_name, publish,
         assert 'to be published' in caplog.text()
     else:
         assert 'publishing deferred' in caplog.text()
+
+
+@pytest.mark.skipif(dockpulp is None,
+                    reason='dockpulp module not available')
+@pytest.mark.parametrize('delta_exported', [True, False])
+def test_pulp_delta_image(tmpdir, monkeypatch, delta_exported):
+    tasker, workflow = prepare()
+    monkeypatch.setenv('SOURCE_SECRET_PATH', str(tmpdir))
+    with open(os.path.join(str(tmpdir), "pulp.cer"), "wt") as cer:
+        cer.write("pulp certificate\n")
+    with open(os.path.join(str(tmpdir), "pulp.key"), "wt") as key:
+        key.write("pulp key\n")
+
+    delta_path = os.path.join(str(tmpdir), 'image-delta.tar')
+    if delta_exported:
+        workflow.postbuild_results['export_image'] = {
+            'delta': {'path': delta_path, 'omitted_layers': ['sha256:base']},
+        }
+        # otherwise image is fetched from docker to temporary file
+    (flexmock(PulpPushPlugin)
+     .should_receive('push_tar')
+     .with_args(delta_path if delta_exported else object, list)
+     .and_return(('foo', []))
+     .once())
+
+    runner = PostBuildPluginsRunner(tasker, workflow, [{
+        'name': PulpPushPlugin.key,
+        'args': {
+            'pulp_registry_name': 'test',
+            'load_delta_image': True,
+        }}])
+    runner.run()
@@ -6,7 +6,8 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
-from atomic_reactor.plugin import PostBuildPlugin, ExitPlugin
+from atomic_reactor.constants import PLUGIN_PULP_PUBLISH_KEY
+from atomic_reactor.plugin import PostBuildPlugin, ExitPlugin, plugins_conflict
 from atomic_reactor.plugins.post_pulp_pull import PulpPullPlugin
 from atomic_reactor.inner import TagConf, PushConf
 from atomic_reactor.util import ImageName
@@ -410,3 +411,7 @@ class TestPostPulpPull(object):
         plugin = PulpPullPlugin(tasker, workflow)
         with pytest.raises(requests.exceptions.HTTPError):
             plugin.run()
+
+    def test_runs_after_pulp_publish(self):
+        pulp_publish = flexmock(key=PLUGIN_PULP_PUBLISH_KEY, reads=('tag_conf',), writes=())
+        assert plugins_conflict(pulp_publish, PulpPullPlugin)
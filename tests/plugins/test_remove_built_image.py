@@ -11,11 +11,14 @@ from __future__ import print_function, unicode_literals
 import flexmock
 import pytest
 
+from atomic_reactor.build import BuildResult
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
-from atomic_reactor.plugin import PostBuildPluginsRunner
+from atomic_reactor.plugin import PostBuildPluginsRunner, plugins_conflict
 from atomic_reactor.plugins.exit_remove_built_image import (GarbageCollectionPlugin,
                                                             defer_removal)
+from atomic_reactor.plugins.exit_delete_from_registry import DeleteFromRegistryPlugin
+from atomic_reactor.plugins.post_pulp_pull import PulpPullPlugin
 from atomic_reactor.plugins.post_tag_and_push import TagAndPushPlugin
 from atomic_reactor.util import ImageName
 from tests.constants import (LOCALHOST_REGISTRY,
@@ -83,3 +86,38 @@ class TestGarbageCollectionPlugin(object):
         image_set = set(removed_images)
         assert len(image_set) == len(removed_images)
         assert image_set == expected
+
+    @pytest.mark.parametrize(('checkpoint_file', 'failed', 'removed'), [
+        (None, True, True),
+        ('checkpoint', False, True),
+        ('checkpoint', True, False),
+    ])
+    def test_keep_images_for_checkpoint(self, checkpoint_file, failed, removed):
+        tasker, workflow = mock_environment()
+        workflow.checkpoint_file = checkpoint_file
+        if failed:
+            workflow.build_result = BuildResult(fail_reason='failed')
+        else:
+            workflow.build_result = BuildResult(image_id=INPUT_IMAGE)
+        runner = PostBuildPluginsRunner(
+            tasker,
+            workflow,
+            [{
+                'name': GarbageCollectionPlugin.key,
+            }]
+        )
+        (flexmock(tasker)
+         .should_receive('remove_image')
+         .times(2 if removed else 0))
+
+        runner.run()
+
+    @pytest.mark.parametrize(('plugin', 'conflict'), [
+        # pulp_pull changes the image to remove and defers removals
+        (PulpPullPlugin, True),
+        # images are kept for resuming when a plugin fails, delete_from_registry
+        # isn't allowed to fail so the runner waits for it to finish
+        (DeleteFromRegistryPlugin, False),
+    ])
+    def test_conflicts(self, plugin, conflict):
+        assert plugins_conflict(plugin, GarbageCollectionPlugin) == conflict
@@ -188,6 +188,9 @@ CMD blabla"""
     workflow.plugins_durations = {
         PostBuildRPMqaPlugin.key: 3.03,
     }
+    workflow.plugins_resource_usage = {
+        PostBuildRPMqaPlugin.key: {'cpu_user': 1.5, 'cpu_system': 0.2, 'docker_calls': 3},
+    }
     workflow.plugins_errors = {}
 
     if koji:
@@ -269,9 +272,14 @@ CMD blabla"""
     assert "errors" in annotations["plugins-metadata"]
     assert "durations" in annotations["plugins-metadata"]
     assert "timestamps" in annotations["plugins-metadata"]
+    assert "resource_usage" in annotations["plugins-metadata"]
+    assert "docker_retries" in annotations["plugins-metadata"]
 
     plugins_metadata = json.loads(annotations["plugins-metadata"])
     assert "all_rpm_packages" in plugins_metadata["durations"]
+    assert plugins_metadata["resource_usage"]["all_rpm_packages"]["docker_calls"] == 3
+    for metrics in plugins_metadata["docker_retries"].values():
+        assert metrics["circuit"] in ("open", "closed")
 
     if br_annotations:
         assert annotations['br_annotations'] == expected_br_annotations
@@ -11,7 +11,9 @@ from __future__ import print_function, unicode_literals
 import pytest
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
-from atomic_reactor.plugin import PostBuildPluginsRunner
+from atomic_reactor import util
+from atomic_reactor.plugin import PostBuildPluginsRunner, PluginFailedException
+from atomic_reactor.plugins.exit_remove_built_image import GarbageCollectionPlugin
 from atomic_reactor.plugins.post_tag_and_push import TagAndPushPlugin
 from atomic_reactor.util import ImageName, ManifestDigest
 from tests.constants import LOCALHOST_REGISTRY, TEST_IMAGE, INPUT_IMAGE, MOCK, DOCKER0_REGISTRY
@@ -283,3 +285,116 @@ def test_tag_and_push_plugin(
                 assert isinstance(workflow.push_conf.docker_registries[0].config, dict)
             else:
                 assert workflow.push_conf.docker_registries[0].config is None
+
+
+@pytest.mark.skipif(not MOCK, reason="requires mocked docker")
+def test_tag_and_push_registry_failure():
+    mock_docker()
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow({"provider": "git", "uri": "asd"}, TEST_IMAGE)
+    workflow.tag_conf.add_primary_image(TEST_IMAGE)
+    workflow.tag_conf.add_primary_image('image:other-tag')
+    setattr(workflow, 'builder', X)
+
+    def tag_and_push_image(image, target_image, insecure=False, force=False, dockercfg=None):
+        if target_image.registry == 'failing.example.com':
+            raise RuntimeError('push failed')
+        return target_image.to_str()
+
+    flexmock(tasker, tag_and_push_image=tag_and_push_image)
+    digests = ManifestDigest(v1=DIGEST_V1, v2=DIGEST_V2)
+    flexmock(util).should_receive('get_manifest_digests').and_return(digests)
+    (flexmock(util)
+        .should_receive('get_config_from_registry')
+        .with_args(object, 'registry.example.com', DIGEST_V2, False, None, 'v2')
+        .and_return({'config': {}})
+        .once())
+
+    runner = PostBuildPluginsRunner(
+        tasker,
+        workflow,
+        [{
+            'name': TagAndPushPlugin.key,
+            'args': {
+                'registries': {
+                    'failing.example.com': {},
+                    'registry.example.com': {},
+                },
+                'max_workers': 2,
+            },
+        }]
+    )
+    with pytest.raises(PluginFailedException) as exc:
+        runner.run()
+    assert 'push failed' in str(exc.value)
+
+    # other registry was pushed to
+    registry, = [registry for registry in workflow.push_conf.docker_registries
+                 if registry.uri == 'registry.example.com']
+    assert sorted(registry.digests) == sorted(['image:other-tag', TEST_IMAGE])
+    assert registry.config == {'config': {}}
+    removed = workflow.plugin_workspace[GarbageCollectionPlugin.key]['images_to_remove']
+    assert set(image.registry for image in removed) == set(['registry.example.com'])
+
+
+@pytest.mark.skipif(not MOCK, reason="requires mocked docker")
+@pytest.mark.parametrize('media_type', [
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.docker.distribution.manifest.v1+prettyjws',
+])
+def test_tag_and_push_once(media_type):
+    mock_docker()
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow({"provider": "git", "uri": "asd"}, TEST_IMAGE)
+    workflow.tag_conf.add_primary_images(['namespace/image:1', 'namespace/image:latest',
+                                          'other:latest'])
+    workflow.tag_conf.add_unique_image('namespace/image:unique')
+    setattr(workflow, 'builder', X)
+
+    pushed = []
+    flexmock(tasker, tag_and_push_image=lambda image, target_image, **kwargs:
+             pushed.append(target_image.to_str()))
+    tagged = []
+    flexmock(tasker, tag_image=lambda image, target_image, force=False:
+             tagged.append(target_image.to_str()))
+
+    manifest_response = requests.Response()
+    manifest_response.headers['Content-Type'] = media_type
+    manifest_response._content = b'manifest'
+    flexmock(util).should_receive('query_registry').and_return(manifest_response)
+    uploaded = []
+    flexmock(util, put_manifest=lambda image, registry, manifest, **kwargs:
+             uploaded.append((image.to_str(), manifest)))
+    flexmock(util).should_receive('get_manifest_digests').and_return(ManifestDigest(v1=DIGEST_V1))
+
+    runner = PostBuildPluginsRunner(
+        tasker,
+        workflow,
+        [{
+            'name': TagAndPushPlugin.key,
+            'args': {
+                'registries': {'registry.example.com': {}},
+                'push_once': True,
+            },
+        }]
+    )
+    output = runner.run()
+
+    all_images = ['registry.example.com/namespace/image:1',
+                  'registry.example.com/namespace/image:latest',
+                  'registry.example.com/other:latest',
+                  'registry.example.com/namespace/image:unique']
+    assert sorted(image.to_str() for image in output[TagAndPushPlugin.key]) == sorted(all_images)
+    registry, = workflow.push_conf.docker_registries
+    assert len(registry.digests) == 4
+
+    if media_type.endswith('v2+json'):
+        # one push per repository
+        assert pushed == ['registry.example.com/namespace/image:1',
+                          'registry.example.com/other:latest']
+        assert tagged == [image for image, _ in uploaded]
+        assert uploaded == [('registry.example.com/namespace/image:latest', b'manifest'),
+                            ('registry.example.com/namespace/image:unique', b'manifest')]
+    else:
+        assert pushed == all_images
+        assert uploaded == []
@@ -203,3 +203,15 @@ class TestCLISuite(object):
 
         encoding = codecs.getreader(match[1])
         assert encoding == encodings.utf_8.StreamReader
+
+    def test_resume(self):
+        (flexmock(atomic_reactor.cli.main)
+            .should_receive('resume_build')
+            .with_args('/tmp/checkpoint')
+            .once())
+        command = [
+            "main.py",
+            "resume",
+            "/tmp/checkpoint",
+        ]
+        self.exec_cli(command)
@@ -0,0 +1,51 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import gzip
+import io
+import os
+try:
+    from backports import lzma
+except ImportError:
+    import lzma
+
+import pytest
+
+from atomic_reactor.compression import (ParallelCompressor, compress_gzip_block,
+                                        compress_xz_block)
+
+
+@pytest.mark.parametrize('compress_block, decompress', [
+    (compress_gzip_block, lambda data: gzip.GzipFile(fileobj=io.BytesIO(data)).read()),
+    (compress_xz_block, lzma.decompress),
+])
+@pytest.mark.parametrize('data', [
+    b'',
+    b'short',
+    os.urandom(1000) + b'compressible ' * 1000,
+])
+@pytest.mark.parametrize('writes', [1, 7])
+def test_parallel_compressor(compress_block, decompress, data, writes):
+    output = io.BytesIO()
+    with ParallelCompressor(output, compress_block, threads=3, block_size=100) as fp:
+        chunk_size = -(-len(data) // writes) or 1
+        for start in range(0, len(data), chunk_size):
+            fp.write(data[start:start + chunk_size])
+    assert not output.closed
+
+    assert decompress(output.getvalue()) == data
+
+
+def test_parallel_compressor_closed():
+    fp = ParallelCompressor(io.BytesIO(), compress_gzip_block)
+    fp.close()
+    fp.close()
+    with pytest.raises(ValueError):
+        fp.write(b'data')
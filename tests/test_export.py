@@ -0,0 +1,178 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import tarfile
+import threading
+
+import pytest
+import six
+
+from atomic_reactor.export import get_base_diff_ids, tee, write_delta_image
+
+
+class CountingStream(object):
+    def __init__(self, data):
+        self.stream = six.BytesIO(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return self.stream.read(size)
+
+
+@pytest.mark.parametrize('size', [0, 1, 1000, 10000])
+def test_tee(size):
+    data = b''.join(six.int2byte(i % 256) for i in range(size))
+    stream = CountingStream(data)
+
+    def read_all(reader):
+        return reader.read()
+
+    def read_small(reader):
+        chunks = []
+        while True:
+            chunk = reader.read(7)
+            if not chunk:
+                break
+            assert len(chunk) <= 7
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def sha256(reader):
+        return hashlib.sha256(reader.read()).hexdigest()
+
+    results = tee(stream, {'all': read_all, 'small': read_small, 'sha256': sha256},
+                  chunk_size=100, max_queued=2)
+    assert results == {
+        'all': data,
+        'small': data,
+        'sha256': hashlib.sha256(data).hexdigest(),
+    }
+    # data were read only once
+    assert stream.reads == -(-size // 100) + 1
+
+
+def test_tee_concurrent():
+    started = threading.Barrier(2) if hasattr(threading, 'Barrier') else None
+    if started is None:
+        pytest.skip('threading.Barrier not available')
+
+    def consumer(reader):
+        # fails unless both consumers run at once
+        started.wait(5)
+        return reader.read()
+
+    results = tee(six.BytesIO(b'data'), {'a': consumer, 'b': consumer})
+    assert results == {'a': b'data', 'b': b'data'}
+
+
+def test_tee_consumer_failed():
+    data = b'x' * 10000
+
+    def failing(reader):
+        reader.read(10)
+        raise RuntimeError('consumer failed')
+
+    def stopping(reader):
+        return reader.read(10)
+
+    results = {}
+
+    def reading(reader):
+        results['reading'] = reader.read()
+
+    with pytest.raises(RuntimeError) as exc:
+        tee(six.BytesIO(data), {'failing': failing, 'stopping': stopping,
+                                'reading': reading},
+            chunk_size=10, max_queued=1)
+    assert 'consumer failed' in str(exc.value)
+    # other consumers still got the whole stream
+    assert results['reading'] == data
+
+
+def test_tee_stream_failed():
+    class FailingStream(object):
+        def read(self, size):
+            raise IOError('read failed')
+
+    consumed = []
+    with pytest.raises(IOError):
+        tee(FailingStream(), {'consumer': lambda reader: consumed.append(reader.read())})
+    assert consumed == [b'']
+
+
+def make_image_tarball(tmpdir, layer_contents):
+    """
+    create tarball like 'docker save' does
+
+    :return: (path to tarball, list of diff IDs of layers)
+    """
+    image_dir = tmpdir.mkdir('image')
+    layers = []
+    diff_ids = []
+    for index, content in enumerate(layer_contents):
+        layer_id = str(index) * 64
+        content_dir = tmpdir.mkdir('layer-%d' % index)
+        content_dir.join('file').write(content)
+        image_dir.mkdir(layer_id)
+        image_dir.join(layer_id, 'json').write('{"id": "%s"}' % layer_id)
+        layer_path = str(image_dir.join(layer_id, 'layer.tar'))
+        with tarfile.open(layer_path, mode='w') as layer_tar:
+            layer_tar.add(str(content_dir), arcname='.')
+        with open(layer_path, 'rb') as layer_file:
+            diff_ids.append('sha256:' + hashlib.sha256(layer_file.read()).hexdigest())
+        layers.append(layer_id + '/layer.tar')
+    config = json.dumps({'rootfs': {'type': 'layers', 'diff_ids': diff_ids}})
+    config_name = hashlib.sha256(config.encode('utf-8')).hexdigest() + '.json'
+    image_dir.join(config_name).write(config)
+    image_dir.join('manifest.json').write(json.dumps([{'Config': config_name,
+                                                       'Layers': layers}]))
+
+    path = str(tmpdir.join('image.tar'))
+    with tarfile.open(path, mode='w') as image_tar:
+        for name in sorted(os.listdir(str(image_dir))):
+            image_tar.add(str(image_dir.join(name)), arcname=name)
+    return path, diff_ids
+
+
+@pytest.mark.parametrize('omit', [[], [0], [0, 1], [1]])
+def test_write_delta_image(tmpdir, omit):
+    path, diff_ids = make_image_tarball(tmpdir, ['base\n' * 1000, 'middle\n', 'top\n' * 100])
+    delta_path = str(tmpdir.join('delta.tar'))
+    omit_diff_ids = [diff_ids[index] for index in omit] + ['sha256:' + 64 * 'f']
+
+    with open(path, 'rb') as image_file, open(delta_path, 'wb') as delta:
+        omitted = write_delta_image(image_file, delta, omit_diff_ids)
+    assert sorted(omitted) == sorted(diff_ids[index] for index in omit)
+
+    with tarfile.open(path) as image_tar, tarfile.open(delta_path) as delta_tar:
+        expected = [member.name for member in image_tar.getmembers()
+                    if member.name not in ['%s/layer.tar' % (str(index) * 64)
+                                           for index in omit]]
+        assert [member.name for member in delta_tar.getmembers()] == expected
+        for name in expected:
+            if image_tar.getmember(name).isfile():
+                assert (delta_tar.extractfile(name).read() ==
+                        image_tar.extractfile(name).read())
+
+
+@pytest.mark.parametrize(('base_layers', 'layers', 'expected'), [
+    (['sha256:a'], ['sha256:a', 'sha256:b'], ['sha256:a']),
+    ([], ['sha256:a'], []),
+    (None, ['sha256:a'], []),
+    # squashed image
+    (['sha256:a'], ['sha256:c'], []),
+])
+def test_get_base_diff_ids(base_layers, layers, expected):
+    base_inspect = {} if base_layers is None else {'RootFS': {'Layers': base_layers}}
+    assert get_base_diff_ids(base_inspect, {'RootFS': {'Layers': layers}}) == expected
@@ -11,6 +11,7 @@ from __future__ import unicode_literals
 from collections import defaultdict
 import json
 import os
+import time
 import docker
 from dockerfile_parse import DockerfileParser
 
@@ -32,6 +33,7 @@ import signal
 
 from atomic_reactor.inner import BuildResults, BuildResultsEncoder, BuildResultsJSONDecoder
 from atomic_reactor.inner import DockerBuildWorkflow
+from atomic_reactor.tracing import Tracer
 
 
 BUILD_RESULTS_ATTRS = ['build_logs',
@@ -72,6 +74,12 @@ class MockDockerTasker(object):
     def inspect_image(self, name):
         return {}
 
+    def image_exists(self, image_id):
+        return True
+
+    def remove_image(self, image_id, force=False):
+        pass
+
     def build_image_from_path(self):
         return True
 
@@ -265,6 +273,58 @@ class ExitCompat(WatchedMixIn, ExitPlugin):
     key = 'store_logs_to_file'
 
 
+class LoggedMixIn(object):
+    """
+    Mix-in class for plugins which log their runs into file.
+    """
+
+    is_allowed_to_fail = False
+
+    def __init__(self, tasker, workflow, log, fail_if_exists=None, *args, **kwargs):
+        super(LoggedMixIn, self).__init__(tasker, workflow, *args, **kwargs)
+        self.log_path = log
+        self.fail_if_exists = fail_if_exists
+
+    def run(self):
+        with open(self.log_path, 'a') as f:
+            f.write(self.key + '\n')
+        if self.fail_if_exists and os.path.exists(self.fail_if_exists):
+            raise RuntimeError('failed')
+        return self.key
+
+
+class PreLogged(LoggedMixIn, PreBuildPlugin):
+    key = 'pre_logged'
+
+
+class BuildStepLogged(LoggedMixIn, BuildStepPlugin):
+    key = 'buildstep_logged'
+
+    def run(self):
+        super(BuildStepLogged, self).run()
+        return DUMMY_BUILD_RESULT
+
+
+class PostLogged(LoggedMixIn, PostBuildPlugin):
+    key = 'post_logged'
+
+
+class PostLoggedFailing(LoggedMixIn, PostBuildPlugin):
+    key = 'post_logged_failing'
+
+
+class ExitLogged(LoggedMixIn, ExitPlugin):
+    key = 'exit_logged'
+
+
+class PreLoggedSleeping(LoggedMixIn, PreBuildPlugin):
+    key = 'pre_logged_sleeping'
+
+    def run(self):
+        super(PreLoggedSleeping, self).run()
+        time.sleep(30)
+
+
 class Watcher(object):
     def __init__(self, raise_exc=False):
         self.called = False
@@ -339,6 +399,211 @@ def test_workflow():
     assert workflow.base_image_inspect == {}
 
 
+def test_workflow_trace(tmpdir):
+    flexmock(DockerfileParser, content='df_content')
+    this_file = inspect.getfile(PreWatched)
+    mock_docker()
+    fake_builder = MockInsideBuilder()
+    flexmock(InsideBuilder).new_instances(fake_builder)
+    trace_file = str(tmpdir.join('trace.json'))
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image',
+                                   prebuild_plugins=[{'name': 'pre_watched',
+                                                      'args': {
+                                                          'watcher': Watcher()
+                                                      }}],
+                                   buildstep_plugins=[{'name': 'buildstep_watched',
+                                                       'args': {
+                                                           'watcher': Watcher()
+                                                       }}],
+                                   exit_plugins=[{'name': 'exit_watched',
+                                                  'args': {
+                                                      'watcher': Watcher()
+                                                  }}],
+                                   plugin_files=[this_file],
+                                   trace_file=trace_file)
+
+    workflow.build_docker_image()
+
+    with open(trace_file) as f:
+        trace = json.load(f)
+    spans = set((event['cat'], event['name']) for event in trace['traceEvents']
+                if event['ph'] == 'X')
+    assert set([('phase', 'prebuild'), ('phase', 'buildstep'), ('phase', 'prepublish'),
+                ('phase', 'postbuild'), ('phase', 'exit'), ('plugin', 'pre_watched'),
+                ('plugin', 'buildstep_watched'), ('plugin', 'exit_watched')]) <= spans
+
+
+def test_workflow_not_traced():
+    flexmock(DockerfileParser, content='df_content')
+    this_file = inspect.getfile(PreWatched)
+    mock_docker()
+    fake_builder = MockInsideBuilder()
+    flexmock(InsideBuilder).new_instances(fake_builder)
+    flexmock(Tracer).should_receive('add_span').never()
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image',
+                                   prebuild_plugins=[{'name': 'pre_watched',
+                                                      'args': {
+                                                          'watcher': Watcher()
+                                                      }}],
+                                   plugin_files=[this_file])
+    assert workflow.tracer is None
+
+    workflow.build_docker_image()
+
+
+def test_workflow_resume(tmpdir):
+    flexmock(DockerfileParser, content='df_content')
+    this_file = inspect.getfile(PreLogged)
+    mock_docker()
+    fake_builder = MockInsideBuilder()
+    flexmock(InsideBuilder).new_instances(fake_builder)
+    log = str(tmpdir.join('log'))
+    fail = str(tmpdir.join('fail'))
+    open(fail, 'w').close()
+    checkpoint_file = str(tmpdir.join('checkpoint'))
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image',
+                                   prebuild_plugins=[{'name': 'pre_logged',
+                                                      'args': {'log': log}}],
+                                   buildstep_plugins=[{'name': 'buildstep_logged',
+                                                       'args': {'log': log}}],
+                                   postbuild_plugins=[{'name': 'post_logged',
+                                                       'args': {'log': log}},
+                                                      {'name': 'post_logged_failing',
+                                                       'args': {'log': log,
+                                                                'fail_if_exists': fail}}],
+                                   exit_plugins=[{'name': 'exit_logged',
+                                                  'args': {'log': log}}],
+                                   plugin_files=[this_file],
+                                   checkpoint_file=checkpoint_file)
+    workflow.tag_conf.add_primary_image('image:1')
+
+    with pytest.raises(PluginFailedException):
+        workflow.build_docker_image()
+
+    # workdir is kept for resuming
+    assert os.path.exists(workflow.source.workdir)
+    with open(log) as f:
+        assert f.read().split() == ['pre_logged', 'buildstep_logged', 'post_logged',
+                                    'post_logged_failing', 'exit_logged']
+
+    os.remove(fail)
+    os.remove(log)
+    resumed = DockerBuildWorkflow.from_checkpoint(checkpoint_file)
+    assert resumed.completed_phases == ['prebuild', 'buildstep', 'prepublish']
+    assert resumed.source.workdir == workflow.source.workdir
+    assert resumed.prebuild_results == {'pre_logged': 'pre_logged'}
+    assert resumed.postbuild_results == {'post_logged': 'post_logged'}
+    assert [str(image) for image in resumed.tag_conf.images] == ['image:1']
+    assert not resumed.plugins_errors
+
+    build_result = resumed.build_docker_image()
+
+    assert not build_result.is_failed()
+    with open(log) as f:
+        assert f.read().split() == ['post_logged_failing', 'exit_logged']
+    assert resumed.postbuild_results == {'post_logged': 'post_logged',
+                                         'post_logged_failing': 'post_logged_failing'}
+    # build succeeded, nothing to resume
+    assert not os.path.exists(checkpoint_file)
+    assert not os.path.exists(workflow.source.workdir)
+
+
+@pytest.mark.parametrize('image_removed', [False, True])
+def test_workflow_resume_remove_built_image(tmpdir, image_removed):
+    flexmock(DockerfileParser, content='df_content')
+    this_file = inspect.getfile(PreLogged)
+    mock_docker()
+    fake_builder = MockInsideBuilder()
+    flexmock(InsideBuilder).new_instances(fake_builder)
+    log = str(tmpdir.join('log'))
+    fail = str(tmpdir.join('fail'))
+    open(fail, 'w').close()
+    checkpoint_file = str(tmpdir.join('checkpoint'))
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image',
+                                   buildstep_plugins=[{'name': 'buildstep_logged',
+                                                       'args': {'log': log}}],
+                                   postbuild_plugins=[{'name': 'post_logged',
+                                                       'args': {'log': log}},
+                                                      {'name': 'post_logged_failing',
+                                                       'args': {'log': log,
+                                                                'fail_if_exists': fail}}],
+                                   exit_plugins=[{'name': 'remove_built_image'}],
+                                   plugin_files=[this_file],
+                                   checkpoint_file=checkpoint_file,
+                                   client_version='1.0')
+    # images are kept while the build can be resumed
+    flexmock(fake_builder.tasker).should_receive('remove_image').never()
+    with pytest.raises(PluginFailedException):
+        workflow.build_docker_image()
+
+    os.remove(fail)
+    os.remove(log)
+    resumed = DockerBuildWorkflow.from_checkpoint(checkpoint_file)
+    assert resumed.client_version == '1.0'
+    (flexmock(fake_builder.tasker)
+     .should_receive('image_exists')
+     .and_return(not image_removed))
+    flexmock(fake_builder.tasker).should_receive('remove_image').at_least().once()
+    build_result = resumed.build_docker_image()
+
+    assert not build_result.is_failed()
+    with open(log) as f:
+        if image_removed:
+            # image is built and processed again
+            assert f.read().split() == ['buildstep_logged', 'post_logged',
+                                        'post_logged_failing']
+        else:
+            assert f.read().split() == ['post_logged_failing']
+    assert not os.path.exists(checkpoint_file)
+
+
+def test_workflow_no_checkpoint(tmpdir):
+    flexmock(DockerfileParser, content='df_content')
+    this_file = inspect.getfile(PreLogged)
+    mock_docker()
+    fake_builder = MockInsideBuilder()
+    flexmock(InsideBuilder).new_instances(fake_builder)
+    log = str(tmpdir.join('log'))
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image',
+                                   postbuild_plugins=[{'name': 'post_logged_failing',
+                                                       'args': {'log': log,
+                                                                'fail_if_exists': log}}],
+                                   plugin_files=[this_file])
+
+    with pytest.raises(PluginFailedException):
+        workflow.build_docker_image()
+
+    assert not os.path.exists(workflow.source.workdir)
+
+
+def test_workflow_build_timeout(tmpdir):
+    flexmock(DockerfileParser, content='df_content')
+    this_file = inspect.getfile(PreLogged)
+    mock_docker()
+    fake_builder = MockInsideBuilder()
+    flexmock(InsideBuilder).new_instances(fake_builder)
+    log = str(tmpdir.join('log'))
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image',
+                                   prebuild_plugins=[{'name': 'pre_logged_sleeping',
+                                                      'args': {'log': log}},
+                                                     {'name': 'pre_logged',
+                                                      'args': {'log': log}}],
+                                   exit_plugins=[{'name': 'exit_logged',
+                                                  'args': {'log': log}}],
+                                   plugin_files=[this_file],
+                                   build_timeout=0.2)
+
+    start = time.time()
+    with pytest.raises(PluginFailedException):
+        workflow.build_docker_image()
+
+    assert time.time() - start < 10
+    assert 'deadline' in workflow.plugins_errors['pre_logged_sleeping']
+    # exit plugins still run
+    with open(log) as f:
+        assert f.read().split() == ['pre_logged_sleeping', 'exit_logged']
+
+
 def test_workflow_base_images():
     """
     Test workflow for base images
@@ -0,0 +1,106 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+
+from atomic_reactor import largefile
+from atomic_reactor.largefile import drop_cache, open_large_file
+
+
+class FadviseRecorder(object):
+    def __init__(self):
+        self.calls = []
+        self.names = dict((getattr(os, name), name[len('POSIX_FADV_'):])
+                          for name in dir(os) if name.startswith('POSIX_FADV_'))
+
+    def __call__(self, fd, offset, length, advice):
+        self.calls.append((self.names[advice], offset, length))
+
+    def ranges(self, advice):
+        return [(offset, length) for name, offset, length in self.calls if name == advice]
+
+
+@pytest.fixture
+def fadvise(monkeypatch):
+    if not hasattr(os, 'posix_fadvise'):
+        pytest.skip('posix_fadvise not available')
+    recorder = FadviseRecorder()
+    monkeypatch.setattr(largefile, '_fadvise', recorder)
+    return recorder
+
+
+def test_read_large_file(tmpdir, fadvise):
+    path = str(tmpdir.join('file'))
+    data = os.urandom(1000)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    with open_large_file(path, window=100) as f:
+        chunks = []
+        for chunk in iter(lambda: f.read(30), b''):
+            chunks.append(chunk)
+        assert f.tell() == len(data)
+    assert b''.join(chunks) == data
+
+    assert fadvise.ranges('SEQUENTIAL') == [(0, 0)]
+    assert fadvise.ranges('WILLNEED')[0] == (0, 100)
+    # all read data were dropped from cache, consecutively
+    dropped = fadvise.ranges('DONTNEED')
+    assert dropped[0][0] == 0
+    for (offset, length), (next_offset, _) in zip(dropped, dropped[1:]):
+        assert offset + length == next_offset
+    assert sum(length for _, length in dropped) == len(data)
+
+
+def test_write_large_file(tmpdir, fadvise):
+    path = str(tmpdir.join('file'))
+    data = os.urandom(1000)
+    with open_large_file(path, 'wb', window=100) as f:
+        for offset in range(0, len(data), 30):
+            f.write(data[offset:offset + 30])
+            # last window is kept for writeback
+            assert all(offset + length <= f.tell() - 100
+                       for offset, length in fadvise.ranges('DONTNEED'))
+        f.seek(0)
+        f.write(b'x')
+    with open(path, 'rb') as f:
+        assert f.read() == b'x' + data[1:]
+
+    dropped = fadvise.ranges('DONTNEED')
+    assert sum(length for _, length in dropped) == len(data) + 1
+
+
+def test_large_file_no_drop(tmpdir, fadvise):
+    path = str(tmpdir.join('file'))
+    with open_large_file(path, 'wb', window=10, drop=False) as f:
+        f.write(100 * b'x')
+    with open_large_file(path, window=10, drop=False) as f:
+        assert f.read() == 100 * b'x'
+    assert fadvise.ranges('DONTNEED') == []
+
+
+def test_drop_cache(tmpdir, fadvise):
+    path = str(tmpdir.join('file'))
+    tmpdir.join('file').write('data')
+    assert drop_cache(path)
+    assert not drop_cache(str(tmpdir.join('missing')))
+    assert fadvise.ranges('DONTNEED') == [(0, 0)]
+
+
+def test_fadvise_unavailable(tmpdir, monkeypatch):
+    monkeypatch.setattr(largefile, '_fadvise', None)
+    path = str(tmpdir.join('file'))
+    with open_large_file(path, 'wb', window=10) as f:
+        f.write(100 * b'x')
+    with open_large_file(path, window=10) as f:
+        assert f.read() == 100 * b'x'
+    assert not drop_cache(path)
@@ -0,0 +1,100 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import time
+
+import pytest
+
+from atomic_reactor.layer_store import LayerStore
+
+
+def add_blob(store, data, key=None):
+    with store.writer(key) as blob:
+        blob.write(data)
+    return blob.key
+
+
+def test_add_and_open(tmpdir):
+    store = LayerStore(str(tmpdir.join('store')))
+    key = add_blob(store, b'layer')
+
+    assert key == 'sha256:' + hashlib.sha256(b'layer').hexdigest()
+    assert key in store
+    with store.open(key) as blob:
+        assert blob.read() == b'layer'
+
+    compressed_key = add_blob(store, b'compressed', key=key + '.gzip')
+    assert compressed_key == key + '.gzip'
+    with store.open(compressed_key) as blob:
+        assert blob.read() == b'compressed'
+
+    assert store.open('sha256:1234') is None
+
+
+def test_key_set_by_writer(tmpdir):
+    store = LayerStore(str(tmpdir))
+    with store.writer() as blob:
+        blob.write(b'compressed')
+        blob.key = 'sha256:1234.gzip-6'
+
+    assert blob.key == 'sha256:1234.gzip-6'
+    with store.open('sha256:1234.gzip-6') as compressed:
+        assert compressed.read() == b'compressed'
+
+
+def test_failed_write(tmpdir):
+    store = LayerStore(str(tmpdir))
+    with pytest.raises(RuntimeError):
+        with store.writer() as blob:
+            blob.write(b'partial')
+            raise RuntimeError('read failed')
+
+    assert os.listdir(store.blobs_path) == []
+
+
+@pytest.mark.parametrize('key', ['../escape', 'sha256:1234/x', 'sha256:xyz'])
+def test_invalid_key(tmpdir, key):
+    store = LayerStore(str(tmpdir))
+    with pytest.raises(ValueError):
+        store.open(key)
+
+
+def test_prune(tmpdir):
+    store = LayerStore(str(tmpdir), max_size=20)
+    keys = [add_blob(store, data * 10) for data in [b'a', b'b', b'c']]
+    now = time.time()
+    for age, key in zip([30, 20, 10], keys):
+        path = os.path.join(store.blobs_path, key)
+        os.utime(path, (now - age, now - age))
+
+    # using blob makes it the most recently used one
+    store.open(keys[0]).close()
+
+    assert store.prune() == [keys[1]]
+    assert keys[0] in store
+    assert keys[1] not in store
+    assert keys[2] in store
+    assert store.prune() == []
+
+
+def test_prune_tmp_files(tmpdir):
+    store = LayerStore(str(tmpdir))
+    now = time.time()
+    for name, age in [('.tmp-stale', 2 * 3600), ('.tmp-written', 60)]:
+        path = os.path.join(store.blobs_path, name)
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        os.utime(path, (now - age, now - age))
+
+    # temporary files aren't blobs
+    assert store.prune() == []
+    assert sorted(os.listdir(store.blobs_path)) == ['.tmp-written']
@@ -0,0 +1,200 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import tarfile
+
+import pytest
+
+from atomic_reactor.overlay2 import (TAR_SPLIT_FILE, TAR_SPLIT_SEGMENT, Overlay2Exporter,
+                                     Overlay2Layer, get_chain_ids)
+
+
+def segment(data):
+    return {'type': TAR_SPLIT_SEGMENT, 'payload': base64.b64encode(data).decode('ascii')}
+
+
+def make_tar_split(layer_tar):
+    """
+    split layer tarball to tar-split entries like docker does
+
+    :return: list of dicts
+    """
+    entries = []
+    with tarfile.open(fileobj=io.BytesIO(layer_tar)) as tar:
+        end = 0
+        for member in tar.getmembers():
+            entries.append(segment(layer_tar[end:member.offset_data]))
+            entries.append({'type': TAR_SPLIT_FILE, 'name': member.name, 'size': member.size})
+            end = member.offset_data + member.size
+    entries.append(segment(layer_tar[end:]))
+    return entries
+
+
+def make_docker_root(tmpdir, layers):
+    """
+    create overlay2 storage of docker daemon with an image
+
+    :param layers: list of dicts, file name -> content of each layer
+    :return: (docker root, image ID, list of diff IDs)
+    """
+    docker_root = tmpdir.mkdir('docker')
+    image_path = docker_root.mkdir('image').mkdir('overlay2')
+    diff_ids = []
+    for index, files in enumerate(layers):
+        diff_dir = docker_root.join('overlay2', 'cache-%d' % index, 'diff')
+        diff_dir.ensure(dir=True)
+        layer_file = io.BytesIO()
+        with tarfile.open(fileobj=layer_file, mode='w') as layer_tar:
+            for name, content in sorted(files.items()):
+                diff_dir.join(name).write(content, ensure=True)
+                layer_tar.add(str(diff_dir.join(name)), arcname=name)
+        layer_tar = layer_file.getvalue()
+        diff_ids.append('sha256:' + hashlib.sha256(layer_tar).hexdigest())
+
+        chain_id = get_chain_ids(diff_ids)[-1]
+        layerdb = image_path.join('layerdb', 'sha256', chain_id.split(':')[1])
+        layerdb.ensure(dir=True)
+        layerdb.join('cache-id').write('cache-%d' % index)
+        with gzip.open(str(layerdb.join('tar-split.json.gz')), 'wb') as tar_split:
+            for entry in make_tar_split(layer_tar):
+                tar_split.write(json.dumps(entry).encode('utf-8') + b'\n')
+
+    config = json.dumps({
+        'architecture': 'amd64',
+        'config': {'Cmd': ['/bin/sh']},
+        'created': '2017-01-01T00:00:00Z',
+        'rootfs': {'type': 'layers', 'diff_ids': diff_ids},
+    }).encode('utf-8')
+    image_id = 'sha256:' + hashlib.sha256(config).hexdigest()
+    content = image_path.join('imagedb', 'content', 'sha256')
+    content.ensure(dir=True)
+    content.join(image_id.split(':')[1]).write(config, mode='wb')
+    return str(docker_root), image_id, diff_ids
+
+
+def test_get_chain_ids():
+    diff_ids = ['sha256:' + 'a' * 64, 'sha256:' + 'b' * 64]
+    chain_ids = get_chain_ids(diff_ids)
+    assert chain_ids[0] == diff_ids[0]
+    expected = hashlib.sha256(('%s %s' % tuple(diff_ids)).encode('utf-8')).hexdigest()
+    assert chain_ids[1] == 'sha256:' + expected
+    assert get_chain_ids([]) == []
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_overlay2_export(tmpdir, workers):
+    layers = [
+        {'bin/sh': 'shell\n' * 1000, 'etc/os-release': 'test\n'},
+        {'empty': ''},
+        {'app/data': 'x' * 513, 'app/README': 'readme\n'},
+    ]
+    docker_root, image_id, diff_ids = make_docker_root(tmpdir, layers)
+    exporter = Overlay2Exporter(docker_root=docker_root, workers=workers)
+    path = str(tmpdir.join('image.tar'))
+    exporter.export(image_id, path, repo_tags=['registry/image'])
+
+    with tarfile.open(path) as image_tar:
+        names = image_tar.getnames()
+        assert names == sorted(names)
+        manifest = json.loads(image_tar.extractfile('manifest.json').read().decode('utf-8'))
+        assert len(manifest) == 1
+        assert manifest[0]['Config'] == image_id.split(':')[1] + '.json'
+        assert manifest[0]['RepoTags'] == ['registry/image:latest']
+        config = image_tar.extractfile(manifest[0]['Config']).read()
+        assert 'sha256:' + hashlib.sha256(config).hexdigest() == image_id
+
+        # reassembled layers are identical to the original ones
+        assert len(manifest[0]['Layers']) == len(layers)
+        for layer_name, diff_id, files in zip(manifest[0]['Layers'], diff_ids, layers):
+            layer_tar = image_tar.extractfile(layer_name).read()
+            assert 'sha256:' + hashlib.sha256(layer_tar).hexdigest() == diff_id
+            with tarfile.open(fileobj=io.BytesIO(layer_tar)) as layer:
+                for name, content in files.items():
+                    assert layer.extractfile(name).read() == content.encode('utf-8')
+
+        layer_json = json.loads(image_tar.extractfile(
+            manifest[0]['Layers'][-1].replace('layer.tar', 'json')).read().decode('utf-8'))
+        assert layer_json['config'] == {'Cmd': ['/bin/sh']}
+        assert 'parent' in layer_json
+        repositories = json.loads(image_tar.extractfile('repositories').read().decode('utf-8'))
+        assert repositories == {'registry/image': {'latest': layer_json['id']}}
+
+
+def test_overlay2_layer_changed(tmpdir):
+    docker_root, image_id, diff_ids = make_docker_root(tmpdir, [{'file': 'content\n'}])
+    tmpdir.join('docker', 'overlay2', 'cache-0', 'diff', 'file').write('changed')
+    exporter = Overlay2Exporter(docker_root=docker_root)
+    with pytest.raises(RuntimeError):
+        exporter.export(image_id, str(tmpdir.join('image.tar')))
+
+
+def test_overlay2_layer_digest_mismatch(tmpdir):
+    docker_root, image_id, diff_ids = make_docker_root(tmpdir, [{'file': 'content\n'}])
+    # same size, so only the digest of the layer tells the difference
+    tmpdir.join('docker', 'overlay2', 'cache-0', 'diff', 'file').write('CONTENT\n')
+    exporter = Overlay2Exporter(docker_root=docker_root)
+    with pytest.raises(RuntimeError) as exc:
+        exporter.export(image_id, str(tmpdir.join('image.tar')))
+    assert 'digest' in str(exc.value)
+
+
+@pytest.mark.parametrize('link_dir', [True, False])
+def test_overlay2_layer_symlink(tmpdir, link_dir):
+    secret = tmpdir.mkdir('host').join('secret')
+    secret.write('hidden\n')
+    docker_root, image_id, diff_ids = make_docker_root(tmpdir, [{'etc/secret': 'public\n'}])
+    diff_dir = tmpdir.join('docker', 'overlay2', 'cache-0', 'diff')
+    if link_dir:
+        diff_dir.join('etc').remove()
+        diff_dir.join('etc').mksymlinkto(secret.dirpath())
+    else:
+        diff_dir.join('etc', 'secret').remove()
+        diff_dir.join('etc', 'secret').mksymlinkto(secret)
+    layer = Overlay2Exporter(docker_root=docker_root).get_layers(diff_ids)[0]
+    out = io.BytesIO()
+    with pytest.raises((RuntimeError, OSError)):
+        layer.write(out)
+    assert b'hidden' not in out.getvalue()
+
+
+def test_overlay2_layer_file_outside(tmpdir):
+    layerdb = tmpdir.mkdir('layerdb')
+    with gzip.open(str(layerdb.join('tar-split.json.gz')), 'wb') as tar_split:
+        entry = {'type': TAR_SPLIT_FILE, 'name': '../../etc/passwd', 'size': 10}
+        tar_split.write(json.dumps(entry).encode('utf-8'))
+    layer = Overlay2Layer(str(layerdb), str(tmpdir.mkdir('diff')), 'sha256:' + 'a' * 64)
+    assert layer.get_size() == 10
+    with pytest.raises(RuntimeError):
+        layer.write(io.BytesIO())
+
+
+@pytest.mark.parametrize(('driver', 'accessible', 'available'), [
+    ('overlay2', True, True),
+    ('overlay2', False, False),
+    ('devicemapper', True, False),
+])
+def test_overlay2_from_docker_info(tmpdir, driver, accessible, available):
+    docker_root = tmpdir.mkdir('docker')
+    if accessible:
+        docker_root.mkdir('image').mkdir('overlay2')
+    info = {'Driver': driver, 'DockerRootDir': str(docker_root)}
+    exporter = Overlay2Exporter.from_docker_info(info, workers=2)
+    if available:
+        assert exporter.docker_root == str(docker_root)
+        assert exporter.workers == 2
+        assert exporter.image_path == os.path.join(str(docker_root), 'image', 'overlay2')
+    else:
+        assert exporter is None
@@ -8,8 +8,10 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import imp
 import json
 import os
+import threading
 import time
 
 from dockerfile_parse import DockerfileParser
@@ -24,7 +26,10 @@ from atomic_reactor.plugin import (BuildPluginsRunner, PreBuildPluginsRunner,
                                    ExitPluginsRunner, BuildStepPluginsRunner,
                                    PluginsRunner, InappropriateBuildStepError,
                                    BuildStepPlugin, PreBuildPlugin,
-                                   PreBuildSleepPlugin)
+                                   PreBuildSleepPlugin, PluginsIndex, plugins_conflict,
+                                   BUILD_STATUS,
+                                   BuildCanceledException, PluginTimeoutException)
+import atomic_reactor.plugin
 from atomic_reactor.plugins.pre_add_yum_repo_by_url import AddYumRepoByUrlPlugin
 from atomic_reactor.util import ImageName
 
@@ -59,6 +64,50 @@ class MyPreBuildPlugin(PreBuildPlugin):
         raise InappropriateBuildStepError
 
 
+class ConcurrentPlugin(PreBuildPlugin):
+    """
+    waits until all plugins from the same group are running
+    """
+    key = None
+    reads = ()
+    writes = ()
+    is_allowed_to_fail = False
+    events = {}
+    run_log = []
+
+    def __init__(self, tasker, workflow, group=(), fail=False):
+        super(ConcurrentPlugin, self).__init__(tasker, workflow)
+        self.group = group
+        self.fail = fail
+
+    def run(self):
+        self.run_log.append(('start', self.key))
+        self.events[self.key].set()
+        for key in self.group:
+            assert self.events[key].wait(5)
+        self.run_log.append(('finish', self.key))
+        if self.fail:
+            raise RuntimeError('failed')
+        return self.key
+
+
+def concurrent_plugins(*plugins):
+    """
+    create ConcurrentPlugin subclasses
+
+    :param plugins: list of tuples (key, reads, writes)
+    :return: dict, key -> plugin class
+    """
+    ConcurrentPlugin.events = {}
+    ConcurrentPlugin.run_log = []
+    plugin_classes = {}
+    for key, reads, writes in plugins:
+        ConcurrentPlugin.events[key] = threading.Event()
+        plugin_classes[key] = type(str(key), (ConcurrentPlugin,),
+                                   {'key': key, 'reads': reads, 'writes': writes})
+    return plugin_classes
+
+
 def mock_workflow(tmpdir):
     if MOCK:
         mock_docker()
@@ -83,20 +132,117 @@ def mock_workflow(tmpdir):
     return workflow
 
 
-@pytest.mark.parametrize('runner_type', [  # noqa
-    PreBuildPluginsRunner,
-    PrePublishPluginsRunner,
-    PostBuildPluginsRunner,
-    ExitPluginsRunner,
-    BuildStepPluginsRunner,
+@pytest.mark.parametrize(('runner_type', 'plugin_name'), [  # noqa
+    (PreBuildPluginsRunner, 'add_yum_repo_by_url'),
+    (PrePublishPluginsRunner, 'squash'),
+    (PostBuildPluginsRunner, 'all_rpm_packages'),
+    (ExitPluginsRunner, 'remove_built_image'),
+    (BuildStepPluginsRunner, 'docker_api'),
 ])
-def test_load_plugins(docker_tasker, runner_type):
+def test_load_plugins(docker_tasker, runner_type, plugin_name):
     """
     test loading plugins
     """
-    runner = runner_type(docker_tasker, DockerBuildWorkflow(SOURCE, ""), None)
-    assert runner.plugin_classes is not None
-    assert len(runner.plugin_classes) > 0
+    runner = runner_type(docker_tasker, DockerBuildWorkflow(SOURCE, ""),
+                         [{'name': plugin_name}])
+    assert list(runner.plugin_classes.keys()) == [plugin_name]
+
+
+class TestPluginsIndex(object):
+    PLUGIN_FILE = """
+from atomic_reactor.plugin import PreBuildPlugin, ExitPlugin
+
+class MyPreBuildPlugin(PreBuildPlugin):
+    key = '{key}'
+
+class MyExitPlugin(ExitPlugin):
+    key = 'my_exit'
+"""
+
+    def write_plugin(self, tmpdir, name, key='my_prebuild'):
+        path = tmpdir.join(name)
+        path.write(self.PLUGIN_FILE.format(key=key))
+        return str(path)
+
+    def test_get_plugin_classes(self, tmpdir):
+        index = PluginsIndex(path=str(tmpdir.join('index.json')))
+        path = self.write_plugin(tmpdir, 'my_plugins.py')
+
+        classes = index.get_plugin_classes([path], 'PreBuildPlugin')
+        assert list(classes.keys()) == ['my_prebuild']
+        classes = index.get_plugin_classes([path], 'PostBuildPlugin')
+        assert list(classes.keys()) == ['my_exit']
+        classes = index.get_plugin_classes([path], 'ExitPlugin', keys=set(['other']))
+        assert classes == {}
+
+    def test_only_requested_modules_imported(self, tmpdir):
+        index_path = str(tmpdir.join('index.json'))
+        used = self.write_plugin(tmpdir, 'used_plugins.py', key='used')
+        unused = self.write_plugin(tmpdir, 'unused_plugins.py', key='unused')
+        PluginsIndex(path=index_path).get_plugin_classes([used, unused], 'PreBuildPlugin')
+
+        index = PluginsIndex(path=index_path)
+        (flexmock(imp)
+            .should_call('load_source')
+            .with_args('used_plugins', used)
+            .once())
+        classes = index.get_plugin_classes([used, unused], 'PreBuildPlugin',
+                                           keys=set(['used']))
+        assert list(classes.keys()) == ['used']
+
+    def test_changed_file_reindexed(self, tmpdir):
+        index_path = str(tmpdir.join('index.json'))
+        path = self.write_plugin(tmpdir, 'my_plugins.py', key='old')
+        PluginsIndex(path=index_path).get_plugin_classes([path], 'PreBuildPlugin')
+
+        self.write_plugin(tmpdir, 'my_plugins.py', key='new_key')
+        classes = PluginsIndex(path=index_path).get_plugin_classes([path], 'PreBuildPlugin')
+        assert list(classes.keys()) == ['new_key']
+
+    def test_stale_key_reindexed(self, tmpdir):
+        index_path = tmpdir.join('index.json')
+        path = self.write_plugin(tmpdir, 'my_plugins.py', key='new_key')
+        PluginsIndex(path=str(index_path)).get_plugin_classes([path], 'PreBuildPlugin')
+        # key changed elsewhere (e.g. in constants), file looks the same
+        index_path.write(index_path.read().replace('new_key', 'old_key'))
+
+        index = PluginsIndex(path=str(index_path))
+        classes = index.get_plugin_classes([path], 'PreBuildPlugin', keys=set(['old_key']))
+        assert classes == {}
+        classes = index.get_plugin_classes([path], 'PreBuildPlugin', keys=set(['new_key']))
+        assert list(classes.keys()) == ['new_key']
+        assert 'old_key' not in index_path.read()
+
+    def test_index_version(self, tmpdir):
+        index_path = tmpdir.join('index.json')
+        path = self.write_plugin(tmpdir, 'my_plugins.py')
+        PluginsIndex(path=str(index_path)).get_plugin_classes([path], 'PreBuildPlugin')
+        assert json.loads(index_path.read())['version'] == PluginsIndex.version
+
+        index = PluginsIndex(path=str(index_path))
+        index._read()
+        assert path in index._files
+
+        # index written by other version of atomic-reactor or python is not used
+        flexmock(PluginsIndex, version=[1, 'other', 'other'])
+        index = PluginsIndex(path=str(index_path))
+        index._read()
+        assert index._files == {}
+
+    def test_default_path(self, plugins_index_path):
+        assert PluginsIndex().path == plugins_index_path
+
+    @pytest.mark.parametrize('content', [None, '', '{"version": 0, "files": {}}'])
+    def test_invalid_index(self, tmpdir, content):
+        index_path = tmpdir.join('index.json')
+        if content is not None:
+            index_path.write(content)
+        path = self.write_plugin(tmpdir, 'my_plugins.py')
+
+        index = PluginsIndex(path=str(index_path))
+        classes = index.get_plugin_classes([path], 'PreBuildPlugin')
+        assert list(classes.keys()) == ['my_prebuild']
+        assert json.loads(index_path.read())['files'][path]['plugins']
 
 
 class X(object):
@@ -272,6 +418,291 @@ def test_fallback_to_docker_build(docker_tasker):  # noqa
     assert runner.plugins_conf == [{'name': 'docker_api', 'is_allowed_to_fail': False}]
 
 
+@pytest.mark.parametrize(('first', 'second', 'conflict'), [
+    ((None, None), ((), ()), True),
+    (((), ()), ((), None), True),
+    (((), ()), ((), ()), False),
+    ((('a',), ()), (('a',), ()), False),
+    ((('a',), ()), ((), ('a',)), True),
+    (((), ('a',)), ((), ('a',)), True),
+    ((('second',), ()), ((), ()), True),
+    (((), ('a',)), (('b',), ('c',)), False),
+    # build status orders plugins in PluginsRunner, it isn't a conflict
+    (((BUILD_STATUS,), ()), ((), ()), False),
+    (((BUILD_STATUS,), ()), ((BUILD_STATUS,), ()), False),
+])
+def test_plugins_conflict(first, second, conflict):
+    first = flexmock(key='first', reads=first[0], writes=first[1])
+    second = flexmock(key='second', reads=second[0], writes=second[1])
+    assert plugins_conflict(first, second) is conflict
+    assert plugins_conflict(second, first) is conflict
+
+
+class TestConcurrentPlugins(object):
+    def test_independent_plugins(self, tmpdir, docker_tasker):  # noqa
+        workflow = mock_workflow(tmpdir)
+        plugin_classes = concurrent_plugins(('a', (), ('x',)),
+                                            ('b', ('y',), ()),
+                                            ('c', (), ('z',)))
+        flexmock(PluginsRunner, load_plugins=lambda x: plugin_classes)
+        runner = PreBuildPluginsRunner(docker_tasker, workflow,
+                                       [{'name': 'a', 'args': {'group': ['b', 'c']}},
+                                        {'name': 'b', 'args': {'group': ['a', 'c']}},
+                                        {'name': 'c', 'args': {'group': ['a', 'b']}}],
+                                       max_workers=3)
+        results = runner.run()
+
+        assert results == {'a': 'a', 'b': 'b', 'c': 'c'}
+        for key in 'abc':
+            assert key in workflow.plugins_timestamps
+            assert key in workflow.plugins_durations
+            assert workflow.plugins_resource_usage[key]['docker_calls'] == 0
+
+    @pytest.mark.parametrize(('max_workers', 'b_reads', 'b_writes', 'overtake'), [
+        # b reads what a writes, c can run before b
+        (3, ('x',), (), True),
+        # b doesn't declare what it accesses
+        (3, None, None, False),
+        # c can't overtake b
+        (3, ('x',), ('y',), False),
+        (1, (), (), False),
+    ])
+    def test_ordering(self, tmpdir, docker_tasker, max_workers, b_reads, b_writes,  # noqa
+                      overtake):
+        workflow = mock_workflow(tmpdir)
+        plugin_classes = concurrent_plugins(('a', (), ('x',)),
+                                            ('b', b_reads, b_writes),
+                                            ('c', ('y',), ()))
+        flexmock(PluginsRunner, load_plugins=lambda x: plugin_classes)
+        plugins_conf = [{'name': 'a'}, {'name': 'b'}, {'name': 'c'}]
+        if overtake:
+            # a and c run at the same time
+            plugins_conf[0]['args'] = {'group': ['c']}
+            plugins_conf[2]['args'] = {'group': ['a']}
+        runner = PreBuildPluginsRunner(docker_tasker, workflow, plugins_conf,
+                                       max_workers=max_workers)
+        assert runner.run() == {'a': 'a', 'b': 'b', 'c': 'c'}
+
+        log = ConcurrentPlugin.run_log
+        assert log.index(('finish', 'a')) < log.index(('start', 'b'))
+        if overtake:
+            assert log.index(('start', 'c')) < log.index(('start', 'b'))
+        else:
+            assert log.index(('finish', 'b')) < log.index(('start', 'c'))
+
+    def test_build_status_readers(self, tmpdir, docker_tasker):  # noqa
+        workflow = mock_workflow(tmpdir)
+        plugin_classes = concurrent_plugins(('a', (), ('x',)),
+                                            ('b', (BUILD_STATUS,), ()),
+                                            ('c', (BUILD_STATUS,), ()),
+                                            ('d', ('y',), ()))
+        flexmock(PluginsRunner, load_plugins=lambda x: plugin_classes)
+        runner = ExitPluginsRunner(docker_tasker, workflow,
+                                   [{'name': 'a', 'args': {'group': ['d']}},
+                                    {'name': 'b', 'args': {'group': ['c']},
+                                     'is_allowed_to_fail': True},
+                                    {'name': 'c', 'args': {'group': ['b']},
+                                     'is_allowed_to_fail': True},
+                                    {'name': 'd', 'args': {'group': ['a']}}],
+                                   max_workers=4)
+        assert runner.run() == {'a': 'a', 'b': 'b', 'c': 'c', 'd': 'd'}
+
+        log = ConcurrentPlugin.run_log
+        # b and c wait for a which may fail the build, then run concurrently
+        for key in 'bc':
+            assert log.index(('finish', 'a')) < log.index(('start', key))
+        # d isn't held back by b and c
+        assert log.index(('start', 'd')) < log.index(('finish', 'a'))
+
+    def test_build_status_reader_not_allowed_to_fail(self, tmpdir, docker_tasker):  # noqa
+        workflow = mock_workflow(tmpdir)
+        plugin_classes = concurrent_plugins(('a', (BUILD_STATUS,), ()),
+                                            ('b', (BUILD_STATUS,), ()))
+        flexmock(PluginsRunner, load_plugins=lambda x: plugin_classes)
+        runner = ExitPluginsRunner(docker_tasker, workflow,
+                                   [{'name': 'a'}, {'name': 'b'}], max_workers=2)
+        assert runner.run() == {'a': 'a', 'b': 'b'}
+
+        log = ConcurrentPlugin.run_log
+        assert log.index(('finish', 'a')) < log.index(('start', 'b'))
+
+    @pytest.mark.parametrize('keep_going', [True, False])
+    def test_failure(self, tmpdir, docker_tasker, keep_going):  # noqa
+        workflow = mock_workflow(tmpdir)
+        plugin_classes = concurrent_plugins(('a', (), ()),
+                                            ('b', (), ('x',)),
+                                            ('c', ('x',), ()),
+                                            ('d', (), ()))
+        flexmock(PluginsRunner, load_plugins=lambda x: plugin_classes)
+        runner = ExitPluginsRunner(docker_tasker, workflow,
+                                   [{'name': 'a', 'args': {'group': ['b'], 'fail': True}},
+                                    {'name': 'b', 'args': {'group': ['a'], 'fail': True}},
+                                    {'name': 'c'},
+                                    {'name': 'd'}],
+                                   max_workers=2)
+        with pytest.raises(PluginFailedException) as exc:
+            runner.run(keep_going=keep_going)
+
+        assert workflow.plugin_failed
+        assert set(workflow.plugins_errors.keys()) == set(['a', 'b'])
+        if keep_going:
+            assert 'Multiple plugins raised an exception' in str(exc)
+            assert set(workflow.exit_results.keys()) == set(['a', 'b', 'c', 'd'])
+            assert isinstance(workflow.exit_results['a'], RuntimeError)
+        else:
+            # no plugins are started after failure
+            assert set(workflow.plugins_timestamps.keys()) == set(['a', 'b'])
+
+    def test_missing_plugin(self, tmpdir, docker_tasker):  # noqa
+        workflow = mock_workflow(tmpdir)
+        plugin_classes = concurrent_plugins(('a', (), ()), ('c', (), ()))
+        flexmock(PluginsRunner, load_plugins=lambda x: plugin_classes)
+        runner = PostBuildPluginsRunner(docker_tasker, workflow,
+                                        [{'name': 'a'}, {'name': 'b'}, {'name': 'c'}],
+                                        max_workers=2)
+        with pytest.raises(PluginFailedException):
+            runner.run()
+        assert set(workflow.postbuild_results.keys()) == set(['a'])
+        assert 'b' in workflow.plugins_errors
+
+    def test_cancel(self, tmpdir, docker_tasker, monkeypatch):  # noqa
+        class LoopingPlugin(ConcurrentPlugin):
+            def run(self):
+                self.events[self.key].set()
+                while True:
+                    time.sleep(0.01)
+
+        def cancel(futures, **kwargs):
+            for key in 'ab':
+                assert ConcurrentPlugin.events[key].wait(5)
+            raise BuildCanceledException('Build was canceled')
+
+        workflow = mock_workflow(tmpdir)
+        plugin_classes = concurrent_plugins(('a', (), ()), ('b', (), ()))
+        for key in plugin_classes:
+            plugin_classes[key] = type(str(key), (LoopingPlugin,), {'key': key})
+        flexmock(PluginsRunner, load_plugins=lambda x: plugin_classes)
+        monkeypatch.setattr(atomic_reactor.plugin, 'wait', cancel)
+        runner = PreBuildPluginsRunner(docker_tasker, workflow,
+                                       [{'name': 'a'}, {'name': 'b'}],
+                                       max_workers=2)
+        with pytest.raises(BuildCanceledException):
+            runner.run()
+        # plugins were interrupted
+        assert set(workflow.plugins_errors.keys()) == set(['a', 'b'])
+
+
+class SleepingPlugin(PreBuildPlugin):
+    """
+    sleeps for a long time
+    """
+    key = 'sleeping'
+    is_allowed_to_fail = False
+
+    def run(self):
+        for _ in range(1000):
+            time.sleep(0.01)
+
+
+class TestPluginsTimeout(object):
+    @pytest.mark.parametrize(('reads', 'writes', 'max_workers'), [
+        # run in main thread
+        (None, None, 1),
+        (None, None, 2),
+        # run in thread of thread pool
+        ((), (), 2),
+    ])
+    def test_plugin_timeout(self, tmpdir, docker_tasker, reads, writes,  # noqa
+                            max_workers):
+        workflow = mock_workflow(tmpdir)
+        plugin_class = type(str('sleeping'), (SleepingPlugin,),
+                            {'reads': reads, 'writes': writes})
+        flexmock(PluginsRunner, load_plugins=lambda x: {'sleeping': plugin_class})
+        runner = PreBuildPluginsRunner(docker_tasker, workflow,
+                                       [{'name': 'sleeping', 'timeout': 0.1}],
+                                       max_workers=max_workers)
+        start = time.time()
+        with pytest.raises(PluginFailedException) as exc:
+            runner.run()
+        assert time.time() - start < 5
+        assert 'timed out' in str(exc.value)
+        assert PluginTimeoutException.__name__ in workflow.plugins_errors['sleeping']
+
+    def test_plugin_finished_in_time(self, tmpdir, docker_tasker):  # noqa
+        workflow = mock_workflow(tmpdir)
+        plugin_classes = concurrent_plugins(('a', (), ()))
+        flexmock(PluginsRunner, load_plugins=lambda x: plugin_classes)
+        runner = PreBuildPluginsRunner(docker_tasker, workflow,
+                                       [{'name': 'a', 'timeout': 0.1}])
+        assert runner.run() == {'a': 'a'}
+        # timer doesn't fire after plugin finished
+        time.sleep(0.2)
+
+    @pytest.mark.parametrize('time_left', [0.1, -1])
+    def test_deadline(self, tmpdir, docker_tasker, time_left):  # noqa
+        workflow = mock_workflow(tmpdir)
+        flexmock(PluginsRunner, load_plugins=lambda x: {'sleeping': SleepingPlugin})
+        runner = PreBuildPluginsRunner(docker_tasker, workflow,
+                                       [{'name': 'sleeping', 'is_allowed_to_fail': True,
+                                         'timeout': 100}],
+                                       deadline=time.time() + time_left)
+        # deadline is fatal even to plugins allowed to fail
+        with pytest.raises(PluginFailedException) as exc:
+            runner.run()
+        assert 'deadline' in str(exc.value)
+        assert 'deadline' in workflow.plugins_errors['sleeping']
+
+
+class PrefetchingPlugin(PreBuildPlugin):
+    """
+    records arguments it was created with for prefetch
+    """
+    key = 'prefetching'
+    prefetched = []
+    created = []
+
+    def __init__(self, tasker, workflow, url=None):
+        super(PrefetchingPlugin, self).__init__(tasker, workflow)
+        self.url = url
+        self.created.append(url)
+
+    def prefetch(self):
+        if self.url is None:
+            raise RuntimeError('nothing to prefetch')
+        self.prefetched.append(self.url)
+
+    def run(self):
+        pass
+
+
+def test_prefetch(tmpdir, docker_tasker):  # noqa
+    workflow = mock_workflow(tmpdir)
+    plugin_classes = concurrent_plugins(('a', (), ()))
+    plugin_classes['prefetching'] = PrefetchingPlugin
+    flexmock(PluginsRunner, load_plugins=lambda x: plugin_classes)
+    flexmock(PrefetchingPlugin, prefetched=[], created=[])
+    runner = PreBuildPluginsRunner(docker_tasker, workflow, [
+        {'name': 'a'},
+        {'name': 'prefetching', 'args': {'url': 'http://example.com/'}},
+        # prefetch failures are ignored
+        {'name': 'prefetching'},
+        {'name': 'missing'},
+    ])
+    runner.prefetch()
+    assert PrefetchingPlugin.prefetched == ['http://example.com/']
+    assert PrefetchingPlugin.created == ['http://example.com/', None]
+
+    # instance which started prefetch is run, the failed one is created again
+    instance = runner.create_instance_from_plugin(PrefetchingPlugin,
+                                                  {'url': 'http://example.com/'})
+    assert instance.url == 'http://example.com/'
+    runner.create_instance_from_plugin(PrefetchingPlugin, {})
+    assert PrefetchingPlugin.created == ['http://example.com/', None, None]
+    # each instance is run only once
+    runner.create_instance_from_plugin(PrefetchingPlugin, {'url': 'http://example.com/'})
+    assert len(PrefetchingPlugin.created) == 4
+
+
 class TestBuildPluginsRunner(object):
 
     @pytest.mark.parametrize(('params'), [
@@ -0,0 +1,123 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import threading
+import time
+
+import pytest
+
+from atomic_reactor.prefetch import (Prefetcher, get_prefetched, get_prefetcher,
+                                     set_prefetcher, start_prefetch)
+
+
+@pytest.fixture
+def prefetcher():
+    prefetcher = Prefetcher()
+    set_prefetcher(prefetcher)
+    yield prefetcher
+    set_prefetcher(None)
+    prefetcher.shutdown()
+
+
+class Fetcher(object):
+    def __init__(self, result='data', exc=None):
+        self.result = result
+        self.exc = exc
+        self.calls = []
+
+    def __call__(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+        if self.exc:
+            raise self.exc
+        return self.result
+
+
+def test_prefetched(prefetcher):
+    fetch = Fetcher()
+    start_prefetch(('data', 'a'), fetch, 'a', arg='b')
+    start_prefetch(('data', 'a'), fetch, 'a', arg='b')
+
+    assert get_prefetched(('data', 'a'), fetch, 'a', arg='b') == 'data'
+    assert fetch.calls == [(('a',), {'arg': 'b'})]
+
+    # results are handed out only once
+    assert get_prefetched(('data', 'a'), fetch, 'a', arg='b') == 'data'
+    assert len(fetch.calls) == 2
+
+
+def test_not_prefetched(prefetcher):
+    fetch = Fetcher()
+    start_prefetch(('data', 'a'), fetch, 'a')
+    prefetcher.get(('data', 'a'), fetch, 'a')
+
+    assert get_prefetched(('data', 'b'), fetch, 'b') == 'data'
+    assert fetch.calls[-1] == (('b',), {})
+
+
+def test_prefetch_failed(prefetcher):
+    start_prefetch(('data',), Fetcher(exc=RuntimeError('unavailable')))
+
+    assert get_prefetched(('data',), Fetcher(result='fetched again')) == 'fetched again'
+
+
+def test_prefetch_in_background(prefetcher):
+    started = threading.Event()
+    finish = threading.Event()
+
+    def fetch():
+        started.set()
+        finish.wait()
+        return threading.current_thread()
+
+    start_prefetch(('thread',), fetch)
+    assert started.wait(5)
+    finish.set()
+    assert get_prefetched(('thread',), fetch) is not threading.current_thread()
+
+
+def test_shutdown(prefetcher):
+    fetch = Fetcher()
+    start_prefetch(('data',), fetch)
+    prefetcher.shutdown()
+
+    assert get_prefetched(('data',), Fetcher(result='fetched again')) == 'fetched again'
+
+
+def test_shutdown_waits(prefetcher):
+    started = threading.Event()
+    finished = []
+
+    def fetch():
+        started.set()
+        time.sleep(0.2)
+        finished.append(True)
+
+    start_prefetch(('slow',), fetch)
+    not_started = Fetcher()
+    for index in range(prefetcher.max_workers):
+        start_prefetch(('queued', index), not_started)
+    assert started.wait(5)
+    prefetcher.shutdown()
+
+    # running prefetch finished, queued ones didn't run after shutdown
+    assert finished == [True]
+    calls = len(not_started.calls)
+    time.sleep(0.1)
+    assert len(not_started.calls) == calls
+
+
+def test_no_prefetcher():
+    assert get_prefetcher() is None
+    fetch = Fetcher()
+    start_prefetch(('data',), fetch)
+    assert not fetch.calls
+
+    assert get_prefetched(('data',), fetch) == 'data'
+    assert len(fetch.calls) == 1
@@ -10,7 +10,9 @@ from __future__ import print_function, unicode_literals
 
 from tests.fixtures import temp_image_name, docker_tasker  # noqa
 
-from atomic_reactor.core import DockerTasker, retry
+from atomic_reactor.core import (AsyncDockerTasker, DockerTasker, retry, RetryPolicy,
+                                 DockerUnavailableException, get_retry_metrics,
+                                 clear_docker_clients, get_docker_client)
 from atomic_reactor.util import ImageName, clone_git_repo
 from tests.constants import LOCALHOST_REGISTRY, INPUT_IMAGE, DOCKERFILE_GIT, MOCK, COMMAND
 from tests.util import requires_internet
@@ -19,6 +21,7 @@ import docker
 import docker.errors
 import requests
 import sys
+import threading
 import time
 from docker.errors import APIError
 
@@ -252,7 +255,7 @@ def test_get_image_info_by_id_nonexistent():
 
 def test_get_image_info_by_id():
     if MOCK:
-        mock_docker(provided_image_repotags=input_image_name.to_str())
+        mock_docker(provided_image_repotags=[input_image_name.to_str()])
 
     t = DockerTasker()
     image_id = t.get_image_info_by_image_name(input_image_name)[0]['Id']
@@ -326,11 +329,18 @@ def test_get_version():
     assert isinstance(response, dict)
 
 
+@pytest.fixture
+def new_docker_clients():
+    clear_docker_clients()
+    yield
+    clear_docker_clients()
+
+
 @pytest.mark.parametrize(('timeout', 'expected_timeout'), [
     (None, 120),
     (60, 60),
 ])
-def test_timeout(timeout, expected_timeout):
+def test_timeout(new_docker_clients, timeout, expected_timeout):
     if not hasattr(docker, 'APIClient'):
         setattr(docker, 'APIClient', docker.Client)
 
@@ -351,7 +361,7 @@ def test_timeout(timeout, expected_timeout):
     DockerTasker(**kwargs)
 
 
-def test_docker2():
+def test_docker2(new_docker_clients):
     class MockClient(object):
         def __init__(self, **kwargs):
             pass
@@ -403,3 +413,292 @@ def test_retry_method(retry_times):
             retry(my_func, *my_args, retry=retry_times, **my_kwargs)
     else:
         retry(my_func, *my_args, retry=retry_times, **my_kwargs)
+
+
+class FailingCall(object):
+    """
+    fails with responses of given statuses, then succeeds
+    """
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.statuses:
+            response = requests.Response()
+            response.status_code = self.statuses.pop(0)
+            raise APIError("test fail", response)
+        return 'result'
+
+
+def test_retry_jitter():
+    delays = []
+    flexmock(time).should_receive('sleep').replace_with(delays.append)
+    function = FailingCall(500, 502, 503)
+    policy = RetryPolicy(backoff_factor=2)
+
+    assert retry(function, retry=3, retry_policy=policy) == 'result'
+    assert function.calls == 4
+    assert len(delays) == 3
+    for counter, delay in enumerate(delays):
+        assert 0 <= delay <= 2 * 2 ** counter
+
+    metrics = policy.get_metrics()
+    assert metrics['requests'] == 4
+    assert metrics['failures'] == 3
+    assert metrics['retries'] == 3
+    assert metrics['circuit'] == 'closed'
+
+
+def test_retry_budget():
+    flexmock(time).should_receive('sleep')
+    policy = RetryPolicy(min_retries=1, retry_ratio=0)
+
+    with pytest.raises(APIError):
+        retry(FailingCall(500, 500, 500), retry=3, retry_policy=policy)
+    metrics = policy.get_metrics()
+    assert metrics['requests'] == 2
+    assert metrics['retries'] == 1
+    assert metrics['retries_denied'] == 1
+
+
+def test_retry_not_retried_status():
+    policy = RetryPolicy()
+    function = FailingCall(404)
+    with pytest.raises(APIError):
+        retry(function, retry=3, retry_policy=policy)
+    assert function.calls == 1
+    assert policy.get_metrics()['failures'] == 0
+
+
+def test_circuit_breaker():
+    flexmock(time).should_receive('sleep')
+    now = [1000.0]
+    flexmock(time).should_receive('time').replace_with(lambda: now[0])
+    policy = RetryPolicy(failure_threshold=2, reset_timeout=30)
+
+    with pytest.raises(APIError):
+        retry(FailingCall(500, 500, 500), retry=1, retry_policy=policy)
+
+    # circuit is open, requests are not sent
+    function = FailingCall()
+    with pytest.raises(DockerUnavailableException):
+        retry(function, retry=1, retry_policy=policy)
+    assert function.calls == 0
+
+    # request which fails after reset timeout opens circuit again
+    def timeout():
+        raise requests.exceptions.ReadTimeout()
+
+    now[0] += 31
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        retry(timeout, retry_policy=policy)
+    with pytest.raises(DockerUnavailableException):
+        retry(function, retry_policy=policy)
+
+    # successful request closes circuit
+    now[0] += 31
+    assert retry(function, retry_policy=policy) == 'result'
+    assert retry(function, retry_policy=policy) == 'result'
+
+    metrics = policy.get_metrics()
+    assert metrics['rejected'] == 2
+    assert metrics['circuit_opened'] == 1
+    assert metrics['circuit'] == 'closed'
+
+
+def test_retry_policy_shared(docker_tasker):  # noqa
+    assert DockerTasker().d.retry_policy is docker_tasker.d.retry_policy
+    assert docker_tasker.d.retry_policy.get_metrics() in get_retry_metrics().values()
+
+
+@pytest.mark.parametrize('change_images', [
+    lambda t: t.tag_image(input_image_name, ImageName.parse('new-image:latest')),
+    lambda t: t.remove_image(input_image_name),
+    lambda t: t.pull_image(input_image_name),
+    lambda t: list(t.build_image_from_path('/', ImageName.parse('new-image:latest'))),
+    lambda t: t.invalidate_image_cache(),
+])
+def test_inspect_image_cache(change_images):
+    mock_docker()
+    t = DockerTasker()
+    inspected = []
+
+    def inspect_image(image_id):
+        inspected.append(image_id)
+        return {'Id': 'sha256:1234', 'RepoTags': [input_image_name.to_str()]}
+
+    flexmock(t.d.wrapped, inspect_image=inspect_image)
+
+    metadata = t.inspect_image(input_image_name)
+    assert metadata['Id'] == 'sha256:1234'
+    # returned metadata may be modified by caller
+    metadata['Id'] = 'modified'
+    assert t.inspect_image(input_image_name.to_str())['Id'] == 'sha256:1234'
+    assert t.inspect_image('sha256:1234')['Id'] == 'sha256:1234'
+    assert t.image_exists(input_image_name)
+    assert inspected == [input_image_name.to_str()]
+
+    change_images(t)
+    t.inspect_image(input_image_name)
+    assert inspected == [input_image_name.to_str()] * 2
+
+
+def test_images_index():
+    mock_docker()
+    t = DockerTasker()
+    images = [
+        {'Id': 'sha256:1', 'RepoTags': ['registry.example.com/fedora:25',
+                                       'registry.example.com/fedora:latest']},
+        {'Id': 'sha256:2', 'RepoTags': ['registry.example.com/fedora:24']},
+        {'Id': 'sha256:3', 'RepoTags': None},
+        {'Id': 'sha256:4', 'RepoTags': ['<none>:<none>']},
+    ]
+    flexmock(t.d.wrapped).should_receive('images').and_return(images).once()
+
+    assert t.get_image_info_by_image_id('sha256:3') == images[2]
+    assert t.get_image_info_by_image_id('sha256:5') is None
+    fedora = ImageName.parse('registry.example.com/fedora:24')
+    assert t.get_image_info_by_image_name(fedora) == [images[1]]
+    assert t.get_image_info_by_image_name(fedora, exact_tag=False) == images[:2]
+    assert t.get_image_info_by_image_name(ImageName.parse('fedora:24')) == []
+
+
+def test_image_cache_invalidated_during_call():
+    mock_docker()
+    t = DockerTasker()
+    calls = {'images': 0, 'inspect_image': 0}
+    listing = threading.Event()
+    invalidated = threading.Event()
+
+    def slow_call(name, result):
+        def call(*args, **kwargs):
+            calls[name] += 1
+            if calls[name] == 1:
+                # image is tagged while docker answers with stale data
+                listing.set()
+                assert invalidated.wait(5)
+            return result
+        return call
+
+    flexmock(t.d.wrapped, images=slow_call('images', [{'Id': 'sha256:1', 'RepoTags': None}]),
+             inspect_image=slow_call('inspect_image', {'Id': 'sha256:1'}))
+    for get_metadata in (lambda: t.get_image_info_by_image_id('sha256:1'),
+                         lambda: t.inspect_image('sha256:1')):
+        listing.clear()
+        invalidated.clear()
+        thread = threading.Thread(target=get_metadata)
+        thread.start()
+        assert listing.wait(5)
+        t.tag_image(input_image_name, ImageName.parse('new-image:latest'))
+        invalidated.set()
+        thread.join(5)
+
+    # metadata fetched before invalidation were not cached
+    assert t.get_image_info_by_image_id('sha256:1') == {'Id': 'sha256:1', 'RepoTags': None}
+    assert t.inspect_image('sha256:1') == {'Id': 'sha256:1'}
+    assert calls == {'images': 2, 'inspect_image': 2}
+    # but those fetched after are
+    t.get_image_info_by_image_id('sha256:1')
+    t.inspect_image('sha256:1')
+    assert calls == {'images': 2, 'inspect_image': 2}
+
+
+def test_async_tasker():
+    mock_docker()
+    t = DockerTasker()
+    started = []
+    release = threading.Event()
+
+    def remove_image(image_id, force=False, noprune=False):
+        started.append(image_id)
+        # both removals have to run at once to finish
+        if len(started) == 2:
+            release.set()
+        assert release.wait(5)
+
+    flexmock(t, remove_image=remove_image)
+    flexmock(t, wait=lambda container_id: 0)
+
+    with AsyncDockerTasker(t, max_workers=2) as async_tasker:
+        futures = [async_tasker.remove_image(image) for image in ['image1', 'image2']]
+        assert [future.result() for future in futures] == [None, None]
+        assert async_tasker.wait('container').result() == 0
+    assert sorted(started) == ['image1', 'image2']
+
+
+@pytest.mark.parametrize('error', [None, RuntimeError('connection lost')])
+def test_async_tasker_stream(error):
+    mock_docker()
+    t = DockerTasker()
+
+    def logs(container_id, stderr=True, stream=True):
+        assert stream
+        yield b'line 1'
+        yield b'line 2'
+        if error:
+            raise error
+
+    flexmock(t, logs=logs)
+    with AsyncDockerTasker(t) as async_tasker:
+        lines = async_tasker.logs('container')
+        assert next(lines) == b'line 1'
+        assert next(lines) == b'line 2'
+        if error:
+            with pytest.raises(RuntimeError):
+                next(lines)
+        else:
+            assert list(lines) == []
+
+
+def test_async_tasker_stream_bounded():
+    mock_docker()
+    t = DockerTasker()
+    produced = []
+
+    def logs(container_id, stderr=True, stream=True):
+        for index in range(100):
+            produced.append(index)
+            yield index
+
+    flexmock(t, logs=logs)
+    with AsyncDockerTasker(t, max_queued=2) as async_tasker:
+        lines = async_tasker.logs('container')
+        assert next(lines) == 0
+        time.sleep(0.3)
+        # reading waits for the consumer
+        assert len(produced) <= 4
+        lines.close()
+    # reading stopped once the iterator was closed
+    assert len(produced) < 100
+
+
+def test_shared_docker_client(new_docker_clients):
+    mock_docker()
+    flexmock(docker).should_call('APIClient').twice()
+
+    t1 = DockerTasker()
+    t2 = DockerTasker()
+    assert t1.d.wrapped is t2.d.wrapped
+    # different arguments, different client
+    assert DockerTasker(timeout=60).d.wrapped is not t1.d.wrapped
+
+
+@pytest.mark.parametrize('api_version', ['1.26', None])
+def test_shared_docker_client_version(new_docker_clients, api_version):
+    kwargs = []
+
+    def client(**client_kwargs):
+        kwargs.append(client_kwargs)
+        return flexmock(api_version=api_version)
+
+    flexmock(docker).should_receive('APIClient').replace_with(client)
+    # bypass DockerTasker to request version negotiation regardless of docker-py version
+    get_docker_client(base_url='unix://docker.sock', timeout=120, version='auto')
+    get_docker_client(base_url='unix://docker.sock', timeout=120, version='auto')
+    get_docker_client(base_url='unix://docker.sock', timeout=60, version='auto')
+
+    # negotiated version is reused by other clients of the same daemon
+    assert [client_kwargs['version'] for client_kwargs in kwargs] == \
+        ['auto', api_version or 'auto']
@@ -0,0 +1,138 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import json
+import threading
+
+import pytest
+
+from atomic_reactor.tracing import (Tracer, add_span, get_tracer, set_tracer, span,
+                                    trace_call)
+
+
+@pytest.fixture
+def tracer():
+    tracer = Tracer()
+    set_tracer(tracer)
+    yield tracer
+    set_tracer(None)
+
+
+def get_spans(tracer):
+    return [event for event in tracer.get_trace()['traceEvents']
+            if event['ph'] == 'X']
+
+
+def test_nested_spans(tracer):
+    with span('outer', 'phase', arg='value'):
+        with span('inner', 'plugin'):
+            pass
+
+    inner, outer = get_spans(tracer)
+    assert inner['name'] == 'inner'
+    assert inner['cat'] == 'plugin'
+    assert outer['name'] == 'outer'
+    assert outer['args'] == {'arg': 'value'}
+    assert outer['ts'] <= inner['ts']
+    assert inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+
+
+def test_span_error(tracer):
+    with pytest.raises(RuntimeError):
+        with span('failing', 'plugin'):
+            raise RuntimeError('failed')
+
+    event, = get_spans(tracer)
+    assert 'failed' in event['args']['error']
+
+
+def test_threads(tracer):
+    def run():
+        with span('thread', 'plugin'):
+            pass
+
+    thread = threading.Thread(target=run, name='worker')
+    thread.start()
+    thread.join()
+    with span('main', 'plugin'):
+        pass
+
+    events = tracer.get_trace()['traceEvents']
+    thread_names = dict((event['tid'], event['args']['name']) for event in events
+                        if event['ph'] == 'M')
+    assert sorted(thread_names.values()) == sorted(['worker',
+                                                    threading.current_thread().name])
+    for event in get_spans(tracer):
+        assert event['tid'] in thread_names
+
+
+def test_no_tracer():
+    assert get_tracer() is None
+    with span('ignored', 'plugin'):
+        pass
+    add_span('ignored', 'http', 0, 1)
+
+
+def test_write(tracer, tmpdir):
+    add_span('GET http://example.com/', 'http', 1.5, 0.25, {'status': 200})
+    path = str(tmpdir.join('trace.json'))
+    tracer.write(path)
+
+    with open(path) as trace_file:
+        trace = json.load(trace_file)
+    event, = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+    assert event['ts'] == 1500000
+    assert event['dur'] == 250000
+    assert event['args'] == {'status': 200}
+
+
+def test_trace_call(tracer):
+    def inspect(image):
+        if image is None:
+            raise RuntimeError('no image')
+        return {'Id': image}
+
+    assert trace_call('inspect', 'docker', inspect, 'image') == {'Id': 'image'}
+    with pytest.raises(RuntimeError):
+        trace_call('inspect', 'docker', inspect, None)
+    succeeded, failed = get_spans(tracer)
+    assert succeeded['name'] == 'inspect'
+    assert 'error' in failed['args']
+
+
+def test_trace_call_iterator(tracer):
+    def pull():
+        yield 'first'
+        yield 'second'
+
+    stream = trace_call('pull', 'docker', pull)
+    assert next(stream) == 'first'
+    # span ends when the stream is exhausted
+    assert get_spans(tracer) == []
+    assert list(stream) == ['second']
+    event, = get_spans(tracer)
+    assert event['name'] == 'pull'
+
+
+def test_trace_call_file(tracer):
+    with trace_call('get_image', 'docker', io.BytesIO, b'image') as stream:
+        assert stream.read(2) == b'im'
+        assert get_spans(tracer) == []
+        assert stream.read() == b'age'
+        assert stream.read() == b''
+        assert len(get_spans(tracer)) == 1
+    # closing doesn't add another span
+    assert len(get_spans(tracer)) == 1
+
+
+def test_trace_call_not_traced():
+    stream = io.BytesIO(b'image')
+    assert trace_call('get_image', 'docker', lambda: stream) is stream
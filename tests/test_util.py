@@ -8,9 +8,14 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import errno
+import hashlib
 import json
 import os
+import pickle
+import resource
 import tempfile
+import threading
 import pytest
 import requests
 import responses
@@ -29,15 +34,18 @@ from atomic_reactor.util import (ImageName, wait_for_command, clone_git_repo,
                                  render_yum_repo, process_substitutions,
                                  get_checksums, print_version_of_tools,
                                  get_version_of_tools, get_preferred_label_key,
-                                 human_size, CommandResult,
-                                 get_manifest_digests, ManifestDigest,
+                                 human_size, CommandResult, LogFile, ChecksumFile,
+                                 copy_file, ChecksumsCache, set_checksums_cache,
+                                 cache_checksums,
+                                 get_manifest_digests, ManifestDigest, put_manifest,
                                  get_build_json, is_scratch_build, df_parser,
                                  are_plugins_in_order, LabelFormatter,
                                  get_manifest_media_type,
-                                 get_retrying_requests_session)
+                                 get_retrying_requests_session,
+                                 ResourceProfiler, count_call, propagate_call_counts)
 from atomic_reactor import util
 from tests.constants import DOCKERFILE_GIT, INPUT_IMAGE, MOCK, DOCKERFILE_SHA1, MOCK_SOURCE
-from atomic_reactor.constants import INSPECT_CONFIG
+from atomic_reactor.constants import COMMAND_RESULT_MAX_LINES, INSPECT_CONFIG
 
 from tests.util import requires_internet
 
@@ -131,6 +139,52 @@ class TestCommandResult(object):
         cr.parse_item(item)
         assert cr.logs == [expected]
 
+    def test_recent_lines(self):
+        cr = CommandResult(max_lines=2)
+        for line in ['line 1', 'line 2\nline 3']:
+            cr.parse_item({'stream': line})
+        cr.parse_item({'error': 'failed', 'errorDetail': {'message': 'failed'}})
+
+        assert cr.logs == ['line 2', 'line 3']
+        assert cr.recent_logs == ['line 2', 'line 3']
+        assert cr.parsed_logs == [{'stream': 'line 2\nline 3'},
+                                  {'error': 'failed', 'errorDetail': {'message': 'failed'}}]
+        assert cr.is_failed()
+        assert cr.error == 'failed'
+
+    def test_all_lines_without_log_file(self):
+        cr = CommandResult()
+        items = [{'stream': 'line %d' % n} for n in range(COMMAND_RESULT_MAX_LINES + 1)]
+        for item in items:
+            cr.parse_item(item)
+
+        assert cr.parsed_logs == items
+        assert len(cr.logs) == len(items)
+
+    def test_log_file(self, tmpdir):
+        path = str(tmpdir.join('build.log'))
+        logs_gen = ({'stream': 'line %d\n' % n} for n in range(10))
+        cr = wait_for_command(logs_gen, log_file=path)
+
+        assert isinstance(cr.logs, LogFile)
+        assert len(cr.logs) == 10
+        assert list(cr.logs) == ['line %d' % n for n in range(10)]
+        # logs can be read repeatedly
+        assert list(cr.logs) == list(cr.logs)
+        with open(path) as log_file:
+            assert log_file.read() == ''.join('line %d\n' % n for n in range(10))
+        assert not cr.is_failed()
+
+
+def test_log_file_pickle(tmpdir):
+    log = LogFile(str(tmpdir.join('build.log')))
+    log.write('\u2018 unicode \u2019')
+
+    restored = pickle.loads(pickle.dumps(log, protocol=2))
+    log.close()
+    assert list(restored) == ['\u2018 unicode \u2019']
+    assert len(restored) == 1
+
 
 @requires_internet
 def test_clone_git_repo_by_sha1(tmpdir):
@@ -227,6 +281,123 @@ def test_get_hexdigests(tmpdir, content, algorithms, expected):
         assert checksums == expected
 
 
+@pytest.mark.parametrize('size', [0, 100, 3 * 1024**2 + 1])
+def test_get_checksums_blocks(tmpdir, size):
+    content = os.urandom(size)
+    path = tmpdir.join('file')
+    path.write(content, mode='wb')
+    algorithms = ['md5', 'sha1', 'sha256']
+
+    checksums = get_checksums(str(path), algorithms)
+    assert checksums == dict(('%ssum' % algorithm, hashlib.new(algorithm, content).hexdigest())
+                             for algorithm in algorithms)
+
+
+@pytest.fixture
+def checksums_cache():
+    cache = ChecksumsCache()
+    set_checksums_cache(cache)
+    yield cache
+    set_checksums_cache(None)
+
+
+def test_get_checksums_cached(tmpdir, checksums_cache):
+    path = tmpdir.join('file')
+    path.write(b'abc', mode='wb')
+    computed = []
+    compute_checksums = util._compute_checksums
+
+    def count_compute(path, algorithms):
+        computed.append(algorithms)
+        return compute_checksums(path, algorithms)
+
+    flexmock(util, _compute_checksums=count_compute)
+
+    md5sum = {'md5sum': '900150983cd24fb0d6963f7d28e17f72'}
+    sha256sum = {'sha256sum': 'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad'}
+    assert get_checksums(str(path), ['md5']) == md5sum
+    assert get_checksums(str(path), ['md5']) == md5sum
+    both = dict(md5sum, **sha256sum)
+    assert get_checksums(str(path), ['md5', 'sha256']) == both
+    assert get_checksums(str(path), ['sha256', 'md5']) == both
+    assert computed == [['md5'], ['sha256']]
+
+    # modified file is read again
+    path.write(b'abcd', mode='wb')
+    os.utime(str(path), (1000000000, 1000000000))
+    assert get_checksums(str(path), ['md5']) != md5sum
+    assert computed[-1] == ['md5']
+
+    # checksums computed while writing file
+    other = tmpdir.join('other')
+    other.write(b'abc', mode='wb')
+    cache_checksums(str(other), sha256sum)
+    assert get_checksums(str(other), ['sha256']) == sha256sum
+    assert len(computed) == 3
+
+
+@pytest.mark.parametrize('content, algorithms, expected', [
+    (b'abc', ['md5', 'sha256'],
+     {'md5sum': '900150983cd24fb0d6963f7d28e17f72',
+      'sha256sum': 'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad'}),
+    (b'abc', ['md5'], {'md5sum': '900150983cd24fb0d6963f7d28e17f72'}),
+    (b'abc', [], {})
+])
+def test_checksum_file(content, algorithms, expected):
+    output = six.BytesIO()
+    written = ChecksumFile(output, algorithms)
+    written.write(content[:1])
+    written.write(content[1:])
+    assert written.get_checksums() == expected
+    assert written.size == len(content)
+    assert output.getvalue() == content
+
+    read = ChecksumFile(six.BytesIO(content), algorithms)
+    assert read.read(1) + read.read() == content
+    assert read.read() == b''
+    assert read.get_checksums() == expected
+    assert read.size == len(content)
+
+
+@pytest.mark.parametrize('size', [0, 1, 10 * 1024 + 1])
+@pytest.mark.parametrize('workers', [1, 4])
+@pytest.mark.parametrize('kernel_copy', ['copy_file_range', 'sendfile', None])
+def test_copy_file(tmpdir, monkeypatch, size, workers, kernel_copy):
+    for name in ['copy_file_range', 'sendfile']:
+        if name != kernel_copy:
+            monkeypatch.delattr(os, name, raising=False)
+    if kernel_copy and not hasattr(os, kernel_copy):
+        pytest.skip('os.{0} not available'.format(kernel_copy))
+
+    content = os.urandom(size)
+    source = tmpdir.join('source')
+    source.write(content, mode='wb')
+    os.utime(str(source), (1000000000, 1000000000))
+    dest = str(tmpdir.join('dest'))
+
+    assert copy_file(str(source), dest, workers=workers, chunk_size=1024) == size
+    with open(dest, 'rb') as dest_file:
+        assert dest_file.read() == content
+    assert os.path.getmtime(dest) == 1000000000
+
+
+def test_copy_file_kernel_copy_unsupported(tmpdir):
+    if not hasattr(os, 'sendfile'):
+        pytest.skip('os.sendfile not available')
+    source = tmpdir.join('source')
+    source.write(b'content', mode='wb')
+    dest = str(tmpdir.join('dest'))
+
+    unsupported = OSError(errno.EINVAL, 'Invalid argument')
+    if hasattr(os, 'copy_file_range'):
+        flexmock(os).should_receive('copy_file_range').and_raise(unsupported)
+    flexmock(os).should_receive('sendfile').and_raise(unsupported)
+
+    copy_file(str(source), dest)
+    with open(dest, 'rb') as dest_file:
+        assert dest_file.read() == b'content'
+
+
 def test_get_versions_of_tools():
     response = get_version_of_tools()
     assert isinstance(response, list)
@@ -532,6 +703,25 @@ def test_get_manifest_digests_connection_error(tmpdir):
         get_manifest_digests(**kwargs)
 
 
+@responses.activate
+@pytest.mark.parametrize('insecure', [True, False])
+def test_put_manifest(insecure):
+    image = ImageName.parse('example.com/spam:new-tag')
+    url = 'https://example.com/v2/spam/manifests/new-tag'
+    if insecure:
+        responses.add(responses.PUT, url, body=ConnectionError())
+        url = 'http://example.com/v2/spam/manifests/new-tag'
+    responses.add(responses.PUT, url, status=201)
+
+    put_manifest(image, 'example.com', b'manifest', insecure=insecure)
+
+    request = responses.calls[-1].request
+    assert request.url == url
+    assert request.body == b'manifest'
+    assert request.headers['Content-Type'] == \
+        'application/vnd.docker.distribution.manifest.v2+json'
+
+
 @pytest.mark.parametrize('v1,v2,default', [
     ('v1-digest', 'v2-digest', 'v2-digest'),
     ('v1-digest', None, 'v1-digest'),
@@ -662,3 +852,76 @@ def test_label_formatter(labels, test_string, expected):
     else:
         with pytest.raises(KeyError):
             LabelFormatter().vformat(test_string, [], labels)
+
+
+def test_resource_profiler(tmpdir):
+    with ResourceProfiler() as outer:
+        count_call('docker')
+        with ResourceProfiler() as inner:
+            count_call('koji')
+            count_call('koji')
+            with open(str(tmpdir.join('file')), 'w') as f:
+                f.write('x' * 1024)
+            sum(range(100000))
+    count_call('http')
+
+    for profiler in (outer, inner):
+        assert profiler.usage['cpu_user'] >= 0
+        assert profiler.usage['cpu_system'] >= 0
+        assert profiler.usage['max_rss_increase'] >= 0
+        if 'read_bytes' in profiler.usage:
+            assert profiler.usage['write_bytes'] >= 0
+    assert inner.usage['koji_calls'] == 2
+    assert inner.usage['docker_calls'] == 0
+    assert outer.usage['koji_calls'] == 2
+    assert outer.usage['docker_calls'] == 1
+    assert outer.usage['http_calls'] == 0
+
+
+def test_resource_profiler_threads():
+    def call():
+        count_call('docker')
+
+    with ResourceProfiler() as profiler:
+        threads = [threading.Thread(target=propagate_call_counts(call)) for _ in range(10)]
+        threads.append(threading.Thread(target=call))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    # only calls from threads the context was propagated to are counted
+    assert profiler.usage['docker_calls'] == 10
+    # without active profiler, function isn't wrapped
+    assert propagate_call_counts(call) is call
+
+
+@pytest.mark.skipif(not hasattr(resource, 'RUSAGE_THREAD'),
+                    reason='CPU time is not measured per thread')
+def test_resource_profiler_threads_usage(tmpdir):
+    def work():
+        start = resource.getrusage(resource.RUSAGE_THREAD).ru_utime
+        while resource.getrusage(resource.RUSAGE_THREAD).ru_utime - start < 0.3:
+            pass
+
+    with ResourceProfiler() as outer:
+        with ResourceProfiler() as inner:
+            thread = threading.Thread(target=propagate_call_counts(work))
+            thread.start()
+            thread.join()
+        # CPU time of threads without propagated context isn't counted
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+
+    assert 0.3 <= inner.usage['cpu_user'] < 0.6
+    # usage of helper threads of nested profiled code counts in outer one
+    assert 0.3 <= outer.usage['cpu_user'] < 0.6
+
+
+@responses.activate
+def test_retrying_requests_session_counts_calls():
+    responses.add(responses.GET, 'http://example.com/', body='ok')
+    session = get_retrying_requests_session()
+    with ResourceProfiler() as profiler:
+        session.get('http://example.com/')
+    assert profiler.usage['http_calls'] == 1